@@ -44,6 +44,8 @@ if "bpy" in locals():
     imp.reload(properties)
     imp.reload(operators)
     imp.reload(export)
+    imp.reload(exportstate)
+    imp.reload(renderqueue)
     imp.reload(ui)
     imp.reload(render)
     imp.reload(util)
@@ -55,6 +57,8 @@ else:
     from . import properties
     from . import operators
     from . import export
+    from . import exportstate
+    from . import renderqueue
     from . import ui
     from . import render    # not superfluous
     from . import preferences
@@ -66,6 +70,8 @@ def register():
     properties.register()
     operators.register()
     export.register()
+    exportstate.register()
+    renderqueue.register()
     ui.register()
     preferences.register()
     bpy.utils.register_module(__name__)
@@ -75,6 +81,8 @@ def unregister():
     properties.unregister()
     operators.unregister()
     export.unregister()
+    exportstate.unregister()
+    renderqueue.unregister()
     ui.unregister()
     preferences.unregister()
     bpy.utils.unregister_module(__name__)
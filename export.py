@@ -59,7 +59,9 @@ class ExportAppleseedScene(bpy.types.Operator, ExportHelper):
     def execute(self, context):
         export_path = util.realpath(self.filepath)
         writer = projectwriter.Writer()
-        writer.write(context.scene, export_path)
+        if not writer.write(context.scene, export_path):
+            self.report({'ERROR'}, "Could not export the scene to {0}, see the console for details.".format(export_path))
+            return {'CANCELLED'}
 
         if self.compress_export:
             appleseed_bin_dir = bpy.context.user_preferences.addons['blenderseed'].preferences.appleseed_binary_directory
@@ -0,0 +1,164 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import bpy
+from bpy.app.handlers import persistent
+
+from . import materialcompiler
+
+# Datablock collections whose update flags are tracked between exports.
+TrackedCollections = ("objects", "meshes", "curves", "metaballs")
+
+# Object type -> collection of its data datablock, for objects whose geometry can be reused.
+GeometryCollections = {'MESH': "meshes", 'CURVE': "curves", 'SURFACE': "curves", 'FONT': "curves", 'META': "metaballs"}
+
+
+class ExportState(object):
+    """
+    Entities of the previous export of a scene and the datablocks updated since, so that an
+    export only tessellates the objects that changed.
+
+    geometry maps object names to the (mesh file name, content hash, mesh parts) of the geometry file
+    written for them, see projectwriter.Writer. Materials are reused by content, see materialcompiler.
+    """
+
+    def __init__(self):
+        self.geometry = {}
+        self._updated = set()
+        self._exported = False
+        self._tessellation_key = None
+
+    def record_updates(self, data):
+        """Record the tracked datablocks whose update flags are set."""
+
+        for collection_name in TrackedCollections:
+            collection = getattr(data, collection_name)
+            if collection.is_updated:
+                for datablock in collection:
+                    if datablock.is_updated or getattr(datablock, "is_updated_data", False):
+                        self._updated.add((collection_name, datablock.name))
+
+    def begin_export(self, scene):
+        """
+        Return the (collection name, datablock name) pairs updated since the previous export, or None if
+        everything must be exported, and start recording the updates happening during this export.
+        Everything is exported again when scene settings that all objects are tessellated with changed.
+        """
+
+        tessellation_key = get_tessellation_key(scene)
+        updated = self._updated if self._exported and tessellation_key == self._tessellation_key else None
+        self._updated = set()
+        self._tessellation_key = tessellation_key
+
+        # Until it finishes, the export leaves the state to be exported again entirely.
+        self._exported = False
+        return updated
+
+    def end_export(self, geometry):
+        """Keep the entities of a finished export."""
+
+        self.geometry = geometry
+        self._exported = True
+
+
+# Scene name -> export state.
+states = {}
+
+
+def get_export_state(scene):
+    if scene.name not in states:
+        states[scene.name] = ExportState()
+    return states[scene.name]
+
+
+def get_tessellation_key(scene):
+    """
+    Return the scene settings that the tessellation of all objects depends on. Changing them does not flag any object
+    as updated: meshes are tessellated at the current frame, or at shutter open when motion blur is enabled, and
+    simplified by the scene.
+    """
+
+    asr_scn = scene.appleseed
+    return (scene.frame_current,
+            scene.frame_subframe,
+            asr_scn.enable_motion_blur,
+            asr_scn.shutter_open,
+            scene.render.use_simplify,
+            scene.render.simplify_subdivision_render)
+
+
+def is_geometry_driven(object):
+    """
+    Return True if the geometry of an object may change without its update flags being set, as when it is animated,
+    has shape keys, has a parent, or has a modifier referencing another object (such as an armature).
+    """
+
+    if object.animation_data is not None or object.parent is not None:
+        return True
+    data = object.data
+    if data is not None and (getattr(data, "animation_data", None) is not None or getattr(data, "shape_keys", None) is not None):
+        return True
+    for modifier in object.modifiers:
+        for prop in modifier.bl_rna.properties:
+            if prop.type == 'POINTER' and isinstance(getattr(modifier, prop.identifier), bpy.types.Object):
+                return True
+    return False
+
+
+def is_geometry_updated(updated, object):
+    """
+    Return True if the geometry of an object may have changed since the previous export.
+    Update flags are only trusted for objects whose geometry is not driven by anything else.
+    """
+
+    if updated is None or ("objects", object.name) in updated or is_geometry_driven(object):
+        return True
+    collection_name = GeometryCollections.get(object.type)
+    return collection_name is None or (collection_name, object.data.name) in updated
+
+
+@persistent
+def record_updates(scene):
+    for state in states.values():
+        state.record_updates(bpy.data)
+
+
+@persistent
+def forget_exports(dummy):
+    states.clear()
+    materialcompiler.compiled_materials.clear()
+
+
+def register():
+    bpy.app.handlers.scene_update_post.append(record_updates)
+    bpy.app.handlers.load_post.append(forget_exports)
+
+
+def unregister():
+    bpy.app.handlers.scene_update_post.remove(record_updates)
+    bpy.app.handlers.load_post.remove(forget_exports)
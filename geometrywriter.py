@@ -26,160 +26,112 @@
 # THE SOFTWARE.
 #
 
-import bpy
-import os
+import numpy as np
+
+from . import meshdata
 from . import util
 
 
-def get_array2_key(v):
-    a = int(v[0] * 1000000)
-    b = int(v[1] * 1000000)
-    return a, b
+def get_face_materials(mesh):
+    """Return the material index of each face of a tessellated mesh."""
+
+    face_materials = np.empty(len(mesh.tessfaces), dtype=np.int32)
+    mesh.tessfaces.foreach_get("material_index", face_materials)
+    return face_materials
+
+
+def read_mesh_arrays(mesh):
+    """Read positions, normals, faces and texture coordinates of a tessellated mesh with foreach_get."""
+
+    vertex_count = len(mesh.vertices)
+    face_count = len(mesh.tessfaces)
+
+    positions = np.empty(vertex_count * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", positions)
+    positions.shape = (vertex_count, 3)
+
+    vertex_normals = np.empty(vertex_count * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("normal", vertex_normals)
+    vertex_normals.shape = (vertex_count, 3)
 
+    face_vertices = np.empty(face_count * 4, dtype=np.int32)
+    mesh.tessfaces.foreach_get("vertices_raw", face_vertices)
+    face_vertices.shape = (face_count, 4)
 
-def get_vector2_key(v):
-    w = v * 1000000
-    return int(w.x), int(w.y)
+    face_normals = np.empty(face_count * 3, dtype=np.float32)
+    mesh.tessfaces.foreach_get("normal", face_normals)
+    face_normals.shape = (face_count, 3)
 
+    face_materials = get_face_materials(mesh)
 
-def get_vector3_key(v):
-    w = v * 1000000
-    return w.x, w.y, w.z
+    face_smooth = np.empty(face_count, dtype=np.bool_)
+    mesh.tessfaces.foreach_get("use_smooth", face_smooth)
+
+    uvtex = mesh.tessface_uv_textures
+    face_uvs = None
+    if uvtex and uvtex.active is not None and face_count > 0:
+        face_uvs = np.empty((4, face_count * 2), dtype=np.float32)
+        for corner in range(4):
+            uvtex.active.data.foreach_get("uv%d" % (corner + 1), face_uvs[corner])
+        face_uvs = np.ascontiguousarray(face_uvs.reshape(4, face_count, 2).transpose(1, 0, 2))
+
+    return meshdata.MeshArrays(positions, vertex_normals, face_vertices, face_normals, face_materials, face_smooth, face_uvs)
+
+
+def extract_mesh(mesh):
+    """
+    Extract positions, normals, faces and texture coordinates of a tessellated mesh into a MeshData.
+    """
 
+    return meshdata.build_mesh_data(read_mesh_arrays(mesh))
 
-def write_mesh_to_disk(ob, scene, mesh, filepath):
-    """Write a mesh object to disk in Wavefront OBJ format."""
+
+def write_mesh_to_disk(ob, scene, mesh, filepath, mesh_format='obj'):
+    """Write a mesh object to disk in Wavefront OBJ or appleseed binary mesh format."""
 
     try:
-        with open(filepath, "w", encoding="utf8") as output_file:
-            vertices = mesh.vertices
-            faces = mesh.tessfaces
-            uvtex = mesh.tessface_uv_textures
-            uvset = uvtex.active.data if uvtex else None
-
-            # Sort faces by material.
-            sorted_faces = [(index, face) for index, face in enumerate(faces)]
-            sorted_faces.sort(key=lambda item: item[1].material_index)
-
-            # Write vertices.
-            for vertex in vertices:
-                v = vertex.co
-                output_file.write("v %.15f %.15f %.15f\n" % (v.x, v.y, v.z))
-
-            # Deduplicate and write normals.
-            normal_indices = {}
-            vertex_normal_indices = {}
-            face_normal_indices = {}
-            current_normal_index = 0
-            for face_index, face in sorted_faces:
-                if face.use_smooth:
-                    for vertex_index in face.vertices:
-                        vn = vertices[vertex_index].normal
-                        vn_key = (vn.x, vn.y, vn.z)
-                        if vn_key in normal_indices:
-                            vertex_normal_indices[vertex_index] = normal_indices[vn_key]
-                        else:
-                            output_file.write("vn %.15f %.15f %.15f\n" % (vn.x, vn.y, vn.z))
-                            normal_indices[vn_key] = current_normal_index
-                            vertex_normal_indices[vertex_index] = current_normal_index
-                            current_normal_index += 1
-                else:
-                    vn = face.normal
-                    vn_key = (vn.x, vn.y, vn.z)
-                    if vn_key in normal_indices:
-                        face_normal_indices[face_index] = normal_indices[vn_key]
-                    else:
-                        output_file.write("vn %.15f %.15f %.15f\n" % (vn.x, vn.y, vn.z))
-                        normal_indices[vn_key] = current_normal_index
-                        face_normal_indices[face_index] = current_normal_index
-                        current_normal_index += 1
-
-            # Deduplicate and write texture coordinates.
-            if uvset:
-                vt_indices = {}
-                vertex_texcoord_indices = {}
-                current_vt_index = 0
-                for face_index, face in sorted_faces:
-                    assert len(uvset[face_index].uv) == len(face.vertices)
-                    for vt_index, vt in enumerate(uvset[face_index].uv):
-                        vertex_index = face.vertices[vt_index]
-                        vt_key = get_array2_key(vt)
-                        if vt_key in vt_indices:
-                            vertex_texcoord_indices[face_index, vertex_index] = vt_indices[vt_key]
-                        else:
-                            output_file.write("vt %.15f %.15f\n" % (vt[0], vt[1]))
-                            vt_indices[vt_key] = current_vt_index
-                            vertex_texcoord_indices[face_index, vertex_index] = current_vt_index
-                            current_vt_index += 1
-
-            # Write faces.
-            mesh_parts = []
-            current_material_index = -1
-            for face_index, face in sorted_faces:
-                if current_material_index != face.material_index:
-                    current_material_index = face.material_index
-                    mesh_name = "part_%d" % current_material_index
-                    mesh_parts.append((current_material_index, mesh_name))
-                    output_file.write("o {0}\n".format(mesh_name))
-                line = "f"
-                if uvset and len(uvset[face_index].uv) > 0:
-                    if face.use_smooth:
-                        for vertex_index in face.vertices:
-                            texcoord_index = vertex_texcoord_indices[face_index, vertex_index]
-                            normal_index = vertex_normal_indices[vertex_index]
-                            line += " %d/%d/%d" % (vertex_index + 1, texcoord_index + 1, normal_index + 1)
-                    else:
-                        normal_index = face_normal_indices[face_index]
-                        for vertex_index in face.vertices:
-                            texcoord_index = vertex_texcoord_indices[face_index, vertex_index]
-                            line += " %d/%d/%d" % (vertex_index + 1, texcoord_index + 1, normal_index + 1)
-                else:
-                    if face.use_smooth:
-                        for vertex_index in face.vertices:
-                            normal_index = vertex_normal_indices[vertex_index]
-                            line += " %d//%d" % (vertex_index + 1, normal_index + 1)
-                    else:
-                        normal_index = face_normal_indices[face_index]
-                        for vertex_index in face.vertices:
-                            line += " %d//%d" % (vertex_index + 1, normal_index + 1)
-                output_file.write(line + "\n")
-
-            return mesh_parts
+        return meshdata.write_mesh_data(extract_mesh(mesh), filepath, mesh_format)
 
     except IOError:
         util.asUpdate("Failed to write to {0}.".format(filepath))
 
 
+def extract_curves(ob, scene, psys):
+    """
+    Return the number of points per hair, the (curve count, written point count, 3) array
+    of hair points and the radius of each written point of a hair particle system.
+    """
+
+    psys.set_resolution(scene, ob, 'RENDER')
+
+    steps = 2 ** psys.settings.render_step
+    num_curves = len(psys.particles) if len(psys.child_particles) == 0 else len(psys.child_particles)
+
+    # A hack for now, to keep the points at max of 4
+    num_points = min(steps, 4)
+
+    root_size = psys.settings.appleseed.root_size * psys.settings.appleseed.scaling
+    tip_size = psys.settings.appleseed.tip_size * psys.settings.appleseed.scaling
+    radius_decrement = util.calc_decrement(root_size, tip_size, steps)
+    radii = []
+    p_radius = root_size
+    for step in range(0, num_points):
+        radii.append(p_radius)
+        p_radius -= radius_decrement
+
+    points = np.empty((num_curves, num_points, 3), dtype=np.float64)
+    for p in range(0, num_curves):
+        for step in range(0, num_points):
+            points[p, step] = psys.co_hair(ob, p, step)
+
+    psys.set_resolution(scene, ob, 'PREVIEW')
+
+    return steps, points, np.array(radii, dtype=np.float64)
+
+
 def write_curves_to_disk(ob, scene, psys, filepath):
     """
     Write curves object to file.
     """
 
-    with open(filepath, "w") as output_file:
-        psys.set_resolution(scene, ob, 'RENDER')
-
-        steps = 2 ** psys.settings.render_step
-
-        # Write the number of hairs to the file
-        num_curves = len(psys.particles) if len(psys.child_particles) == 0 else len(psys.child_particles)
-        output_file.write("%d\n" % num_curves)
-
-        # Write the number of points per hair to the file
-        output_file.write("%d\n" % steps)
-
-        root_size = psys.settings.appleseed.root_size * psys.settings.appleseed.scaling
-        tip_size = psys.settings.appleseed.tip_size * psys.settings.appleseed.scaling
-        radius_decrement = util.calc_decrement(root_size, tip_size, steps)
-        for p in range(0, num_curves):
-            p_radius = root_size
-            for step in range(0, steps):
-                # A hack for now, to keep the points at max of 4
-                if step == 4:
-                    break
-                co = psys.co_hair(ob, p, step)
-                radius = p_radius
-                output_file.write("%.6f %.6f %.6f %.4f " % (co.x, co.y, co.z, radius))
-                p_radius -= radius_decrement
-            output_file.write("\n")
-
-        psys.set_resolution(scene, ob, 'PREVIEW')
+    meshdata.write_curves_data(filepath, *extract_curves(ob, scene, psys))
@@ -0,0 +1,182 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import collections
+import hashlib
+
+import bpy
+
+from . import util
+
+# Largest number of material hashes whose compiled materials are kept.
+MaxCachedMaterials = 1024
+
+# Node and socket properties that only affect the node editor.
+IgnoredNodeProperties = {"location", "width", "width_hidden", "height", "dimensions", "select",
+                         "show_options", "show_preview", "show_texture", "show_expanded"}
+
+
+def update_hash(sha, value):
+    sha.update(repr(value).encode("utf8"))
+    sha.update(b"\n")
+
+
+def get_property_value(struct, prop):
+    value = getattr(struct, prop.identifier)
+    if prop.type in {'BOOLEAN', 'INT', 'FLOAT'} and prop.array_length > 0:
+        value = tuple(value)
+    elif prop.type == 'STRING' and prop.subtype == 'FILE_PATH' and value:
+        # The XML holds resolved paths: a relative path resolves differently once the .blend file moves.
+        value = util.realpath(value)
+    return value
+
+
+def update_struct_hash(sha, struct, texture_names):
+    """
+    Hash the properties of a property group, recursively.
+    Strings naming textures are collected in texture_names.
+    """
+
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == "rna_type":
+            continue
+        if prop.type == 'COLLECTION':
+            items = getattr(struct, prop.identifier)
+            update_hash(sha, (prop.identifier, len(items)))
+            for item in items:
+                update_struct_hash(sha, item, texture_names)
+        elif prop.type == 'POINTER':
+            value = getattr(struct, prop.identifier)
+            if isinstance(value, bpy.types.ID):
+                update_hash(sha, (prop.identifier, value.name))
+            elif isinstance(value, bpy.types.PropertyGroup):
+                update_struct_hash(sha, value, texture_names)
+        else:
+            value = get_property_value(struct, prop)
+            if prop.type == 'STRING' and value in bpy.data.textures:
+                texture_names.add(value)
+            update_hash(sha, (prop.identifier, value))
+
+
+def update_node_tree_hash(sha, node_tree):
+    """Hash the nodes of a node tree, their input values and their links."""
+
+    for node in sorted(node_tree.nodes, key=lambda node: node.name):
+        update_hash(sha, (node.bl_idname, node.name))
+        for prop in node.bl_rna.properties:
+            if prop.type not in {'POINTER', 'COLLECTION'} and prop.identifier not in IgnoredNodeProperties:
+                update_hash(sha, (prop.identifier, get_property_value(node, prop)))
+        for socket in node.inputs:
+            update_hash(sha, (socket.identifier, socket.is_linked))
+            for prop in socket.bl_rna.properties:
+                if prop.type not in {'POINTER', 'COLLECTION'} and prop.identifier not in IgnoredNodeProperties:
+                    update_hash(sha, (prop.identifier, get_property_value(socket, prop)))
+
+    update_hash(sha, sorted((link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier)
+                            for link in node_tree.links))
+
+
+def get_material_hash(material, scene):
+    """
+    Return the content hash of everything the XML of a material is emitted from: its appleseed properties
+    and layers, its node tree, the textures they reference and the scene settings applying to materials.
+    File paths are hashed resolved, as they are emitted.
+    """
+
+    sha = hashlib.sha1()
+    update_hash(sha, (material.name, scene.appleseed.export_emitting_obj_as_lights, scene.appleseed.light_mats_radiance_multiplier))
+
+    asr_mat = material.appleseed
+    texture_names = set()
+    update_struct_hash(sha, asr_mat, texture_names)
+
+    node_tree = bpy.data.node_groups.get(asr_mat.node_tree) if asr_mat.node_tree else None
+    if node_tree is not None:
+        update_node_tree_hash(sha, node_tree)
+
+    for texture_name in sorted(texture_names):
+        texture = bpy.data.textures[texture_name]
+        image = getattr(texture, "image", None)
+        if image is not None:
+            update_hash(sha, (texture_name, texture.type, texture.extension, util.realpath(image.filepath), image.colorspace_settings.name))
+        else:
+            update_hash(sha, (texture_name, texture.type, texture.extension))
+
+    return sha.hexdigest()
+
+
+class CompiledMaterial(object):
+    """
+    XML emitted for a material, without indentation, with the names of its front and back materials.
+
+    Textures are only emitted once per project, so the XML depends on which of the textures looked up
+    while emitting it were already emitted: texture_lookups lists the looked up textures and whether
+    they were, and emitted_textures holds the textures the XML defines.
+    """
+
+    def __init__(self, texture_lookups, emitted_textures, content, material_names):
+        self.texture_lookups = tuple(texture_lookups)
+        self.emitted_textures = frozenset(emitted_textures)
+        self.material_names = material_names
+        self._content = {"": content}
+
+    def matches(self, textures_set):
+        """Return True if this XML is the one emitted after the textures of textures_set."""
+
+        return all((texture_key in textures_set) == emitted for (texture_key, emitted) in self.texture_lookups)
+
+    def get_content(self, indent):
+        """Return the XML indented by the string indent."""
+
+        if indent not in self._content:
+            content = self._content[""]
+            self._content[indent] = indent + content[:-1].replace("\n", "\n" + indent) + "\n" if content else content
+        return self._content[indent]
+
+
+# Material hash -> compiled materials, least recently used first.
+compiled_materials = collections.OrderedDict()
+
+
+def find_compiled_material(material_hash, textures_set):
+    """Return the compiled material for a material hash and the textures already emitted, or None."""
+
+    if material_hash not in compiled_materials:
+        return None
+    compiled_materials.move_to_end(material_hash)
+    for compiled_material in compiled_materials[material_hash]:
+        if compiled_material.matches(textures_set):
+            return compiled_material
+    return None
+
+
+def add_compiled_material(material_hash, compiled_material):
+    compiled_materials.setdefault(material_hash, []).append(compiled_material)
+    compiled_materials.move_to_end(material_hash)
+    while len(compiled_materials) > MaxCachedMaterials:
+        compiled_materials.popitem(last=False)
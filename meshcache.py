@@ -0,0 +1,84 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import json
+import os
+
+
+class MeshCache(object):
+    """
+    Manifest of the geometry files of a meshes directory.
+
+    The manifest maps each file name to the content hash of the geometry it was written from,
+    and is stored next to the files themselves. A file only needs to be written again when the
+    hash of the geometry to export differs from the one recorded in the manifest.
+    """
+
+    ManifestFileName = "manifest.json"
+
+    def __init__(self, meshes_path):
+        self._meshes_path = meshes_path
+        self._manifest_path = os.path.join(meshes_path, self.ManifestFileName)
+        self._entries = {}
+        self._modified = False
+
+        try:
+            with open(self._manifest_path, "r", encoding="utf8") as manifest_file:
+                self._entries = json.load(manifest_file)
+        except (IOError, ValueError):
+            # Missing or corrupted manifest: everything will be exported again.
+            self._entries = {}
+
+    def is_current(self, filename, content_hash):
+        """Return True if filename exists and was written from geometry with this content hash."""
+
+        return self._entries.get(filename) == content_hash and os.path.exists(os.path.join(self._meshes_path, filename))
+
+    def update(self, filename, content_hash):
+        """Record that filename was written from geometry with this content hash."""
+
+        if self._entries.get(filename) != content_hash:
+            self._entries[filename] = content_hash
+            self._modified = True
+
+    def invalidate(self, filename):
+        """Forget the content hash of filename, after it was written without computing one."""
+
+        if filename in self._entries:
+            del self._entries[filename]
+            self._modified = True
+
+    def save(self):
+        """Write the manifest back to disk if it changed."""
+
+        if not self._modified or not os.path.isdir(self._meshes_path):
+            return
+
+        with open(self._manifest_path, "w", encoding="utf8") as manifest_file:
+            json.dump(self._entries, manifest_file, indent=4, sort_keys=True)
+        self._modified = False
@@ -0,0 +1,406 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import hashlib
+import struct
+
+import numpy as np
+
+
+# Mesh file formats supported by appleseed, and their file extensions.
+mesh_file_extensions = {'obj': ".obj",
+                        'binarymesh': ".binarymesh"}
+
+
+# Index written in place of a missing normal or texture coordinate index in binary mesh files.
+BinaryMeshNoIndex = 0xFFFFFFFF
+
+
+def get_mesh_file_extension(mesh_format):
+    return mesh_file_extensions.get(mesh_format, ".obj")
+
+
+class MeshData(object):
+    """
+    Mesh arrays extracted from a Blender mesh.
+
+    Faces are sorted by material. Normals and texture coordinates are deduplicated and
+    numbered by order of first use, exactly as they are written to disk. Corners are
+    the face vertices of all faces, face after face.
+    """
+
+    def __init__(self, positions, normals, texcoords, face_sizes, face_materials, corner_vertices, corner_normals, corner_texcoords):
+        self.positions = positions                  # (vertex count, 3) float32
+        self.normals = normals                      # (normal count, 3) float32
+        self.texcoords = texcoords                  # (texcoord count, 2) float32, or None
+        self.face_sizes = face_sizes                # (face count,) int, 3 or 4
+        self.face_materials = face_materials        # (face count,) int, sorted
+        self.corner_vertices = corner_vertices      # (corner count,) int
+        self.corner_normals = corner_normals        # (corner count,) int
+        self.corner_texcoords = corner_texcoords    # (corner count,) int, or None
+
+
+def get_row_keys(rows):
+    """Return one opaque, hashable and sortable key per row of a 2D array."""
+
+    rows = np.ascontiguousarray(rows)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+
+
+def unique_in_order(keys):
+    """
+    Deduplicate keys, numbering unique keys by order of first occurrence.
+    Return the index of the first occurrence of each unique key, and the unique key index of each key.
+    """
+
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='mergesort')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order], rank[inverse.ravel()]
+
+
+class MeshArrays(object):
+    """
+    Raw arrays read from a tessellated Blender mesh, in Blender's face order.
+    Reading them is the only part of geometry export that needs access to Blender data.
+    """
+
+    def __init__(self, positions, vertex_normals, face_vertices, face_normals, face_materials, face_smooth, face_uvs):
+        self.positions = positions                  # (vertex count, 3) float32
+        self.vertex_normals = vertex_normals        # (vertex count, 3) float32
+        self.face_vertices = face_vertices          # (face count, 4) int32, zero fourth index for triangles
+        self.face_normals = face_normals            # (face count, 3) float32
+        self.face_materials = face_materials        # (face count,) int32
+        self.face_smooth = face_smooth              # (face count,) bool
+        self.face_uvs = face_uvs                    # (face count, 4, 2) float32, or None
+
+
+def sort_mesh_faces(mesh_arrays):
+    """
+    Sort the faces of raw mesh arrays by material, keeping the original order within each material.
+    Return the face order, the sorted face sizes and materials, the mask of used face corners
+    and the vertex and original face of each corner.
+    """
+
+    face_vertices = mesh_arrays.face_vertices
+
+    # Triangles are stored with a zero fourth vertex index.
+    face_sizes = np.where(face_vertices[:, 3] != 0, 4, 3)
+
+    face_order = np.argsort(mesh_arrays.face_materials, kind='mergesort')
+    face_sizes = face_sizes[face_order]
+    face_materials = mesh_arrays.face_materials[face_order]
+    corner_mask = np.arange(4) < face_sizes[:, np.newaxis]
+    corner_vertices = face_vertices[face_order][corner_mask]
+    corner_faces = np.repeat(face_order, face_sizes)
+
+    return face_order, face_sizes, face_materials, corner_mask, corner_vertices, corner_faces
+
+
+def get_corner_normal_values(mesh_arrays, corner_vertices, corner_faces):
+    """Return the normal of each face corner: smooth faces use vertex normals, flat faces use the face normal."""
+
+    corner_smooth = mesh_arrays.face_smooth[corner_faces]
+    return np.where(corner_smooth[:, np.newaxis],
+                    mesh_arrays.vertex_normals[corner_vertices],
+                    mesh_arrays.face_normals[corner_faces])
+
+
+def build_mesh_data(mesh_arrays):
+    """
+    Sort the faces of raw mesh arrays by material and deduplicate normals and texture coordinates.
+    This only works on arrays and can run on any thread.
+    """
+
+    face_order, face_sizes, face_materials, corner_mask, corner_vertices, corner_faces = sort_mesh_faces(mesh_arrays)
+
+    # Deduplicate normals.
+    corner_normal_values = get_corner_normal_values(mesh_arrays, corner_vertices, corner_faces)
+    # Adding zero maps -0.0 to 0.0 so that they compare equal, as they do in Python.
+    first, corner_normals = unique_in_order(get_row_keys(corner_normal_values + np.float32(0.0)))
+    normals = corner_normal_values[first]
+
+    # Deduplicate texture coordinates, quantized to millionths.
+    texcoords = None
+    corner_texcoords = None
+    if mesh_arrays.face_uvs is not None:
+        corner_texcoord_values = mesh_arrays.face_uvs[face_order][corner_mask]
+        texcoord_keys = np.trunc(corner_texcoord_values.astype(np.float64) * 1000000).astype(np.int64)
+        first, corner_texcoords = unique_in_order(get_row_keys(texcoord_keys))
+        texcoords = corner_texcoord_values[first]
+
+    return MeshData(mesh_arrays.positions, normals, texcoords, face_sizes, face_materials, corner_vertices, corner_normals, corner_texcoords)
+
+
+def build_mesh_pose(mesh_arrays, base_mesh_data):
+    """
+    Build the mesh data of a deformation motion blur sample with the same topology as the mesh at shutter open.
+
+    appleseed requires all the motion samples of a mesh to have the same vertex and normal counts and face
+    indices, so the sample is laid out exactly as base_mesh_data, the mesh data at shutter open: it uses the
+    positions of the sample, and the normal indices and texture coordinates at shutter open. Each normal is the
+    average of the sample normals of the corners sharing it at shutter open.
+    """
+
+    face_order, face_sizes, face_materials, corner_mask, corner_vertices, corner_faces = sort_mesh_faces(mesh_arrays)
+
+    corner_normal_values = get_corner_normal_values(mesh_arrays, corner_vertices, corner_faces)
+    normal_sums = np.zeros(base_mesh_data.normals.shape, dtype=np.float64)
+    np.add.at(normal_sums, base_mesh_data.corner_normals, corner_normal_values)
+    lengths = np.linalg.norm(normal_sums, axis=1)[:, np.newaxis]
+    # Keep the normal at shutter open where the sample normals cancel out.
+    normals = np.where(lengths > 0.0, normal_sums / np.maximum(lengths, 1.0e-30), base_mesh_data.normals).astype(np.float32)
+
+    return MeshData(mesh_arrays.positions, normals, base_mesh_data.texcoords, base_mesh_data.face_sizes, base_mesh_data.face_materials,
+                    base_mesh_data.corner_vertices, base_mesh_data.corner_normals, base_mesh_data.corner_texcoords)
+
+
+def is_same_mesh_topology(mesh_arrays, other_mesh_arrays):
+    """Return True if two mesh arrays have the same vertex count, faces and face materials."""
+
+    return (len(mesh_arrays.positions) == len(other_mesh_arrays.positions) and
+            np.array_equal(mesh_arrays.face_vertices, other_mesh_arrays.face_vertices) and
+            np.array_equal(mesh_arrays.face_materials, other_mesh_arrays.face_materials))
+
+
+def is_same_mesh_pose(mesh_arrays, other_mesh_arrays):
+    """Return True if two mesh arrays have the same topology and bit-for-bit identical positions."""
+
+    return (is_same_mesh_topology(mesh_arrays, other_mesh_arrays) and
+            mesh_arrays.positions.tobytes() == other_mesh_arrays.positions.tobytes())
+
+
+def write_mesh_arrays(mesh_arrays, filepath, mesh_format='obj'):
+    """Build mesh data from raw mesh arrays, write it to disk and return its mesh parts."""
+
+    return write_mesh_data(build_mesh_data(mesh_arrays), filepath, mesh_format)
+
+
+def write_mesh_pose(mesh_arrays, base_mesh_data, filepath, mesh_format='obj'):
+    """Write a deformation motion blur sample laid out as the mesh data at shutter open to disk and return its mesh parts."""
+
+    return write_mesh_data(build_mesh_pose(mesh_arrays, base_mesh_data), filepath, mesh_format)
+
+
+def write_mesh_data(mesh_data, filepath, mesh_format='obj'):
+    """Write extracted mesh data to disk and return its mesh parts."""
+
+    if mesh_format == 'binarymesh':
+        return write_binarymesh_file(filepath, mesh_data)
+    else:
+        return write_obj_file(filepath, mesh_data)
+
+
+def get_mesh_parts(face_materials):
+    """
+    Return the list of (material index, mesh name) pairs of a mesh whose faces are sorted by material.
+    """
+
+    return [(int(material_index), "part_%d" % material_index) for material_index in np.unique(face_materials)]
+
+
+def get_part_ranges(face_materials):
+    """Return the (first face, end face) range of each mesh part of a mesh whose faces are sorted by material."""
+
+    boundaries = np.flatnonzero(np.diff(face_materials)) + 1
+    starts = [0] + boundaries.tolist()
+    ends = boundaries.tolist() + [len(face_materials)]
+    return list(zip(starts, ends)) if len(face_materials) > 0 else []
+
+
+# Number of lines formatted at once when writing text mesh files.
+LinesPerChunk = 65536
+
+
+def write_lines(output_file, line_format, rows):
+    """Write one formatted line per row of a 2D array."""
+
+    for start in range(0, len(rows), LinesPerChunk):
+        chunk = rows[start:start + LinesPerChunk]
+        output_file.write((line_format * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
+def write_obj_file(filepath, mesh_data):
+    """Write mesh data to disk in Wavefront OBJ format."""
+
+    with open(filepath, "w", encoding="utf8") as output_file:
+        # Write vertices, normals and texture coordinates.
+        write_lines(output_file, "v %.15f %.15f %.15f\n", mesh_data.positions)
+        write_lines(output_file, "vn %.15f %.15f %.15f\n", mesh_data.normals)
+        if mesh_data.texcoords is not None:
+            write_lines(output_file, "vt %.15f %.15f\n", mesh_data.texcoords)
+
+        # Build one-based face vertex indices.
+        if mesh_data.corner_texcoords is not None:
+            corner_format = " %d/%d/%d"
+            corner_indices = np.column_stack((mesh_data.corner_vertices, mesh_data.corner_texcoords, mesh_data.corner_normals)) + 1
+        else:
+            corner_format = " %d//%d"
+            corner_indices = np.column_stack((mesh_data.corner_vertices, mesh_data.corner_normals)) + 1
+        face_formats = np.array(["f" + corner_format * 3 + "\n", "f" + corner_format * 4 + "\n"])
+        face_corner_starts = np.concatenate(([0], np.cumsum(mesh_data.face_sizes)))
+
+        # Write faces.
+        for first_face, end_face in get_part_ranges(mesh_data.face_materials):
+            output_file.write("o part_%d\n" % mesh_data.face_materials[first_face])
+            for start in range(first_face, end_face, LinesPerChunk):
+                end = min(start + LinesPerChunk, end_face)
+                line_format = "".join(face_formats[mesh_data.face_sizes[start:end] - 3].tolist())
+                rows = corner_indices[face_corner_starts[start]:face_corner_starts[end]]
+                output_file.write(line_format % tuple(rows.ravel().tolist()))
+
+    return get_mesh_parts(mesh_data.face_materials)
+
+
+def write_binarymesh_file(filepath, mesh_data):
+    """
+    Write mesh data to disk in appleseed's binary mesh format (uncompressed, version 1).
+    Each material becomes a separate mesh with its own vertex, normal and texture coordinate
+    arrays, as the format does not share them across meshes.
+    """
+
+    face_corner_starts = np.concatenate(([0], np.cumsum(mesh_data.face_sizes)))
+
+    with open(filepath, "wb") as output_file:
+        output_file.write(b"BINARYMESH")
+        output_file.write(struct.pack("<H", 1))
+
+        for first_face, end_face in get_part_ranges(mesh_data.face_materials):
+            first_corner = face_corner_starts[first_face]
+            end_corner = face_corner_starts[end_face]
+            face_sizes = mesh_data.face_sizes[first_face:end_face]
+
+            # Remap global indices to indices local to this mesh part.
+            part_vertices, corner_vertices = unique_in_order(mesh_data.corner_vertices[first_corner:end_corner])
+            part_normals, corner_normals = unique_in_order(mesh_data.corner_normals[first_corner:end_corner])
+            normals = mesh_data.normals[mesh_data.corner_normals[first_corner:end_corner][part_normals]]
+            if mesh_data.corner_texcoords is not None:
+                part_texcoords, corner_texcoords = unique_in_order(mesh_data.corner_texcoords[first_corner:end_corner])
+                texcoords = mesh_data.texcoords[mesh_data.corner_texcoords[first_corner:end_corner][part_texcoords]]
+            else:
+                corner_texcoords = np.full(end_corner - first_corner, BinaryMeshNoIndex, dtype=np.int64)
+                texcoords = np.empty((0, 2), dtype=np.float32)
+            positions = mesh_data.positions[mesh_data.corner_vertices[first_corner:end_corner][part_vertices]]
+
+            # Mesh name.
+            name = ("part_%d" % mesh_data.face_materials[first_face]).encode("utf-8")
+            output_file.write(struct.pack("<H", len(name)))
+            output_file.write(name)
+
+            # Vertices, normals and texture coordinates, stored as doubles.
+            for values in (positions, normals, texcoords):
+                output_file.write(struct.pack("<I", len(values)))
+                output_file.write(values.astype("<f8").tobytes())
+
+            # No material slots: materials are assigned per mesh part.
+            output_file.write(struct.pack("<H", 0))
+
+            # Faces: a uint16 vertex count, (vertex, normal, texture coordinate) uint32 triplets
+            # and a uint16 material index, assembled as a stream of uint16 words.
+            corner_words = np.column_stack((corner_vertices, corner_normals, corner_texcoords)).astype("<u4").view("<u2")
+            face_word_starts = np.concatenate(([0], np.cumsum(face_sizes * 6 + 2)))
+            words = np.zeros(face_word_starts[-1], dtype="<u2")
+            words[face_word_starts[:-1]] = face_sizes
+            corner_in_face = np.arange(len(corner_words)) - np.repeat(face_corner_starts[first_face:end_face] - first_corner, face_sizes)
+            corner_word_starts = np.repeat(face_word_starts[:-1] + 1, face_sizes) + corner_in_face * 6
+            words[corner_word_starts[:, np.newaxis] + np.arange(6)] = corner_words
+            output_file.write(struct.pack("<I", len(face_sizes)))
+            output_file.write(words.tobytes())
+
+    return get_mesh_parts(mesh_data.face_materials)
+
+
+def get_mesh_arrays_hash(mesh_arrays, mesh_format):
+    """
+    Return a hash of everything written to disk for a mesh: positions, topology,
+    normals, texture coordinates, material indices and the file format.
+    """
+
+    return get_arrays_hash(mesh_format,
+                           mesh_arrays.positions,
+                           mesh_arrays.vertex_normals,
+                           mesh_arrays.face_vertices,
+                           mesh_arrays.face_normals,
+                           mesh_arrays.face_materials,
+                           mesh_arrays.face_smooth,
+                           mesh_arrays.face_uvs)
+
+
+def get_mesh_pose_hash(mesh_arrays, base_content_hash):
+    """
+    Return a hash of everything written to disk for a deformation motion blur sample: the mesh arrays of the
+    sample, and base_content_hash, the hash of the mesh at shutter open that the sample is laid out as.
+    """
+
+    return get_arrays_hash("pose-" + base_content_hash,
+                           mesh_arrays.positions,
+                           mesh_arrays.vertex_normals,
+                           mesh_arrays.face_vertices,
+                           mesh_arrays.face_normals,
+                           mesh_arrays.face_materials,
+                           mesh_arrays.face_smooth)
+
+
+def get_arrays_hash(tag, *arrays):
+    """Return a hex digest of a tag string followed by a sequence of arrays (or None)."""
+
+    content_hash = hashlib.sha1(tag.encode("utf-8"))
+    for values in arrays:
+        if values is None:
+            content_hash.update(b"none")
+        else:
+            values = np.ascontiguousarray(values)
+            content_hash.update("{0}{1}".format(values.dtype.str, values.shape).encode("utf-8"))
+            content_hash.update(values.tobytes())
+    return content_hash.hexdigest()
+
+
+def get_curves_data_hash(steps, points, radii):
+    """Return a hash of everything written to disk for a hair particle system."""
+
+    return get_arrays_hash("curves%d" % steps, points, radii)
+
+
+def write_curves_data(filepath, steps, points, radii):
+    """Write extracted hair points to a curves file."""
+
+    num_curves, num_points = points.shape[:2]
+
+    with open(filepath, "w") as output_file:
+        # Write the number of hairs to the file
+        output_file.write("%d\n" % num_curves)
+
+        # Write the number of points per hair to the file
+        output_file.write("%d\n" % steps)
+
+        # Write one line of points and radii per hair.
+        rows = np.empty((num_curves, num_points, 4), dtype=np.float64)
+        rows[:, :, :3] = points
+        rows[:, :, 3] = radii
+        write_lines(output_file, "%.6f %.6f %.6f %.4f " * num_points + "\n", rows.reshape(num_curves, num_points * 4))
@@ -0,0 +1,456 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import bpy
+import numpy as np
+
+from . import geometrywriter
+from . import util
+
+GeometricObjectTypes = {'MESH', 'CURVE', 'SURFACE', 'FONT', 'META'}
+
+# Largest total vertex count of the meshes tessellated ahead of export at shutter open. They stay in memory until
+# they are exported, the meshes of the objects beyond this count are tessellated when they are exported.
+MaxShutterOpenVertices = 2000000
+
+# Largest difference between matrix elements of motion samples for an object to be considered static.
+StaticMatrixTolerance = 1.0e-6
+
+
+def is_static(matrices, tolerance=StaticMatrixTolerance):
+    """Return True if all the matrices sampled during the shutter interval match the first one within tolerance."""
+
+    first_matrix = matrices[0]
+    for matrix in matrices[1:]:
+        for row, first_row in zip(matrix, first_matrix):
+            for value, first_value in zip(row, first_row):
+                if abs(value - first_value) > tolerance:
+                    return False
+    return True
+
+
+def get_static_instances(matrices, tolerance=StaticMatrixTolerance):
+    """
+    Return a boolean mask of the instances that did not move, given an
+    (instance count, sample count, 4, 4) array of matrices sampled during the shutter interval.
+    """
+
+    return np.all(np.abs(matrices - matrices[:, :1]) <= tolerance, axis=(1, 2, 3))
+
+
+def get_particle_array(particles, attribute, width=None, dtype=np.float32):
+    """Read an attribute of all the particles of a particle system into an array, in bulk."""
+
+    values = np.empty(len(particles) * (width or 1), dtype=dtype)
+    particles.foreach_get(attribute, values)
+    return values.reshape(-1, width) if width else values
+
+
+def get_alive_particles(particles, settings, time):
+    """
+    Return a boolean mask of the particles of an emitter particle system that have a dupli at a time given in frames.
+    As in Blender, a particle is alive from its birth time and until its death time; unborn and dead particles
+    have a dupli if the particle settings show them.
+    """
+
+    alive = np.ones(len(particles), dtype=np.bool_)
+    if not settings.show_unborn:
+        alive &= get_particle_array(particles, "birth_time") <= time
+    if not settings.use_dead:
+        alive &= time < get_particle_array(particles, "die_time")
+    return alive
+
+
+class MotionSampleCache(object):
+    """
+    Scene state sampled at the shutter times of the current frame.
+
+    Setting the frame triggers a full evaluation of the scene, so the scene is set to each shutter
+    time only once and everything the exporter needs at that time is collected during the visit:
+    object matrices, dupli transforms, particle states, deformed meshes and hair curves, and the
+    camera transform. The geometry exported at shutter open is tessellated while the scene is at
+    shutter open too, for the objects accepted by needs_mesh(ob), up to MaxShutterOpenVertices. The
+    scene is then returned to the current frame, at which everything else is exported; call release()
+    once the project is emitted.
+    """
+
+    def __init__(self, scene, global_matrix, needs_mesh=None):
+        asr_scn = scene.appleseed
+
+        self._scene = scene
+        self._global_matrix = global_matrix
+        self._frame = scene.frame_current
+
+        # Shutter times, evenly spaced between shutter open and shutter close,
+        # as subframes of the current frame and as times on the appleseed shutter.
+        if asr_scn.enable_motion_blur:
+            sample_count = asr_scn.motion_blur_samples
+            self.times = [sample_index / (sample_count - 1) for sample_index in range(sample_count)]
+            self.subframes = [asr_scn.shutter_open + (asr_scn.shutter_close - asr_scn.shutter_open) * time for time in self.times]
+        else:
+            self.times = [0.0]
+            self.subframes = [0.0]
+
+        # Object name -> list of samples, one per shutter time.
+        self._object_matrices = {}
+        self._dupli_samples = {}
+        self._particle_samples = {}
+        self._particle_instances = {}
+
+        # Object name (or object and particle system names) -> list of geometry samples, one per shutter time after shutter open.
+        self._deformation_meshes = {}
+        self._deformation_curves = {}
+
+        # Object name (or object and particle system names) -> mesh or curves data at shutter open, tessellated when
+        # shutter open is not the current frame. Meshes are handed over to the exporter, see get_shutter_open_mesh().
+        self._shutter_open_meshes = {}
+        self._shutter_open_curves = {}
+        self._shutter_open_vertex_count = 0
+
+        self._camera_transforms = []
+
+        if not asr_scn.enable_motion_blur:
+            return
+
+        # Collect the objects that need samples.
+        collectors = []
+        camera = scene.camera
+        if camera is not None and asr_scn.enable_camera_blur:
+            collectors.append(lambda sample_index: self.__collect_camera(camera, sample_index))
+        for ob in scene.objects:
+            if not util.do_export(ob, scene) or ob.type == 'LAMP':
+                continue
+            if util.ob_mblur_enabled(ob, scene):
+                collectors.append(self.__get_object_collector(ob))
+            if util.def_mblur_enabled(ob, scene) and ob.type in GeometricObjectTypes:
+                collectors.append(self.__get_deformation_collector(ob))
+
+        # The camera and the geometry are exported at shutter open, collect them during the visit of shutter open.
+        open_collectors = []
+        if self.subframes[0] != 0.0:
+            if camera is not None and not asr_scn.enable_camera_blur:
+                open_collectors.append(lambda: self.__collect_camera(camera, 0))
+            for ob in scene.objects:
+                if util.do_export(ob, scene) and ob.type in GeometricObjectTypes:
+                    open_collectors.append(self.__get_shutter_open_collector(ob, needs_mesh is None or needs_mesh(ob)))
+
+        if collectors or open_collectors:
+            self.__sample(collectors, open_collectors)
+
+    def release(self):
+        """Remove the meshes tessellated at shutter open that were not exported."""
+
+        for mesh in self._shutter_open_meshes.values():
+            if mesh is not None:
+                bpy.data.meshes.remove(mesh)
+        self._shutter_open_meshes = {}
+        self._shutter_open_curves = {}
+
+    def get_camera_transforms(self):
+        """Return the camera (origin, forward, up, target) at each shutter time."""
+
+        return self._camera_transforms
+
+    def get_shutter_open_camera_transform(self, camera):
+        """Return the camera (origin, forward, up, target) at shutter open."""
+
+        if not self._camera_transforms:
+            self.__at_shutter_open(lambda: self.__collect_camera(camera, 0))
+        return self._camera_transforms[0]
+
+    def get_shutter_open_mesh(self, ob):
+        """
+        Return a mesh of an object tessellated at shutter open, which the caller removes once exported.
+        Raise RuntimeError if the object could not be converted to a mesh.
+        """
+
+        if ob.name in self._shutter_open_meshes:
+            mesh = self._shutter_open_meshes.pop(ob.name)
+        else:
+            mesh = self.__at_shutter_open(lambda: self.__to_mesh(ob))
+        if mesh is None:
+            raise RuntimeError("Object '{0}' could not be converted to a mesh".format(ob.name))
+        return mesh
+
+    def get_shutter_open_curves(self, ob, psys):
+        """Return the curves data of a hair particle system at shutter open."""
+
+        curves_name = "_".join([ob.name, psys.name])
+        if curves_name in self._shutter_open_curves:
+            return self._shutter_open_curves.pop(curves_name)
+        return self.__at_shutter_open(lambda: geometrywriter.extract_curves(ob, self._scene, psys))
+
+    def get_object_matrices(self, ob):
+        """Return the world matrix of an object at each shutter time."""
+
+        if ob.name not in self._object_matrices:
+            self.__sample([self.__get_object_collector(ob)])
+        return self._object_matrices[ob.name]
+
+    def get_dupli_instances(self, ob):
+        """
+        Return the instances of a dupli-verts / dupli-faces parent as a list of
+        [dupli object, (instance count, sample count, 4, 4) array of dupli matrices].
+        """
+
+        if ob.name not in self._dupli_samples:
+            self.__sample([self.__get_object_collector(ob)])
+
+        samples = self._dupli_samples[ob.name]
+        dupli_objects = samples[0][0]
+        instance_count = min(len(dupli_matrices) for objects, dupli_matrices in samples)
+        matrices = np.stack([dupli_matrices[:instance_count] for objects, dupli_matrices in samples], axis=1)
+        return [[dupli_object, matrices[indices[indices < instance_count]]]
+                for dupli_object, indices in util.group_by_object(dupli_objects)]
+
+    def get_particle_instances(self, ob):
+        """
+        Return the instances of the particle systems of an object as a list of
+        [dupli object, (instance count, sample count, 4, 4) array of matrices].
+        """
+
+        if ob.name not in self._particle_instances:
+            if ob.name not in self._particle_samples:
+                self.__sample([self.__get_object_collector(ob)])
+            self._particle_instances[ob.name] = self.__build_particle_instances(self._particle_samples.pop(ob.name))
+        return self._particle_instances[ob.name]
+
+    def get_deformation_meshes(self, ob):
+        """
+        Return the mesh arrays of an object at each shutter time after shutter open.
+        A sample is None if the object could not be converted to a mesh.
+        """
+
+        if ob.name not in self._deformation_meshes:
+            self.__sample([self.__get_deformation_collector(ob)])
+        return self._deformation_meshes[ob.name]
+
+    def get_deformation_curves(self, ob, psys):
+        """Return the curves data of a hair particle system at each shutter time after shutter open."""
+
+        curves_name = "_".join([ob.name, psys.name])
+        if curves_name not in self._deformation_curves:
+            self.__sample([self.__get_deformation_collector(ob)])
+        return self._deformation_curves[curves_name]
+
+    def __sample(self, collectors, open_collectors=()):
+        """
+        Set the scene to each shutter time once and call every collector with the sample index, and the
+        open collectors at shutter open, then return the scene to the current frame. Shutter open is visited
+        last, the scene is already at the current frame if shutter open is the start of the current frame.
+        """
+
+        sample_indices = range(len(self.subframes)) if collectors else [0]
+        for sample_index in reversed(sample_indices):
+            self._scene.frame_set(self._frame, subframe=self.subframes[sample_index])
+            for collect in collectors:
+                collect(sample_index)
+        for collect in open_collectors:
+            collect()
+        if self.subframes[0] != 0.0:
+            self._scene.frame_set(self._frame)
+
+    def __at_shutter_open(self, function):
+        """Return function() evaluated with the scene at shutter open."""
+
+        if self.subframes[0] == 0.0:
+            return function()
+        self._scene.frame_set(self._frame, subframe=self.subframes[0])
+        try:
+            return function()
+        finally:
+            self._scene.frame_set(self._frame)
+
+    def __new_samples(self):
+        return [None] * len(self.subframes)
+
+    def __collect_camera(self, camera, sample_index):
+        if not self._camera_transforms:
+            self._camera_transforms = self.__new_samples()
+        self._camera_transforms[sample_index] = util.get_camera_matrix(camera, self._global_matrix)
+
+    def __get_object_collector(self, ob):
+        """Return a function collecting the transforms of an object with object motion blur."""
+
+        self._object_matrices[ob.name] = self.__new_samples()
+        is_dupli_parent = ob.is_duplicator and ob.dupli_type in {'VERTS', 'FACES'}
+        if is_dupli_parent:
+            self._dupli_samples[ob.name] = self.__new_samples()
+        is_emitter = util.is_psys_emitter(ob)
+        if is_emitter:
+            self._particle_samples[ob.name] = self.__new_samples()
+
+        def collect(sample_index):
+            self._object_matrices[ob.name][sample_index] = ob.matrix_world.copy()
+            if is_dupli_parent:
+                ob.dupli_list_create(self._scene)
+                # Dupli objects are only needed at shutter open, which is sampled last.
+                dupli_objects = [dupli.object for dupli in ob.dupli_list] if sample_index == 0 else None
+                self._dupli_samples[ob.name][sample_index] = (dupli_objects, util.get_dupli_matrices(ob.dupli_list))
+                ob.dupli_list_clear()
+            elif is_emitter:
+                self._particle_samples[ob.name][sample_index] = self.__collect_particles(ob, sample_index)
+
+        return collect
+
+    def __collect_particles(self, ob, sample_index):
+        """Collect the dupli list and the alive particles of each particle system of an object at the current time."""
+
+        ob.dupli_list_create(self._scene, 'RENDER')
+        dupli_objects = [dupli.object for dupli in ob.dupli_list] if sample_index == 0 else None
+        dupli_matrices = util.get_dupli_matrices(ob.dupli_list)
+        ob.dupli_list_clear()
+
+        time = self._frame + self.subframes[sample_index]
+        alive_masks = []
+        for modifier in ob.modifiers:
+            if modifier.type == 'PARTICLE_SYSTEM' and modifier.show_render:
+                psys = modifier.particle_system
+                settings = psys.settings
+                if settings.render_type not in {'OBJECT', 'GROUP'}:
+                    continue
+                particles = psys.particles
+                if settings.type == 'EMITTER':
+                    alive_masks.append(get_alive_particles(particles, settings, time))
+                else:
+                    alive_masks.append(np.ones(len(particles), dtype=np.bool_))
+
+        return dupli_objects, dupli_matrices, alive_masks
+
+    def __build_particle_instances(self, samples):
+        """
+        Match the particles sampled at each shutter time into instances with one matrix per time.
+        The matrices are those of Blender's dupli lists, which hold one dupli per alive particle of each system.
+        A particle that is not alive at a shutter time keeps its matrix at shutter open at that time.
+        If the alive particles do not add up to the dupli list, for instance with whole groups, the instances are not blurred.
+        """
+
+        open_dupli_objects, open_matrices, open_alive_masks = samples[0]
+        for sample_objects, dupli_matrices, alive_masks in samples:
+            if sum(int(np.count_nonzero(alive)) for alive in alive_masks) != len(dupli_matrices):
+                return [[dupli_object, np.repeat(open_matrices[indices, np.newaxis], len(samples), axis=1)]
+                        for dupli_object, indices in util.group_by_object(open_dupli_objects)]
+
+        instances = []
+        # Offset of the current particle system in the dupli list of each sample.
+        offsets = [0] * len(samples)
+
+        for system_index, open_alive in enumerate(open_alive_masks):
+            # Particles are matched across shutter times by their index; only those alive at shutter open are instanced.
+            alive_indices = np.flatnonzero(open_alive)
+            dupli_objects = open_dupli_objects[offsets[0]:offsets[0] + len(alive_indices)]
+
+            for dupli_object, indices in util.group_by_object(dupli_objects):
+                particle_indices = alive_indices[indices]
+                open_particle_matrices = open_matrices[offsets[0] + indices]
+                matrices = []
+                for sample_index, (sample_objects, dupli_matrices, alive_masks) in enumerate(samples):
+                    alive = alive_masks[system_index]
+                    if len(alive) != len(open_alive):
+                        matrices.append(open_particle_matrices)
+                        continue
+                    # Rank of each particle among the particles alive at this shutter time, which is its dupli.
+                    dupli_indices = offsets[sample_index] + np.cumsum(alive)[particle_indices] - 1
+                    matrices.append(np.where(alive[particle_indices, np.newaxis, np.newaxis],
+                                             dupli_matrices[np.maximum(dupli_indices, 0)],
+                                             open_particle_matrices))
+                instances.append([dupli_object, np.stack(matrices, axis=1)])
+
+            for sample_index, (sample_objects, dupli_matrices, alive_masks) in enumerate(samples):
+                offsets[sample_index] += int(np.count_nonzero(alive_masks[system_index]))
+
+        return instances
+
+    def __get_hair_systems(self, ob):
+        """Return the hair particle systems of an object exported as curves."""
+
+        hair_systems = []
+        if self._scene.appleseed.export_hair and util.has_hairsys(ob):
+            for modifier in ob.modifiers:
+                if modifier.type == 'PARTICLE_SYSTEM' and modifier.show_render:
+                    psys = modifier.particle_system
+                    if psys.settings.type == 'HAIR' and psys.settings.render_type == 'PATH':
+                        hair_systems.append(psys)
+        return hair_systems
+
+    def __get_shutter_open_collector(self, ob, needs_mesh):
+        """Return a function collecting the geometry of an object at shutter open."""
+
+        hair_systems = self.__get_hair_systems(ob)
+
+        def collect():
+            # Past the vertex budget, get_shutter_open_mesh() tessellates the object when it is exported.
+            if needs_mesh and self._shutter_open_vertex_count < MaxShutterOpenVertices:
+                mesh = self.__to_mesh(ob)
+                self._shutter_open_meshes[ob.name] = mesh
+                if mesh is not None:
+                    self._shutter_open_vertex_count += len(mesh.vertices)
+            for psys in hair_systems:
+                self._shutter_open_curves["_".join([ob.name, psys.name])] = geometrywriter.extract_curves(ob, self._scene, psys)
+
+        return collect
+
+    def __get_deformation_collector(self, ob):
+        """Return a function collecting the geometry of an object with deformation motion blur."""
+
+        export_hair = self._scene.appleseed.export_hair and util.has_hairsys(ob)
+        export_mesh = not export_hair or util.render_emitter(ob)
+        hair_systems = self.__get_hair_systems(ob)
+
+        self._deformation_meshes[ob.name] = self.__new_samples()[1:]
+        for psys in hair_systems:
+            self._deformation_curves["_".join([ob.name, psys.name])] = self.__new_samples()[1:]
+
+        def collect(sample_index):
+            # Geometry at shutter open is exported along with the object itself.
+            if sample_index == 0:
+                return
+            if export_mesh:
+                self._deformation_meshes[ob.name][sample_index - 1] = self.__read_mesh_arrays(ob)
+            for psys in hair_systems:
+                curves_data = geometrywriter.extract_curves(ob, self._scene, psys)
+                self._deformation_curves["_".join([ob.name, psys.name])][sample_index - 1] = curves_data
+
+        return collect
+
+    def __to_mesh(self, ob):
+        """Return a mesh of an object tessellated at the current time, or None if it could not be converted to a mesh."""
+
+        try:
+            return ob.to_mesh(self._scene, True, 'RENDER', calc_tessface=True)
+        except RuntimeError:
+            return None
+
+    def __read_mesh_arrays(self, ob):
+        mesh = self.__to_mesh(ob)
+        if mesh is None:
+            return None
+        try:
+            return geometrywriter.read_mesh_arrays(mesh)
+        finally:
+            bpy.data.meshes.remove(mesh)
@@ -0,0 +1,265 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from . import meshcache
+
+# Root of the directories written by the add-on.
+RootDir = os.path.join(tempfile.gettempdir(), "blenderseed")
+
+# Directory holding one working directory per render session.
+SessionsDir = os.path.join(RootDir, "sessions")
+
+# Geometry files shared between render sessions, see seed_meshes() and publish_meshes().
+SharedMeshesDir = os.path.join(RootDir, "meshes")
+
+# Pixels of interrupted renders, see rendercheckpoint.RenderCheckpoint.
+CheckpointsDir = os.path.join(RootDir, "checkpoints")
+
+# Finished renders, see resultcache.ResultCache.
+ResultsDir = os.path.join(RootDir, "results")
+
+# Session directories left behind (by crashed or kept renders) are removed after this many seconds.
+MaxSessionAge = 24 * 60 * 60
+
+# Checkpoints of renders that were not resumed are removed after this many seconds.
+MaxCheckpointAge = 7 * 24 * 60 * 60
+
+# A shared meshes or session lock older than this many seconds was left behind and is ignored.
+MaxLockAge = 10 * 60
+
+# Name of the lock file of a session directory in use, see create_session_dir().
+SessionLockFileName = "session.lock"
+
+# Session locks are refreshed every this many seconds while their session is in use.
+SessionLockRefreshInterval = 60
+
+# Session directories in use by this Blender instance, whose locks are refreshed by a thread.
+held_session_dirs = set()
+held_session_dirs_lock = threading.Lock()
+session_lock_refresher = None
+
+
+def create_session_dir(kind):
+    """
+    Create a unique working directory for a render session of the given kind ("render", "material_preview"...).
+    Directories of sessions older than MaxSessionAge and checkpoints older than MaxCheckpointAge are removed first.
+
+    The directory holds a lock file, refreshed until the directory is released or removed, so that other
+    Blender instances do not remove the directory of a long render while it is running.
+    """
+
+    if not os.path.exists(SessionsDir):
+        os.makedirs(SessionsDir)
+    remove_old_session_dirs()
+    remove_old_checkpoints()
+    session_dir = tempfile.mkdtemp(prefix=kind + "_", dir=SessionsDir)
+    hold_session_lock(session_dir)
+    return session_dir
+
+
+def release_session_dir(session_dir):
+    """Release the lock of a session directory that is kept after its render, see create_session_dir()."""
+
+    with held_session_dirs_lock:
+        held_session_dirs.discard(session_dir)
+    try:
+        os.remove(os.path.join(session_dir, SessionLockFileName))
+    except OSError:
+        pass
+
+
+def remove_session_dir(session_dir):
+    """Remove the working directory of a render session."""
+
+    release_session_dir(session_dir)
+    shutil.rmtree(session_dir, ignore_errors=True)
+
+
+def remove_old_session_dirs():
+    """Remove the session directories that were not modified for MaxSessionAge seconds and are not in use."""
+
+    now = time.time()
+    for name in os.listdir(SessionsDir):
+        session_dir = os.path.join(SessionsDir, name)
+        try:
+            if now - os.path.getmtime(session_dir) > MaxSessionAge and not is_session_locked(session_dir):
+                remove_session_dir(session_dir)
+        except OSError:
+            # Removed by another session in the meantime.
+            pass
+
+
+def hold_session_lock(session_dir):
+    """Create the lock file of a session directory and refresh it until the session is released."""
+
+    global session_lock_refresher
+
+    with open(os.path.join(session_dir, SessionLockFileName), "w") as lock_file:
+        lock_file.write(str(os.getpid()))
+
+    with held_session_dirs_lock:
+        held_session_dirs.add(session_dir)
+        if session_lock_refresher is None:
+            session_lock_refresher = threading.Thread(target=refresh_session_locks)
+            session_lock_refresher.daemon = True
+            session_lock_refresher.start()
+
+
+def refresh_session_locks():
+    """Touch the lock files of the session directories in use. Runs on a thread for the lifetime of Blender."""
+
+    while True:
+        time.sleep(SessionLockRefreshInterval)
+        with held_session_dirs_lock:
+            session_dirs = list(held_session_dirs)
+        for session_dir in session_dirs:
+            try:
+                os.utime(os.path.join(session_dir, SessionLockFileName), None)
+            except OSError:
+                pass
+
+
+def is_session_locked(session_dir):
+    """Return True if a session directory is in use, by this or another Blender instance."""
+
+    try:
+        return time.time() - os.path.getmtime(os.path.join(session_dir, SessionLockFileName)) <= MaxLockAge
+    except OSError:
+        return False
+
+
+def remove_old_checkpoints():
+    """Remove the checkpoint files that were not modified for MaxCheckpointAge seconds."""
+
+    if not os.path.isdir(CheckpointsDir):
+        return
+
+    now = time.time()
+    for name in os.listdir(CheckpointsDir):
+        checkpoint_path = os.path.join(CheckpointsDir, name)
+        try:
+            if now - os.path.getmtime(checkpoint_path) > MaxCheckpointAge:
+                os.remove(checkpoint_path)
+        except OSError:
+            pass
+
+
+def link_meshes(source_dir, target_dir):
+    """
+    Populate the meshes directory of a project with the geometry files found in source_dir/meshes.
+    Files are hard linked when possible, and copied otherwise. The writer replaces the files whose
+    geometry changed instead of overwriting them, so the source keeps its own version.
+    """
+
+    source_meshes_path = os.path.join(source_dir, "meshes")
+    target_meshes_path = os.path.join(target_dir, "meshes")
+    if not os.path.isdir(source_meshes_path):
+        return
+
+    if os.path.isdir(target_meshes_path):
+        shutil.rmtree(target_meshes_path)
+    os.makedirs(target_meshes_path)
+
+    for filename in os.listdir(source_meshes_path):
+        source_path = os.path.join(source_meshes_path, filename)
+        target_path = os.path.join(target_meshes_path, filename)
+        # The manifest is rewritten in place, it is never shared.
+        if filename != meshcache.MeshCache.ManifestFileName:
+            try:
+                os.link(source_path, target_path)
+                continue
+            except OSError:
+                pass
+        shutil.copyfile(source_path, target_path)
+
+
+def seed_meshes(session_dir):
+    """Populate the meshes directory of a session with the shared geometry files. Return False if they are busy."""
+
+    if not acquire_shared_meshes_lock():
+        return False
+    try:
+        link_meshes(RootDir, session_dir)
+    except (IOError, OSError):
+        return False
+    finally:
+        release_shared_meshes_lock()
+    return True
+
+
+def publish_meshes(session_dir):
+    """Make the geometry files of a session the shared ones. Return False if they are busy."""
+
+    if not os.path.isdir(os.path.join(session_dir, "meshes")):
+        return True
+    if not acquire_shared_meshes_lock():
+        return False
+    try:
+        link_meshes(session_dir, RootDir)
+    except (IOError, OSError):
+        # Do not leave a partial set of files behind a complete manifest.
+        shutil.rmtree(SharedMeshesDir, ignore_errors=True)
+        return False
+    finally:
+        release_shared_meshes_lock()
+    return True
+
+
+def get_shared_meshes_lock_path():
+    return os.path.join(RootDir, "meshes.lock")
+
+
+def acquire_shared_meshes_lock():
+    """Try to take the lock of the shared geometry files, across Blender instances. Return False if it is taken."""
+
+    lock_path = get_shared_meshes_lock_path()
+    if not os.path.exists(RootDir):
+        os.makedirs(RootDir)
+    try:
+        if time.time() - os.path.getmtime(lock_path) > MaxLockAge:
+            os.remove(lock_path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except OSError:
+        return False
+    return True
+
+
+def release_shared_meshes_lock():
+    try:
+        os.remove(get_shared_meshes_lock_path())
+    except OSError:
+        pass
@@ -0,0 +1,145 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import abc
+import gzip
+import io
+import subprocess
+
+# Size in characters of the blocks written by sinks.
+BlockSize = 1 << 20
+
+
+class Sink(abc.ABC):
+    """
+    Destination of the text emitted by projectwriter.Writer.
+
+    Text fragments are accumulated in memory and written in large blocks,
+    so emitting a line costs a list append rather than an encoded write.
+    Sinks are context managers and are closed by the writer they are given to.
+    """
+
+    def __init__(self):
+        self._fragments = []
+        self._pending_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, text):
+        self._fragments.append(text)
+        self._pending_size += len(text)
+        if self._pending_size >= BlockSize:
+            self.flush()
+
+    def flush(self):
+        """Write the accumulated text as one block."""
+
+        if self._fragments:
+            block = "".join(self._fragments)
+            self._fragments = []
+            self._pending_size = 0
+            self._write_block(block)
+
+    def close(self):
+        """Write the accumulated text and release the destination."""
+
+        try:
+            self.flush()
+        finally:
+            self._close()
+
+    @abc.abstractmethod
+    def _write_block(self, block):
+        """Write a block of text to the destination."""
+
+    def _close(self):
+        pass
+
+
+class FileSink(Sink):
+    """Write text to a UTF-8 file."""
+
+    def __init__(self, file_path):
+        super(FileSink, self).__init__()
+        self._file = open(file_path, "w", encoding="utf-8", newline="")
+
+    def _write_block(self, block):
+        self._file.write(block)
+
+    def _close(self):
+        self._file.close()
+
+
+class GzipFileSink(Sink):
+    """Write text to a gzip-compressed UTF-8 file."""
+
+    def __init__(self, file_path, compress_level=6):
+        super(GzipFileSink, self).__init__()
+        self._file = gzip.open(file_path, "wt", compresslevel=compress_level, encoding="utf-8", newline="")
+
+    def _write_block(self, block):
+        self._file.write(block)
+
+    def _close(self):
+        self._file.close()
+
+
+class MemorySink(Sink):
+    """Keep text in memory, see getvalue()."""
+
+    def __init__(self):
+        super(MemorySink, self).__init__()
+        self._buffer = io.StringIO()
+
+    def getvalue(self):
+        self.flush()
+        return self._buffer.getvalue()
+
+    def _write_block(self, block):
+        self._buffer.write(block)
+
+
+class ProcessSink(Sink):
+    """
+    Write UTF-8 text to the standard input of a child process.
+    Closing the sink closes the pipe, the process itself is left to the caller, see process.
+    """
+
+    def __init__(self, args, **popen_args):
+        super(ProcessSink, self).__init__()
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, **popen_args)
+
+    def _write_block(self, block):
+        self.process.stdin.write(block.encode("utf-8"))
+
+    def _close(self):
+        self.process.stdin.close()
@@ -26,21 +26,55 @@
 # THE SOFTWARE.
 #
 
-import codecs
+import collections
+import concurrent.futures
+import hashlib
+import io
 import math
 import os
 from datetime import datetime
 
 import bpy
 import mathutils
+import numpy as np
 
+from . import exportstate
 from . import geometrywriter
+from . import materialcompiler
+from . import meshdata
+from . import meshcache
+from . import motionsamples
+from . import projectsinks
 from . import util
 
 identity_matrix = mathutils.Matrix(((1.0, 0.0, 0.0, 0.0),
                                     (0.0, 0.0, -1.0, 0.0),
                                     (0.0, 1.0, 0.0, 0.0),
                                     (0.0, 0.0, 0.0, 1.0)))
+identity_matrices = np.array([identity_matrix], dtype=np.float32)
+
+# Placeholders of the object instance template, see Writer.__emit_object_instance_elements().
+InstanceIndexToken = "\x00instance\x00"
+MatrixRowToken = "\x00matrix_row\x00"
+
+# Number of spaces per indentation level of the project file.
+IndentSize = 4
+
+# Number of object instances formatted at once.
+InstanceChunkSize = 4096
+
+
+# Export modes in which the content hash of geometry decides whether its file is written. Partial export used to trust
+# any existing file, which may come from another render since session directories start from the shared geometry files.
+CachedExportModes = ('cached', 'partial')
+
+# Extension of the files holding the assemblies of split projects.
+AssemblyFileExtension = ".assembly.appleseed"
+
+
+def write_assembly_file(content, filepath):
+    with open(filepath, "wb") as assembly_file:
+        assembly_file.write(content)
 
 
 def is_black(color):
@@ -66,12 +100,19 @@ def object_enumerator(obj_type):
 class Writer(object):
     """appleseed exporter."""
 
-    def write(self, scene, file_path):
-        """Write the .appleseed project file for rendering."""
+    def write(self, scene, file_path, final_sampling=None, sink=None):
+        """
+        Write the .appleseed project file for rendering.
+        final_sampling is an optional (max samples, passes) pair overriding the sampling settings of the final configuration.
+        sink is an optional projectsinks.Sink receiving the project instead of file_path, which still locates geometry files.
+        Return False if the project could not be exported.
+        """
 
         if scene is None:
             self.__error("No scene to export.")
-            return
+            return False
+
+        self._final_sampling = final_sampling
 
         # Root path of the exported project.
         self._root_path = os.path.dirname(util.realpath(file_path))
@@ -80,47 +121,114 @@ class Writer(object):
         self._global_scale = 1
         self._global_matrix = mathutils.Matrix.Scale(self._global_scale, 4)
 
-        # Store textures as they are exported.
+        # Store the names of textures (or the paths of scene textures) as they are exported,
+        # and the textures looked up while emitting a material, see __emit_material().
         self._textures_set = set()
+        self._texture_lookups = []
+
+        # Material name -> content hash, see __emit_material().
+        self._material_hashes = {}
+
+        # Entities of the previous export, reused for the datablocks that were not updated since.
+        # The entities of this export are kept for the next one, see exportstate.
+        self._export_state = exportstate.get_export_state(scene)
+        self._updated = self._export_state.begin_export(scene)
+        self._geometry = {}
 
         # Collect objects with motion blur.
-        self._def_mblur_obs = {ob.name: '' for ob in scene.objects if ob.appleseed.enable_motion_blur and ob.appleseed.motion_blur_type == 'deformation'}
+        # Object name -> deformation geometry files, one per motion sample after shutter open.
+        self._def_mblur_obs = {ob.name: [] for ob in scene.objects if ob.appleseed.enable_motion_blur and ob.appleseed.motion_blur_type == 'deformation'}
         self._selected_objects = [ob.name for ob in scene.objects if ob.select]
         self._dupli_objects = []
 
         # Blender material -> front material name, back material name.
         self._emitted_materials = {}
 
-        # Object name -> instance count.
+        # Object name -> instance count, in the scene assembly.
         self._instance_count = {}
+
+        # Names of the objects and curves whose geometry files were already handled.
+        self._exported_geometry = set()
         self._assembly_count = {}
         self._assembly_instance_count = {}
 
+        # Write each assembly to a file of its own, next to the geometry files, see __open_assembly().
+        self._split_assemblies = scene.appleseed.split_assemblies
+        self._assembly_files = []
+
         # Object name -> (material index, mesh name).
         self._mesh_parts = {}
 
+        # Mesh datablock -> name of the mesh object emitted for it, for objects that can share their geometry.
+        self._shared_meshes = {}
+
+        # Object name -> name of the mesh object holding its geometry.
+        self._mesh_object_names = {}
+
         # Instanced particle objects.
         # Write mesh files but do not write to appleseed file.
         self._no_export = {ob.name for ob in util.get_all_psysobs()}
 
+        # Content hashes of the geometry files already on disk.
+        self._mesh_cache = meshcache.MeshCache(os.path.join(self._root_path, "meshes"))
+
+        # Geometry files are written by a pool of threads while the project file is emitted.
+        export_threads = util.thread_count if scene.appleseed.export_threads_auto else scene.appleseed.export_threads
+        self._geometry_executor = concurrent.futures.ThreadPoolExecutor(max_workers=export_threads) if export_threads > 1 else None
+        self._geometry_jobs = collections.deque()
+        self._max_geometry_jobs = 2 * export_threads
+
+        # Geometry files written in parallel that could not be written, although the project references them.
+        self._failed_geometry_files = []
+
         self.__info("")
         self.__info("Starting export of scene '{0}' to {1}...".format(scene.name, file_path))
 
         start_time = datetime.now()
 
+        # Visit each shutter time once, tessellating the geometry exported at shutter open during the visit.
+        self._shutter_open_mesh_data = set()
+        self._motion_samples = motionsamples.MotionSampleCache(scene, self._global_matrix,
+                                                               lambda object: self.__needs_shutter_open_mesh(scene, object))
+
         try:
-            with codecs.open(file_path, "w", "utf-8") as self._output_file:
+            with sink or projectsinks.FileSink(file_path) as self._output_file:
                 self._indent = 0
                 self.__emit_file_header()
                 self.__emit_project(scene)
         except IOError:
             self.__error("Could not write to {0}.".format(file_path))
-            return
+            return False
+        finally:
+            # Wait for all geometry files to be written.
+            self.__finish_geometry_jobs()
+            if self._geometry_executor is not None:
+                self._geometry_executor.shutdown()
+            self._motion_samples.release()
+
+        # The project references the geometry files written in parallel before they are written, it can not be rendered without them.
+        if self._failed_geometry_files:
+            self.__error("Could not write the geometry files {0}, the project can not be rendered.".format(", ".join(self._failed_geometry_files)))
+            if sink is None:
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+            return False
+
+        try:
+            self._mesh_cache.save()
+        except IOError:
+            self.__warning("Could not write the mesh cache manifest, geometry will be exported again next time.")
+
+        self._export_state.end_export(self._geometry)
 
         elapsed_time = datetime.now() - start_time
 
         self.__info("Finished exporting in {0}".format(elapsed_time))
 
+        return True
+
     """Export the project."""
 
     def __get_selected_camera(self, scene):
@@ -151,11 +259,11 @@ class Writer(object):
     def __emit_assembly(self, scene):
         """Write the scene assembly."""
 
-        self.__open_element('assembly name="%s"' % scene.name)
+        self.__open_assembly(scene.name)
         self.__emit_physical_surface_shader_element()
         self.__emit_default_material(scene)
         self.__emit_objects(scene)
-        self.__close_element("assembly")
+        self.__close_assembly()
 
     def __emit_assembly_instance(self, scene, obj=None):
         """
@@ -163,44 +271,85 @@ class Writer(object):
         instance for an object with transformation motion blur.
         """
 
-        asr_scn = scene.appleseed
-        shutter_open = asr_scn.shutter_open if asr_scn.enable_motion_blur else 0
-        shutter_close = asr_scn.shutter_close if asr_scn.enable_motion_blur else 1
         if obj is not None:
             # Write object assembly for an object with motion blur.
             obj_name = obj.name
             self.__open_element('assembly_instance name="%s_instance" assembly="%s"' % (obj_name, obj_name))
-            current_frame = scene.frame_current
 
-            # Advance to shutter open, collect matrix.
-            scene.frame_set(current_frame, subframe=shutter_open)
-            instance_matrix = self._global_matrix * obj.matrix_world
-
-            # Advance to next frame, collect matrix.
-            scene.frame_set(current_frame, subframe=shutter_close)
-            next_matrix = self._global_matrix * obj.matrix_world
-
-            # Reset timeline.
-            scene.frame_set(current_frame)
-
-            self.__emit_transform_element(instance_matrix, 0)
-            self.__emit_transform_element(next_matrix, 1)
+            # Emit the matrices sampled at each shutter time.
+            matrices = self._motion_samples.get_object_matrices(obj)
+            for time, matrix in zip(self._motion_samples.times, matrices):
+                self.__emit_transform_element(self._global_matrix * matrix, time)
             self.__close_element("assembly_instance")
         else:
             # No object, write an assembly for the whole scene.
             self.__open_element('assembly_instance name="%s_instance" assembly="%s"' % (scene.name, scene.name))
             self.__close_element("assembly_instance")
 
+    def __open_assembly(self, assembly_name):
+        """
+        Open an assembly element. In split projects, the element only references an archive assembly
+        file, and the contents of the assembly are emitted to that file until __close_assembly().
+        """
+
+        if not self._split_assemblies:
+            self.__open_element('assembly name="%s"' % assembly_name)
+            return
+
+        assembly_filename = assembly_name + AssemblyFileExtension
+        self.__open_element('assembly name="%s" model="archive_assembly"' % assembly_name)
+        self.__emit_parameter("filename", "meshes/" + assembly_filename)
+        self.__close_element("assembly")
+
+        # The file holds a project with a scene made of this assembly only. appleseed expands an archive
+        # assembly with the contents of the assembly named "assembly" of the archive, whose file paths are
+        # resolved with the search paths of the main project, like the paths of the main project itself.
+        self._assembly_files.append((self._output_file, self._indent, assembly_filename))
+        self._output_file = projectsinks.MemorySink()
+        self._indent = 0
+        self.__emit_file_header()
+        self.__open_element("project")
+        self.__open_element("scene")
+        self.__open_element('assembly name="assembly"')
+
+    def __close_assembly(self):
+        """
+        Close the assembly element opened by __open_assembly(). In split projects, the assembly file
+        is written by the geometry thread pool, unless the file on disk has the same content.
+        """
+
+        if not self._split_assemblies:
+            self.__close_element("assembly")
+            return
+
+        self.__close_element("assembly")
+        self.__close_element("scene")
+        self.__close_element("project")
+        content = self._output_file.getvalue().encode("utf-8")
+        (self._output_file, self._indent, assembly_filename) = self._assembly_files.pop()
+
+        content_hash = hashlib.sha1(content).hexdigest()
+        if self._mesh_cache.is_current(assembly_filename, content_hash):
+            return
+
+        meshes_path = os.path.join(self._root_path, "meshes")
+        if not os.path.exists(meshes_path):
+            os.mkdir(meshes_path)
+        assembly_filepath = os.path.join(meshes_path, assembly_filename)
+        self.__progress("Exporting assembly to {0}...".format(assembly_filename))
+        error_message = "Could not write to {0}.".format(assembly_filepath)
+        self.__write_geometry_file(assembly_filename, content_hash, error_message, write_assembly_file, content, assembly_filepath)
+
     # --------------------------------
     def __emit_object_assembly(self, scene, object):
         """Write an assembly for an object with transformation motion blur."""
 
         object_name = object.name
-        self.__open_element('assembly name="%s"' % object_name)
+        self.__open_assembly(object_name)
         self.__emit_physical_surface_shader_element()
         self.__emit_default_material(scene)
         self.__emit_geometric_object(scene, object, True)
-        self.__close_element("assembly")
+        self.__close_assembly()
 
     # --------------------------------
     def __emit_dupli_assembly(self, scene, object, matrices):
@@ -215,11 +364,11 @@ class Writer(object):
         self._assembly_count[object_name] = instance_index
 
         assembly_name = "%s_%d" % (object_name, instance_index)
-        self.__open_element('assembly name="%s"' % assembly_name)
+        self.__open_assembly(assembly_name)
         self.__emit_physical_surface_shader_element()
         self.__emit_default_material(scene)
-        self.__emit_dupli_object(scene, object, matrices, True, new_assembly=True)
-        self.__close_element("assembly")
+        self.__emit_dupli_object(scene, object, identity_matrices, True, new_assembly=True)
+        self.__close_assembly()
         # Emit an instance of the dupli object assembly.
         self.__emit_dupli_assembly_instance(scene, assembly_name, matrices)
 
@@ -237,12 +386,9 @@ class Writer(object):
 
         self.__open_element('assembly_instance name="%s.instance_%d" assembly="%s"' % (assembly_name, instance_index, assembly_name))
 
-        instance_matrix = self._global_matrix * matrices[0].copy()
-        next_matrix = self._global_matrix * matrices[1].copy()
-
         # Emit transformation matrices with their respective times.
-        self.__emit_transform_element(instance_matrix, 0)
-        self.__emit_transform_element(next_matrix, 1)
+        for time, matrix in zip(self._motion_samples.times, matrices):
+            self.__emit_transform_element(self._global_matrix * matrix, time)
         self.__close_element("assembly_instance")
 
     # --------------------------------
@@ -256,34 +402,52 @@ class Writer(object):
                 else:
                     self._dupli_objects.clear()
                     if util.ob_mblur_enabled(object, scene):
+                        # Objects and instances that did not move during the shutter interval are
+                        # emitted as plain object instances in the scene assembly.
                         if object.is_duplicator and object.dupli_type in {'VERTS', 'FACES'}:
                             # Motion blur enabled on a dupli parent
-                            self._dupli_objects = util.get_instances(object, scene)
-                            for dupli_obj in self._dupli_objects:
-                                # Each "dupli" in dupli_objects is a nested list: [dupli.object, [object.matrix1, object.matrix2]]
-                                inst_mats = dupli_obj[1]
-                                self.__emit_dupli_assembly(scene, dupli_obj[0], inst_mats)
+                            self.__emit_moving_instances(scene, self._motion_samples.get_dupli_instances(object))
 
                         elif util.is_psys_emitter(object):
                             # Motion blur enabled on a particle system emitter.
-                            particle_obs = util.get_psys_instances(object, scene)
-                            for ob in particle_obs:  # each 'ob' is a particle, as dict key
-                                # The value is a list: dupli.object and another list of two matrices
-                                dupli_obj = particle_obs[ob][0]  # The dupli.object
-                                inst_mats = particle_obs[ob][1]  # The list of matrices
-                                self.__emit_dupli_assembly(scene, dupli_obj, inst_mats)
+                            self.__emit_moving_instances(scene, self._motion_samples.get_particle_instances(object))
 
                             if util.render_emitter(object):
-                                self.__emit_object_assembly(scene, object)
-                                self.__emit_assembly_instance(scene, obj=object)
+                                self.__emit_moving_object(scene, object)
                         else:
                             # No duplis, no particle systems.
-                            self.__emit_object_assembly(scene, object)
-                            self.__emit_assembly_instance(scene, obj=object)
+                            self.__emit_moving_object(scene, object)
                     else:
                         # No motion blur enabled.
                         self.__emit_geometric_object(scene, object, False)
 
+    def __emit_moving_instances(self, scene, instances):
+        """
+        Emit the instances of a dupli parent or particle emitter with object motion blur.
+        Each entry of instances is [dupli object, (instance count, sample count, 4, 4) array of matrices].
+        Instances that did not move during the shutter interval are emitted together as plain object instances.
+        """
+
+        for dupli_object, matrices in instances:
+            static_instances = motionsamples.get_static_instances(matrices)
+            if static_instances.any():
+                self.__emit_dupli_object(scene, dupli_object, matrices[static_instances, 0], False)
+            for instance_matrices in matrices[~static_instances].tolist():
+                self.__emit_dupli_assembly(scene, dupli_object, [mathutils.Matrix(matrix) for matrix in instance_matrices])
+
+    def __emit_moving_object(self, scene, object):
+        """
+        Emit an object with object motion blur in its own assembly,
+        or as a plain object instance if it did not move during the shutter interval.
+        """
+
+        matrices = self._motion_samples.get_object_matrices(object)
+        if motionsamples.is_static(matrices):
+            self.__emit_dupli_object(scene, object, np.array([matrices[0]], dtype=np.float32), False)
+        else:
+            self.__emit_object_assembly(scene, object)
+            self.__emit_assembly_instance(scene, obj=object)
+
     def __emit_geometric_object(self, scene, object, enable_object_blur=False):
         """
         Get scene objects and instances for emitting.
@@ -301,33 +465,35 @@ class Writer(object):
             if object.is_duplicator:
                 self._dupli_objects.extend(util.get_instances(object, scene))
                 if util.is_psys_emitter(object) and util.render_emitter(object):
-                    self._dupli_objects.append([object, object.matrix_world])
+                    self._dupli_objects.append([object, np.array([object.matrix_world], dtype=np.float32)])
 
             # No duplis or particle systems.
             else:
-                self._dupli_objects = [(object, object.matrix_world)]
+                self._dupli_objects = [(object, np.array([object.matrix_world], dtype=np.float32))]
 
         # Motion blur is enabled
         else:
-            self._dupli_objects = [(object, identity_matrix)]
+            self._dupli_objects = [(object, identity_matrices)]
 
         # Emit the dupli objects.
         for dupli_object in self._dupli_objects:
             self.__emit_dupli_object(scene, dupli_object[0], dupli_object[1], enable_object_blur)
 
     # --------------------------------
-    def __emit_dupli_object(self, scene, object, object_matrix, enable_object_blur, new_assembly=False):
-        """Emit objects / dupli objects."""
+    def __emit_dupli_object(self, scene, object, object_matrices, enable_object_blur, new_assembly=False):
+        """Emit objects / dupli objects, given an (instance count, 4, 4) array of instance matrices."""
 
-        asr_scn = scene.appleseed
-        shutter_open = asr_scn.shutter_open if asr_scn.enable_motion_blur else 0
-        current_frame = scene.frame_current
         """
         Emit the mesh object (and write it to disk) only the first time it is encountered.
+        Objects sharing a mesh datablock without render modifiers only emit instances of a single mesh object.
         If it's a new assembly (for dupli motion blur), only emit the object without tesselating mesh.
         """
+        mesh_object_name = object.name
+        if not new_assembly and not enable_object_blur:
+            mesh_object_name = self.__get_mesh_object_name(scene, object)
+
         export_mesh = True
-        if new_assembly or object.name not in self._instance_count:
+        if new_assembly or mesh_object_name not in self._instance_count:
             try:
                 # Export hair as curves, if enabled in settings.
                 export_hair = scene.appleseed.export_hair and util.has_hairsys(object)
@@ -335,42 +501,36 @@ class Writer(object):
                     if not util.render_emitter(object):
                         export_mesh = False
 
-                # If deformation motion blur is enabled, write deformation mesh to disk.
+                # If deformation motion blur is enabled, write the hair curves sampled after shutter open to disk.
+                # Deformation meshes are written along with the mesh at shutter open, see __emit_mesh_object().
                 if util.def_mblur_enabled(object, scene):
-                    scene.frame_set(current_frame, subframe=asr_scn.shutter_close)
-                    # Tessellate the object at the next frame to export mesh for deformation motion blur.
-                    if export_mesh:
-                        def_mesh = object.to_mesh(scene, True, 'RENDER', calc_tessface=True)
-                        mesh_faces = def_mesh.tessfaces
-                        mesh_uvtex = def_mesh.tessface_uv_textures
-                        # Write the deformation motion blur mesh to disk.
-                        self.__emit_def_mesh_object(scene, object, def_mesh, mesh_faces, mesh_uvtex)
-                        # Delete the mesh.
-                        bpy.data.meshes.remove(def_mesh)
-
                     if export_hair:
                         for mod in object.modifiers:
                             if mod.type == 'PARTICLE_SYSTEM' and mod.show_render:
                                 psys = mod.particle_system
                                 if psys.settings.type == 'HAIR' and psys.settings.render_type == 'PATH':
-                                    mat_index = psys.settings.material - 1
-                                    material = object.material_slots[mat_index].name
-                                    # Write the deformation motion blur hair mesh to disk.
-                                    self.__emit_def_curves_object(scene, object, psys.name)
-
-                    # Reset the timeline to current frame
-                    scene.frame_set(current_frame)
+                                    # Write the deformation motion blur hair curves to disk.
+                                    self._def_mblur_obs["_".join([object.name, psys.name])] = []
+                                    for sample_index, def_curves_data in enumerate(self._motion_samples.get_deformation_curves(object, psys), 1):
+                                        self.__emit_def_curves_object(scene, object, psys, def_curves_data, sample_index)
 
-                # Tessellate the object at shutter open.
-                scene.frame_set(current_frame, subframe=shutter_open)
+                # Tessellate the object at shutter open, unless its geometry file is still current.
                 if export_mesh:
-                    mesh = object.to_mesh(scene, True, 'RENDER', calc_tessface=True)
-                    mesh_faces = mesh.tessfaces
-                    mesh_uvtex = mesh.tessface_uv_textures
-                    # Write the geometry to disk and emit a mesh object element.
-                    self._mesh_parts[object.name] = self.__emit_mesh_object(scene, object, mesh, mesh_faces, mesh_uvtex, new_assembly)
-                    # Delete the mesh
-                    bpy.data.meshes.remove(mesh)
+                    geometry = self.__get_unchanged_geometry(scene, object)
+                    if geometry is not None:
+                        (mesh_filename, content_hash, mesh_parts) = geometry
+                        self._geometry[object.name] = geometry
+                        self._exported_geometry.add(object.name)
+                        self.__emit_object_element(object.name, mesh_filename, object, scene)
+                        self._mesh_parts[object.name] = mesh_parts
+                    else:
+                        mesh = self._motion_samples.get_shutter_open_mesh(object)
+                        mesh_faces = mesh.tessfaces
+                        mesh_uvtex = mesh.tessface_uv_textures
+                        # Write the geometry to disk and emit a mesh object element.
+                        self._mesh_parts[object.name] = self.__emit_mesh_object(scene, object, mesh, mesh_faces, mesh_uvtex, new_assembly)
+                        # Delete the mesh
+                        bpy.data.meshes.remove(mesh)
 
                 if export_hair:
                     for mod in object.modifiers:
@@ -383,19 +543,85 @@ class Writer(object):
                                 self._mesh_parts["_".join([object.name, psys.name])] = self.__emit_curves_object(scene, object, psys, new_assembly)
 
                                 # Emit the curves object instance.
-                                self.__emit_mesh_object_instance(scene, object, self._global_matrix, new_assembly,
+                                self.__emit_mesh_object_instance(scene, object, np.array([self._global_matrix], dtype=np.float32), new_assembly,
                                                                  hair=True, hair_material=material, psys_name=psys.name)
 
-                # Reset timeline.
-                scene.frame_set(current_frame)
-
             except RuntimeError:
                 self.__info("Skipping object '{0}' of type '{1}' because it could not be converted to a mesh.".format(object.name, object.type))
                 return
 
-        # Emit the object instance.
+        # Emit the object instances.
         if export_mesh:
-            self.__emit_mesh_object_instance(scene, object, object_matrix, new_assembly)
+            self.__emit_mesh_object_instance(scene, object, object_matrices, new_assembly)
+
+    def __needs_shutter_open_mesh(self, scene, object):
+        """Return True if an exported object will probably be tessellated, to tessellate it along with the motion samples."""
+
+        if scene.appleseed.export_hair and util.has_hairsys(object) and not util.render_emitter(object):
+            return False
+        if self.__is_mesh_shareable(scene, object):
+            # Only the first user of a mesh datablock is tessellated.
+            if object.data in self._shutter_open_mesh_data:
+                return False
+            self._shutter_open_mesh_data.add(object.data)
+        return self.__get_unchanged_geometry(scene, object) is None
+
+    def __get_unchanged_geometry(self, scene, object):
+        """
+        Return the (mesh file name, content hash, mesh parts) of the geometry file written for an object by
+        the previous export, if the object was not updated since and the file is still current, or None.
+        """
+
+        if scene.appleseed.export_mode not in CachedExportModes or not scene.appleseed.generate_mesh_files:
+            return None
+
+        # Deformation motion blur samples the geometry at other times, it is always exported.
+        if util.def_mblur_enabled(object, scene) or exportstate.is_geometry_updated(self._updated, object):
+            return None
+
+        geometry = self._export_state.geometry.get(object.name)
+        if geometry is None:
+            return None
+        (mesh_filename, content_hash, mesh_parts) = geometry
+        if mesh_filename != object.name + meshdata.get_mesh_file_extension(scene.appleseed.mesh_format):
+            return None
+        if not self._mesh_cache.is_current(mesh_filename, content_hash):
+            return None
+        return geometry
+
+    def __get_mesh_object_name(self, scene, object):
+        """
+        Return the name of the mesh object holding the geometry of an object.
+        Objects using the same mesh datablock with no render modifiers share the mesh object of the first of them.
+        """
+
+        if object.name not in self._mesh_object_names:
+            mesh_object_name = object.name
+            if self.__is_mesh_shareable(scene, object):
+                mesh_object_name = self._shared_meshes.setdefault(object.data, object.name)
+            self._mesh_object_names[object.name] = mesh_object_name
+
+        mesh_object_name = self._mesh_object_names[object.name]
+        if mesh_object_name != object.name and mesh_object_name not in self._instance_count:
+            # The first user of the mesh could not be exported, this object takes over the shared mesh.
+            mesh_object_name = object.name
+            self._shared_meshes[object.data] = mesh_object_name
+            self._mesh_object_names[object.name] = mesh_object_name
+
+        return mesh_object_name
+
+    def __is_mesh_shareable(self, scene, object):
+        """Return True if the evaluated geometry of an object only depends on its mesh datablock."""
+
+        if object.type != 'MESH':
+            return False
+
+        # Modifiers (including particle systems) make the geometry object-specific.
+        if any(modifier.show_render for modifier in object.modifiers):
+            return False
+
+        # Deformation motion blur writes a per-object mesh file.
+        return not util.def_mblur_enabled(object, scene)
 
     def __emit_curves_object(self, scene, object, psys, new_assembly=False):
         """
@@ -412,23 +638,23 @@ class Writer(object):
             curves_filepath = os.path.join(meshes_path, curves_filename)
             if not os.path.exists(meshes_path):
                 os.mkdir(meshes_path)
-            if scene.appleseed.export_mode == 'all':
-                export_curves = True
-            if scene.appleseed.export_mode == 'partial' and not os.path.exists(curves_filepath):
-                export_curves = True
-            if scene.appleseed.export_mode == 'selected' and object.name in self._selected_objects:
-                export_curves = True
-            if new_assembly and curves_name in self._instance_count:
+            export_curves = self.__is_geometry_export_needed(scene, object, curves_filepath)
+            if curves_name in self._exported_geometry:
                 export_curves = False
+            self._exported_geometry.add(curves_name)
             if export_curves:
-                # Export curves file to disk.
-                self.__progress("Exporting particle system '{0}' to {1}...".format(psys.name, curves_filename))
-                try:
-                    geometrywriter.write_curves_to_disk(object, scene, psys, curves_filepath)
-                except IOError:
-                    self.__error("While exporting particle system '{0}': could not write to {1}, skipping particle system.".format(
-                        psys.name, curves_filepath))
-                    return []
+                curves_data = self._motion_samples.get_shutter_open_curves(object, psys)
+                content_hash = None
+                if scene.appleseed.export_mode in CachedExportModes:
+                    content_hash = meshdata.get_curves_data_hash(*curves_data)
+                    export_curves = not self._mesh_cache.is_current(curves_filename, content_hash)
+                if export_curves:
+                    # Export curves file to disk.
+                    self.__progress("Exporting particle system '{0}' to {1}...".format(psys.name, curves_filename))
+                    error_message = "While exporting particle system '{0}': could not write to {1}, skipping particle system.".format(psys.name, curves_filepath)
+                    if not self.__write_geometry_file(curves_filename, content_hash, error_message,
+                                                      meshdata.write_curves_data, curves_filepath, *curves_data):
+                        return []
 
         self.__emit_curves_element(curves_name, curves_filename, object, scene)
         # Hard code one mesh part for now, since particle systems aren't split into materials.
@@ -446,36 +672,49 @@ class Writer(object):
 
         object_name = object.name
 
-        mesh_filename = object_name + ".obj"
+        mesh_filename = object_name + meshdata.get_mesh_file_extension(scene.appleseed.mesh_format)
         meshes_path = os.path.join(self._root_path, "meshes")
-        export_mesh = False
+        mesh_arrays = None
+        mesh_parts = None
+        content_hash = None
         if scene.appleseed.generate_mesh_files:
             mesh_filepath = os.path.join(meshes_path, mesh_filename)
             if not os.path.exists(meshes_path):
                 os.mkdir(meshes_path)
-            if scene.appleseed.export_mode == 'all':
-                export_mesh = True
-            if scene.appleseed.export_mode == 'partial' and not os.path.exists(mesh_filepath):
-                export_mesh = True
-            if scene.appleseed.export_mode == 'selected' and object.name in self._selected_objects:
-                export_mesh = True
-            if new_assembly and object.name in self._instance_count:
+            export_mesh = self.__is_geometry_export_needed(scene, object, mesh_filepath)
+            if object.name in self._exported_geometry:
                 export_mesh = False
+            self._exported_geometry.add(object.name)
+            if export_mesh:
+                # Only read the mesh arrays here, the file is built and written by __write_geometry_file().
+                mesh_arrays = geometrywriter.read_mesh_arrays(mesh)
+                mesh_parts = meshdata.get_mesh_parts(mesh_arrays.face_materials)
+                content_hash = None
+                if scene.appleseed.export_mode in CachedExportModes:
+                    content_hash = meshdata.get_mesh_arrays_hash(mesh_arrays, scene.appleseed.mesh_format)
+                    # Skip the mesh if the file on disk is up to date.
+                    export_mesh = not self._mesh_cache.is_current(mesh_filename, content_hash)
             if export_mesh:
                 # Export the mesh to disk.
                 self.__progress("Exporting object '{0}' to {1}...".format(object_name, mesh_filename))
-                try:
-                    mesh_parts = geometrywriter.write_mesh_to_disk(object, scene, mesh, mesh_filepath)
-                except IOError:
-                    self.__error("While exporting object '{0}': could not write to {1}, skipping this object.".format(object.name, mesh_filepath))
+                error_message = "While exporting object '{0}': could not write to {1}, skipping this object.".format(object.name, mesh_filepath)
+                if not self.__write_geometry_file(mesh_filename, content_hash, error_message,
+                                                  meshdata.write_mesh_arrays, mesh_arrays, mesh_filepath, scene.appleseed.mesh_format):
                     return []
 
-        if scene.appleseed.generate_mesh_files == False or export_mesh == False:
+        if mesh_parts is None:
             # Build a list of mesh parts just as if we had exported the mesh to disk.
-            material_indices = set()
-            for face in mesh_faces:
-                material_indices.add(face.material_index)
-            mesh_parts = map(lambda material_index: (material_index, "part_%d" % material_index), material_indices)
+            mesh_parts = meshdata.get_mesh_parts(geometrywriter.get_face_materials(mesh))
+
+        # Write the deformation motion blur meshes, which are compared against the mesh at shutter open.
+        if util.def_mblur_enabled(object, scene):
+            if mesh_arrays is None:
+                mesh_arrays = geometrywriter.read_mesh_arrays(mesh)
+            self.__emit_def_mesh_objects(scene, object, mesh_filename, mesh_arrays)
+
+        # Record the geometry file for the next export, see __get_unchanged_geometry().
+        if content_hash is not None and mesh_parts:
+            self._geometry[object_name] = (mesh_filename, content_hash, mesh_parts)
 
         # Emit object.
         self.__emit_object_element(object_name, mesh_filename, object, scene)
@@ -487,10 +726,11 @@ class Writer(object):
 
         mesh_filename = "meshes" + os.path.sep + mesh_file
         self.__open_element('object name="' + object_name + '" model="mesh_object"')
-        if util.def_mblur_enabled(object, scene):
+        if util.def_mblur_enabled(object, scene) and self._def_mblur_obs.get(object_name):
             self.__open_element('parameters name="filename"')
             self.__emit_parameter("0", mesh_filename)
-            self.__emit_parameter("1", "meshes" + os.path.sep + self._def_mblur_obs[object_name])
+            for sample_index, def_mesh_file in enumerate(self._def_mblur_obs[object_name], 1):
+                self.__emit_parameter(str(sample_index), "meshes" + os.path.sep + def_mesh_file)
             self.__close_element("parameters")
         else:
             self.__emit_parameter("filename", mesh_filename)
@@ -501,26 +741,62 @@ class Writer(object):
 
         curves_filename = "meshes" + os.path.sep + curves_file
         self.__open_element('object name="' + curves_name + '" model="curve_object"')
-        if util.def_mblur_enabled(object, scene):
+        if util.def_mblur_enabled(object, scene) and self._def_mblur_obs.get(curves_name):
             self.__open_element('parameters name="filepath"')
             self.__emit_parameter("0", curves_filename)
-            self.__emit_parameter("1", "meshes" + os.path.sep + self._def_mblur_obs[curves_name])
+            for sample_index, def_curves_file in enumerate(self._def_mblur_obs[curves_name], 1):
+                self.__emit_parameter(str(sample_index), "meshes" + os.path.sep + def_curves_file)
             self.__close_element("parameters")
         else:
             self.__emit_parameter("filepath", curves_filename)
         self.__close_element("object")
 
-    def __emit_def_mesh_object(self, scene, object, mesh, mesh_faces, mesh_uvtex):
-        """Emit a deformation mesh object and write to disk."""
+    def __emit_def_mesh_objects(self, scene, object, mesh_filename, mesh_arrays):
+        """
+        Write the deformation meshes sampled after shutter open to disk and record the mesh file of each motion sample.
+        Samples that did not move use the mesh file at shutter open; if no sample moved, deformation blur is dropped.
+        appleseed requires all the motion samples of a mesh to have the same topology, deformation blur is dropped
+        for objects whose topology changes during the shutter interval. Samples with the same topology are laid out
+        as the mesh at shutter open, whose mesh data and hash are only built once for all the samples.
+        """
 
-        if len(mesh_faces) == 0:
-            self.__info("Skipping object '{0}' since it has no faces once converted to a mesh.".format(object.name))
-            return []
+        def_mesh_arrays_list = self._motion_samples.get_deformation_meshes(object)
+        for sample_index, def_mesh_arrays in enumerate(def_mesh_arrays_list, 1):
+            if def_mesh_arrays is not None and not meshdata.is_same_mesh_topology(mesh_arrays, def_mesh_arrays):
+                self.__warning("Topology of object '{0}' changes during the shutter interval at motion sample {1}, disabling deformation motion blur.".format(
+                    object.name, sample_index))
+                self._def_mblur_obs[object.name] = []
+                return
 
-        object_name = object.name
-        mesh_filename = object_name + "_deform.obj"
+        def_mesh_files = []
+        deformed = False
+        base_mesh_data = None
+        base_content_hash = None
+        for sample_index, def_mesh_arrays in enumerate(def_mesh_arrays_list, 1):
+            if def_mesh_arrays is None or meshdata.is_same_mesh_pose(mesh_arrays, def_mesh_arrays):
+                def_mesh_files.append(mesh_filename)
+            else:
+                if base_mesh_data is None:
+                    base_mesh_data = meshdata.build_mesh_data(mesh_arrays)
+                    if scene.appleseed.export_mode in CachedExportModes:
+                        base_content_hash = meshdata.get_mesh_arrays_hash(mesh_arrays, scene.appleseed.mesh_format)
+                def_mesh_file = self.__emit_def_mesh_object(scene, object, base_mesh_data, base_content_hash, def_mesh_arrays, sample_index)
+                if def_mesh_file is None:
+                    self._def_mblur_obs[object.name] = []
+                    return
+                def_mesh_files.append(def_mesh_file)
+                deformed = True
+
+        self._def_mblur_obs[object.name] = def_mesh_files if deformed else []
+
+    def __emit_def_mesh_object(self, scene, object, base_mesh_data, base_content_hash, def_mesh_arrays, sample_index):
+        """
+        Write the deformation mesh of a motion sample to disk and return its file name, or None if the file could not
+        be written. The mesh is laid out as base_mesh_data, the mesh data at shutter open, see meshdata.build_mesh_pose().
+        """
 
-        self._def_mblur_obs[object_name] = mesh_filename
+        object_name = object.name
+        mesh_filename = "{0}_deform_{1}{2}".format(object_name, sample_index, meshdata.get_mesh_file_extension(scene.appleseed.mesh_format))
 
         meshes_path = os.path.join(self._root_path, "meshes")
         export_mesh = False
@@ -528,27 +804,29 @@ class Writer(object):
             mesh_filepath = os.path.join(meshes_path, mesh_filename)
             if not os.path.exists(meshes_path):
                 os.mkdir(meshes_path)
-            if scene.appleseed.export_mode == 'all':
-                export_mesh = True
-            if scene.appleseed.export_mode == 'partial' and not os.path.exists(mesh_filepath):
-                export_mesh = True
-            if scene.appleseed.export_mode == 'selected' and object.name in self._selected_objects:
-                export_mesh = True
+            export_mesh = self.__is_geometry_export_needed(scene, object, mesh_filepath)
+            if export_mesh:
+                content_hash = None
+                if scene.appleseed.export_mode in CachedExportModes:
+                    content_hash = meshdata.get_mesh_pose_hash(def_mesh_arrays, base_content_hash)
+                    export_mesh = not self._mesh_cache.is_current(mesh_filename, content_hash)
             if export_mesh:
                 # Export the mesh to disk.
                 self.__progress("Exporting object '{0}' to {1}...".format(object_name, mesh_filename))
-                try:
-                    geometrywriter.write_mesh_to_disk(object, scene, mesh, mesh_filepath)
-                except IOError:
-                    self.__error("While exporting object '{0}': could not write to {1}, skipping this object.".format(object.name, mesh_filepath))
+                error_message = "While exporting object '{0}': could not write to {1}, disabling deformation motion blur.".format(object.name, mesh_filepath)
+                if not self.__write_geometry_file(mesh_filename, content_hash, error_message,
+                                                  meshdata.write_mesh_pose, def_mesh_arrays, base_mesh_data, mesh_filepath, scene.appleseed.mesh_format):
+                    return None
 
-    def __emit_def_curves_object(self, scene, object, psys):
-        """Emit a curves deformation mesh object and write to disk."""
+        return mesh_filename
+
+    def __emit_def_curves_object(self, scene, object, psys, curves_data, sample_index):
+        """Write the deformation curves of a motion sample to disk."""
 
         curves_name = "_".join([object.name, psys.name])
-        curves_filename = curves_name + "_deform.curves"
+        curves_filename = "{0}_deform_{1}.curves".format(curves_name, sample_index)
 
-        self._def_mblur_obs[curves_name] = curves_filename
+        self._def_mblur_obs[curves_name].append(curves_filename)
 
         meshes_path = os.path.join(self._root_path, "meshes")
         export_curves = False
@@ -556,32 +834,111 @@ class Writer(object):
             curves_filepath = os.path.join(meshes_path, curves_filename)
             if not os.path.exists(meshes_path):
                 os.mkdir(meshes_path)
-            if scene.appleseed.export_mode == 'all':
-                export_curves = True
-            if scene.appleseed.export_mode == 'partial' and not os.path.exists(curves_filepath):
-                export_curves = True
-            if scene.appleseed.export_mode == 'selected' and object.name in self._selected_objects:
-                export_curves = True
+            export_curves = self.__is_geometry_export_needed(scene, object, curves_filepath)
             if export_curves:
-                # Export curves file to disk.
-                self.__progress("Exporting particle system '{0}' to {1}...".format(psys.name, curves_filename))
+                content_hash = None
+                if scene.appleseed.export_mode in CachedExportModes:
+                    content_hash = meshdata.get_curves_data_hash(*curves_data)
+                    export_curves = not self._mesh_cache.is_current(curves_filename, content_hash)
+                if export_curves:
+                    # Export curves file to disk.
+                    self.__progress("Exporting particle system '{0}' to {1}...".format(psys.name, curves_filename))
+                    error_message = "While exporting particle system '{0}': could not write to {1}, skipping particle system.".format(psys.name, curves_filepath)
+                    self.__write_geometry_file(curves_filename, content_hash, error_message,
+                                               meshdata.write_curves_data, curves_filepath, *curves_data)
+
+    def __is_geometry_export_needed(self, scene, object, filepath):
+        """Return True if the geometry file of an object must be (re)written according to the export mode."""
+
+        export_mode = scene.appleseed.export_mode
+        if export_mode == 'all' or export_mode in CachedExportModes:
+            # In cached modes, the content hash decides whether the file is actually written.
+            return True
+        if export_mode == 'selected':
+            return object.name in self._selected_objects
+        return False
+
+    def __write_geometry_file(self, filename, content_hash, error_message, write_function, *args):
+        """
+        Write a geometry file by calling write_function(*args).
+        If geometry is written in parallel, the call is queued on the thread pool and True is returned right away,
+        and the export fails if the file can not be written; otherwise return False if the file could not be written.
+        """
+
+        # Replace the file rather than overwrite it, it may be hard linked from the project of another frame, see renderqueue.
+        filepath = os.path.join(self._root_path, "meshes", filename)
+        if os.path.exists(filepath):
+            try:
+                os.remove(filepath)
+            except OSError:
+                # Writing the file reports the error.
+                pass
+
+        if self._geometry_executor is None:
+            return self.__finish_geometry_job(filename, content_hash, error_message, lambda: write_function(*args))
+
+        # Bound the number of pending jobs so that extracted geometry does not pile up in memory.
+        while len(self._geometry_jobs) >= self._max_geometry_jobs:
+            self.__finish_geometry_job(*self._geometry_jobs.popleft())
+
+        future = self._geometry_executor.submit(write_function, *args)
+        self._geometry_jobs.append((filename, content_hash, error_message, future.result))
+        return True
+
+    def __finish_geometry_job(self, filename, content_hash, error_message, get_result):
+        """Wait for a geometry file to be written and update the mesh cache. Return False if writing failed."""
+
+        try:
+            get_result()
+        except IOError:
+            self._mesh_cache.invalidate(filename)
+            self.__error(error_message)
+            if self._geometry_executor is not None:
+                # Remove the partial file, the export fails.
                 try:
-                    geometrywriter.write_curves_to_disk(object, scene, psys, curves_filepath)
-                except IOError:
-                    self.__error("While exporting particle system '{0}': could not write to {1}, skipping particle system.".format(
-                        psys.name, curves_filepath))
+                    os.remove(os.path.join(self._root_path, "meshes", filename))
+                except OSError:
+                    pass
+                self._failed_geometry_files.append(filename)
+            return False
 
-    def __emit_mesh_object_instance(self, scene, object, object_matrix, new_assembly, hair=False, hair_material=None, psys_name=None):
-        """Calls __emit_object_instance_element to emit an object instance."""
+        self.__update_mesh_cache(filename, content_hash)
+        return True
 
-        object_name = "_".join([object.name, psys_name]) if hair else object.name
-        if new_assembly:
-            object_matrix = self._global_matrix * identity_matrix
+    def __finish_geometry_jobs(self):
+        """Wait for all pending geometry files to be written."""
+
+        while self._geometry_jobs:
+            self.__finish_geometry_job(*self._geometry_jobs.popleft())
+
+    def __update_mesh_cache(self, filename, content_hash):
+        """Record the content hash of a geometry file that was just written, or forget it if it is unknown."""
+
+        if content_hash is not None:
+            self._mesh_cache.update(filename, content_hash)
         else:
-            object_matrix = self._global_matrix * object_matrix
+            self._mesh_cache.invalidate(filename)
+
+    def __emit_mesh_object_instance(self, scene, object, object_matrices, new_assembly, hair=False, hair_material=None, psys_name=None):
+        """
+        Calls __emit_object_instance_elements to emit the instances of an object,
+        given an (instance count, 4, 4) array of instance matrices.
+        """
 
         if hair:
-            util.debug(object_name, object_matrix)
+            object_name = "_".join([object.name, psys_name])
+        elif new_assembly:
+            object_name = object.name
+        else:
+            # Objects sharing their geometry instantiate the same mesh object.
+            object_name = self._mesh_object_names.get(object.name, object.name)
+
+        if new_assembly:
+            object_matrices = identity_matrices
+        object_matrices = np.matmul(np.array(self._global_matrix, dtype=np.float32), object_matrices)
+
+        if hair:
+            util.debug(object_name, object_matrices)
         # Emit BSDFs and materials if they are encountered for the first time.
         for material_slot_index, material_slot in enumerate(object.material_slots):
             material = material_slot.material
@@ -593,12 +950,13 @@ class Writer(object):
                 # Need to emit material again if it's in a separate assembly.
                 self._emitted_materials[material] = self.__emit_material(material, scene)
 
-        # Figure out the instance number of this object.
-        if not new_assembly and object_name in self._instance_count:
-            instance_index = self._instance_count[object_name] + 1
+        # Figure out the instance numbers of these instances in the scene assembly.
+        # Objects emitted in their own assembly (for motion blur) are always instantiated once.
+        if new_assembly:
+            first_instance_index = 0
         else:
-            instance_index = 0
-        self._instance_count[object_name] = instance_index
+            first_instance_index = self._instance_count[object_name] + 1 if object_name in self._instance_count else 0
+            self._instance_count[object_name] = first_instance_index + len(object_matrices) - 1
 
         # Emit object parts instances.
         for (material_index, mesh_name) in self._mesh_parts[object_name]:
@@ -608,7 +966,6 @@ class Writer(object):
                 part_name = "{0}.{1}".format(object_name, mesh_name)
             else:
                 part_name = object_name
-            instance_name = "{0}.instance_{1}".format(part_name, instance_index)
             front_material_name = "__default_material"
             back_material_name = "__default_material"
             if material_index < len(object.material_slots):
@@ -619,12 +976,45 @@ class Writer(object):
                 if material:
                     front_material_name, back_material_name = self._emitted_materials[material]
 
-            if hair:
-                util.debug(object_name, object_matrix)
-            self.__emit_object_instance_element(part_name, instance_name, object_matrix, front_material_name, back_material_name, object, scene)
+            self.__emit_object_instance_elements(part_name, first_instance_index, object_matrices, front_material_name, back_material_name, object, scene)
+
+    def __emit_object_instance_elements(self, object_name, first_instance_index, instance_matrices, front_material_name, back_material_name, object, scene):
+        """
+        Emit object instance elements to the project file, one per instance matrix.
+
+        All the instances of a part only differ by their name and matrix, so the element is
+        formatted once into a template and the instances are written in chunks from the matrices.
+        """
+
+        # Format the element with placeholders for the instance number and the matrix rows.
+        output_file = self._output_file
+        self._output_file = io.StringIO()
+        try:
+            self.__emit_object_instance_element(object_name, "{0}.instance_{1}".format(object_name, InstanceIndexToken),
+                                                MatrixRowToken, front_material_name, back_material_name, object, scene)
+            template = self._output_file.getvalue()
+        finally:
+            self._output_file = output_file
+        template = template.replace("%", "%%").replace(InstanceIndexToken, "%d").replace(MatrixRowToken, "%r %r %r %r")
+
+        # Rows of the matrices in the order they are emitted, see __emit_transform_element().
+        instance_count = len(instance_matrices)
+        values = np.empty((instance_count, 17), dtype=np.float64)
+        values[:, 0] = np.arange(first_instance_index, first_instance_index + instance_count)
+        values[:, 1:5] = instance_matrices[:, 0]
+        values[:, 5:9] = instance_matrices[:, 2]
+        values[:, 9:13] = -instance_matrices[:, 1]
+        values[:, 13:17] = instance_matrices[:, 3]
+
+        for chunk_start in range(0, instance_count, InstanceChunkSize):
+            chunk = values[chunk_start:chunk_start + InstanceChunkSize].tolist()
+            self._output_file.write("".join([template % tuple(instance_values) for instance_values in chunk]))
 
     def __emit_object_instance_element(self, object_name, instance_name, instance_matrix, front_material_name, back_material_name, object, scene):
-        """Emit an object instance element to the project file."""
+        """
+        Emit an object instance element to the project file.
+        instance_matrix is either a matrix or MatrixRowToken, see __emit_object_instance_elements().
+        """
 
         self.__open_element('object_instance name="{0}" object="{1}"'.format(instance_name, object_name))
         if object.appleseed.enable_visibility_flags:
@@ -634,8 +1024,13 @@ class Writer(object):
         if object.appleseed.ray_bias_method != 'none':
             self.__emit_parameter("ray_bias_method", object.appleseed.ray_bias_method)
             self.__emit_parameter("ray_bias_distance", object.appleseed.ray_bias_distance)
-        if util.ob_mblur_enabled(object, scene):
-            self.__emit_transform_element(identity_matrix, None)
+        if instance_matrix is MatrixRowToken:
+            self.__open_element("transform")
+            self.__open_element("matrix")
+            for row in range(4):
+                self.__emit_line(MatrixRowToken)
+            self.__close_element("matrix")
+            self.__close_element("transform")
         else:
             self.__emit_transform_element(instance_matrix, None)
         self.__emit_line('<assign_material slot="0" side="front" material="{0}" />'.format(front_material_name))
@@ -684,7 +1079,40 @@ class Writer(object):
         self.__emit_material_element("__default_material", "__default_material_bsdf", "", "", "", "physical_surface_shader", scene, "")
 
     def __emit_material(self, material, scene):
-        """Write the material."""
+        """
+        Write the material. Its XML is compiled once per content hash and textures already emitted,
+        then copied, see materialcompiler.
+        """
+
+        # Materials do not change during an export, they are hashed once.
+        if material.name not in self._material_hashes:
+            self._material_hashes[material.name] = materialcompiler.get_material_hash(material, scene)
+        material_hash = self._material_hashes[material.name]
+        compiled_material = materialcompiler.find_compiled_material(material_hash, self._textures_set)
+        if compiled_material is None:
+            # Emit the material without indentation, recording the textures it looks up.
+            output_file = self._output_file
+            indent = self._indent
+            textures = set(self._textures_set)
+            self._output_file = projectsinks.MemorySink()
+            self._indent = 0
+            self._texture_lookups = []
+            try:
+                material_names = self.__emit_material_elements(material, scene)
+                content = self._output_file.getvalue()
+            finally:
+                self._output_file = output_file
+                self._indent = indent
+            compiled_material = materialcompiler.CompiledMaterial(self._texture_lookups, self._textures_set - textures, content, material_names)
+            materialcompiler.add_compiled_material(material_hash, compiled_material)
+        else:
+            self._textures_set.update(compiled_material.emitted_textures)
+
+        self._output_file.write(compiled_material.get_content(" " * (self._indent * IndentSize)))
+        return compiled_material.material_names
+
+    def __emit_material_elements(self, material, scene):
+        """Write the elements of a material."""
 
         asr_mat = material.appleseed
         asr_node_tree = asr_mat.node_tree
@@ -2179,10 +2607,12 @@ class Writer(object):
         # Nothing to do if this texture was already emitted.
 
         if not node:
-            if texture in self._textures_set:
+            texture_key = texture if scene_texture else texture.name
+            self._texture_lookups.append((texture_key, texture_key in self._textures_set))
+            if texture_key in self._textures_set:
                 return
 
-            self._textures_set.add(texture)
+            self._textures_set.add(texture_key)
 
         if scene_texture:
             # texture is an absolute file path string.
@@ -2361,31 +2791,17 @@ class Writer(object):
         self.__emit_parameter("shutter_close_time", shutter_close)
         self.__emit_parameter("near_z", appleseed_cam.near_z)
 
-        current_frame = scene.frame_current
-        scene.frame_set(current_frame, subframe=shutter_open)
-        origin_1, forward_1, up_1, target_1 = util.get_camera_matrix(camera, self._global_matrix)
-
         # Write respective transforms if using camera motion blur.
         if scene.appleseed.enable_motion_blur and scene.appleseed.enable_camera_blur:
-            scene.frame_set(current_frame, subframe=asr_scn.shutter_close)
-            origin_2, forward_2, up_2, target_2 = util.get_camera_matrix(camera, self._global_matrix)
-            # Return the timeline to original frame.
-            scene.frame_set(current_frame)
-
-            self.__open_element('transform time="0"')
-            self.__emit_line('<look_at origin="{0} {1} {2}" target="{3} {4} {5}" up="{6} {7} {8}" />'.format(
-                origin_1[0], origin_1[2], -origin_1[1],
-                target_1[0], target_1[2], -target_1[1],
-                up_1[0], up_1[2], -up_1[1]))
-            self.__close_element("transform")
-
-            self.__open_element('transform time="1"')
-            self.__emit_line('<look_at origin="{0} {1} {2}" target="{3} {4} {5}" up="{6} {7} {8}" />'.format(
-                origin_2[0], origin_2[2], -origin_2[1],
-                target_2[0], target_2[2], -target_2[1],
-                up_2[0], up_2[2], -up_2[1]))
-            self.__close_element("transform")
+            for time, (origin, forward, up, target) in zip(self._motion_samples.times, self._motion_samples.get_camera_transforms()):
+                self.__open_element('transform time="%r"' % float(time))
+                self.__emit_line('<look_at origin="{0} {1} {2}" target="{3} {4} {5}" up="{6} {7} {8}" />'.format(
+                    origin[0], origin[2], -origin[1],
+                    target[0], target[2], -target[1],
+                    up[0], up[2], -up[1]))
+                self.__close_element("transform")
         else:
+            origin_1, forward_1, up_1, target_1 = self._motion_samples.get_shutter_open_camera_transform(camera)
             self.__open_element("transform")
             self.__emit_line('<look_at origin="{0} {1} {2}" target="{3} {4} {5}" up="{6} {7} {8}" />'.format(
                 origin_1[0], origin_1[2], -origin_1[1],
@@ -2672,22 +3088,31 @@ class Writer(object):
     def __emit_final_configuration_element(self, scene):
         self.__open_element('configuration name="final" base="base_final"')
         self.__emit_common_configuration_parameters(scene, "final")
+        max_samples, passes = self.__get_sampling(scene, "final")
         self.__open_element('parameters name="generic_tile_renderer"')
-        self.__emit_parameter("min_samples", scene.appleseed.sampler_min_samples)
-        self.__emit_parameter("max_samples", scene.appleseed.sampler_max_samples)
+        self.__emit_parameter("min_samples", min(scene.appleseed.sampler_min_samples, max_samples))
+        self.__emit_parameter("max_samples", max_samples)
         self.__close_element("parameters")
         self.__close_element("configuration")
 
+    def __get_sampling(self, scene, type):
+        """Return the (max samples, passes) of a configuration, which can be overridden for the final one."""
+
+        if type == "final" and self._final_sampling is not None:
+            return self._final_sampling
+        return scene.appleseed.sampler_max_samples, scene.appleseed.renderer_passes
+
     def __emit_common_configuration_parameters(self, scene, type):
         # Interactive: always use drt
         lighting_engine = 'drt' if type == "interactive" else scene.appleseed.lighting_engine
+        max_samples, passes = self.__get_sampling(scene, type)
 
         self.__emit_parameter("pixel_renderer", scene.appleseed.pixel_sampler)
         self.__emit_parameter("lighting_engine", lighting_engine)
 
         self.__open_element('parameters name="adaptive_pixel_renderer"')
-        self.__emit_parameter("min_samples", scene.appleseed.sampler_min_samples)
-        self.__emit_parameter("max_samples", scene.appleseed.sampler_max_samples)
+        self.__emit_parameter("min_samples", min(scene.appleseed.sampler_min_samples, max_samples))
+        self.__emit_parameter("max_samples", max_samples)
         self.__emit_parameter("quality", scene.appleseed.adaptive_sampler_quality)
         self.__emit_parameter("enable_diagnostics", scene.appleseed.adaptive_sampler_enable_diagnostics)
         self.__close_element("parameters")
@@ -2695,11 +3120,11 @@ class Writer(object):
         self.__open_element('parameters name="uniform_pixel_renderer"')
         self.__emit_parameter("decorrelate_pixels", "true" if scene.appleseed.decorrelate_pixels else "false")
         self.__emit_parameter("force_antialiasing", "true" if scene.appleseed.force_aa else "false")
-        self.__emit_parameter("samples", scene.appleseed.sampler_max_samples)
+        self.__emit_parameter("samples", max_samples)
         self.__close_element("parameters")
 
         self.__open_element('parameters name="generic_frame_renderer"')
-        self.__emit_parameter("passes", scene.appleseed.renderer_passes)
+        self.__emit_parameter("passes", passes)
         self.__emit_parameter("tile_ordering", scene.appleseed.tile_ordering)
         self.__close_element("parameters")
 
@@ -2707,7 +3132,7 @@ class Writer(object):
         self.__emit_parameter("algorithm", scene.appleseed.light_sampler)
         self.__close_element("parameters")
 
-        self.__emit_parameter("shading_result_framebuffer", "permanent" if scene.appleseed.renderer_passes > 1 else "ephemeral")
+        self.__emit_parameter("shading_result_framebuffer", "permanent" if passes > 1 else "ephemeral")
 
         self.__open_element('parameters name="{0}"'.format(scene.appleseed.lighting_engine))
 
@@ -2800,7 +3225,7 @@ class Writer(object):
         """
 
         if time is not None:
-            self.__open_element('transform time="%.2f"' % time)
+            self.__open_element('transform time="%r"' % float(time))
         else:
             self.__open_element("transform")
         self.__open_element("matrix")
@@ -2833,8 +3258,7 @@ class Writer(object):
         self.__emit_line("</" + name + ">")
 
     def __emit_line(self, line):
-        self.__emit_indent()
-        self._output_file.write(line + "\n")
+        self._output_file.write(" " * (self._indent * IndentSize) + line + "\n")
 
     def __indent(self):
         self._indent += 1
@@ -2843,10 +3267,6 @@ class Writer(object):
         assert self._indent > 0
         self._indent -= 1
 
-    def __emit_indent(self):
-        IndentSize = 4
-        self._output_file.write(" " * self._indent * IndentSize)
-
     def __error(self, message):
         self.__print_message("error", message)
         # self.report({ 'ERROR' }, message)
@@ -2871,19 +3291,21 @@ class Writer(object):
         padding = " " * padding_count
         print("{0}{1} : {2}".format(severity, padding, message))
 
-    def export_preview(self, scene, file_path, mat, mesh, width, height):
+    def export_preview(self, scene, file_path, mat, mesh, width, height, sink=None):
         """
         Write the .appleseed project file for preview rendering
         """
 
         self._textures_set = set()
+        self._texture_lookups = []
+        self._material_hashes = {}
 
         asr_mat = mat.appleseed
         sphere_a = True if mesh == 'sphere_a' else False
         mesh = 'sphere' if mesh in {'sphere', 'sphere_a'} else mesh
 
         try:
-            with codecs.open(file_path, "w", "utf-8") as self._output_file:
+            with sink or projectsinks.FileSink(file_path) as self._output_file:
                 self._indent = 0
                 self.__emit_file_header()
                 aspect_ratio = self.__get_frame_aspect_ratio(scene.render)
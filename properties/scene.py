@@ -69,21 +69,72 @@ class AppleseedRenderSettings(bpy.types.PropertyGroup):
                                             min=1,
                                             max=max_threads)
 
+        cls.render_workers = bpy.props.IntProperty(name="render_workers",
+                                                   description="Number of appleseed.cli processes rendering horizontal bands of the frame, sharing the rendering threads",
+                                                   default=1,
+                                                   min=1,
+                                                   max=max_threads)
+
+        cls.frames_in_flight = bpy.props.IntProperty(name="frames_in_flight",
+                                                     description="Number of frames rendered at the same time by Render Frame Range, sharing the rendering threads",
+                                                     default=2,
+                                                     min=1,
+                                                     max=max_threads)
+
         cls.generate_mesh_files = bpy.props.BoolProperty(name="Export Geometry",
-                                                         description="Write geometry to disk as .obj files",
+                                                         description="Write geometry to disk as mesh files",
                                                          default=True)
 
         cls.export_mode = bpy.props.EnumProperty(name="Export Mode",
                                                  description="Geometry export mode",
-                                                 items=[('all', "All", "Export all geometry, overwriting existing .obj files"),
-                                                        ('partial', "Partial", "Only export geometry that has not been written to disk"),
+                                                 items=[('all', "All", "Export all geometry, overwriting existing mesh files"),
+                                                        ('cached', "Cached", "Only export geometry whose content changed since it was last written to disk"),
+                                                        ('partial', "Partial", "Same as Cached, kept for existing scenes"),
                                                         ('selected', "Selected", "Only export selected geometry")],
-                                                 default='all')
+                                                 default='cached')
+
+        cls.mesh_format = bpy.props.EnumProperty(name="Mesh Format",
+                                                 description="File format used to write geometry to disk",
+                                                 items=[('obj', "OBJ", "Write geometry as Wavefront OBJ text files"),
+                                                        ('binarymesh', "Binary Mesh", "Write geometry as appleseed binary mesh files, faster to write and to load")],
+                                                 default='obj')
+
+        cls.export_threads_auto = bpy.props.BoolProperty(name="export_threads_auto",
+                                                         description="Automatically determine the number of threads writing geometry files",
+                                                         default=True)
+
+        cls.export_threads = bpy.props.IntProperty(name="export_threads",
+                                                   description="Number of threads writing geometry files while the project is exported",
+                                                   default=threads,
+                                                   min=1,
+                                                   max=max_threads)
+
+        cls.split_assemblies = bpy.props.BoolProperty(name="split_assemblies",
+                                                      description="Write each assembly to a file of its own, only rewritten when its content changes",
+                                                      default=False)
 
         cls.clean_cache = bpy.props.BoolProperty(name="clean_cache",
                                                  description="Delete external files after rendering completes",
                                                  default=False)
 
+        cls.stream_project = bpy.props.BoolProperty(name="stream_project",
+                                                    description="Stream the exported project to appleseed.cli through a pipe instead of writing it to disk (geometry files are still written)",
+                                                    default=False)
+
+        cls.enable_checkpoints = bpy.props.BoolProperty(name="enable_checkpoints",
+                                                        description="Keep the pixels of final renders on disk while rendering, so that an interrupted render of an unchanged scene only renders the missing pixels",
+                                                        default=False)
+
+        cls.enable_result_cache = bpy.props.BoolProperty(name="enable_result_cache",
+                                                         description="Keep finished final renders on disk and show them again instantly when an unchanged scene is rendered",
+                                                         default=False)
+
+        cls.result_cache_size = bpy.props.IntProperty(name="result_cache_size",
+                                                      description="Largest size in megabytes of the finished renders kept on disk",
+                                                      default=1024,
+                                                      min=1,
+                                                      max=1024 * 1024)
+
         cls.export_hair = bpy.props.BoolProperty(name="export_hair",
                                                  description="Export hair particle systems as renderable geometry",
                                                  default=False)
@@ -163,6 +214,26 @@ class AppleseedRenderSettings(bpy.types.PropertyGroup):
                                                     min=1,
                                                     max=1000000)
 
+        cls.enable_noise_threshold = bpy.props.BoolProperty(name="enable_noise_threshold",
+                                                            description="Stop multi-pass final renders once the noise of every tile is below the noise threshold",
+                                                            default=False)
+
+        cls.noise_threshold = bpy.props.FloatProperty(name="noise_threshold",
+                                                      description="Relative change of a tile between two consecutive passes below which it is considered converged",
+                                                      default=0.01,
+                                                      min=0.0001,
+                                                      max=1.0,
+                                                      precision=4)
+
+        cls.enable_time_budget = bpy.props.BoolProperty(name="enable_time_budget",
+                                                        description="Fit the samples of final renders to a time budget, measured with a short calibration render",
+                                                        default=False)
+
+        cls.time_budget = bpy.props.FloatProperty(name="time_budget",
+                                                  description="Time in seconds final renders should take, including calibration",
+                                                  default=60.0,
+                                                  min=1.0)
+
         cls.light_sampler = bpy.props.EnumProperty(name="Light Sampler",
                                                    description="The method used for sampling lights",
                                                    items=[('cdf', 'CDF', 'CDF'),
@@ -401,6 +472,12 @@ class AppleseedRenderSettings(bpy.types.PropertyGroup):
                                                     step=3,
                                                     precision=3)
 
+        cls.motion_blur_samples = bpy.props.IntProperty(name="motion_blur_samples",
+                                                        description="Number of transformation and deformation samples, evenly spaced between shutter open and shutter close",
+                                                        default=2,
+                                                        min=2,
+                                                        max=32)
+
     @classmethod
     def unregister(cls):
         del bpy.types.Scene.appleseed
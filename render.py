@@ -26,66 +26,261 @@
 # THE SOFTWARE.
 #
 
-import array
 import os
-import struct
+import queue
 import subprocess
-import shutil
-import tempfile
 import threading
+import time
 from shutil import copyfile
 
 import bpy
+import numpy as np
 
+from . import exportstate
+from . import projectdirs
+from . import projectsinks
 from . import projectwriter
+from . import rendercheckpoint
+from . import resultcache
+from . import tilestream
 from . import util
 
+# Minimum interval in seconds between two updates of the displayed render result.
+FramebufferFlushInterval = 0.1
+
+# Color of the brackets highlighting the tiles being rendered.
+TileHighlightColor = np.array([1.0, 1.0, 1.0, 1.0], dtype=np.float32)
+
+# Interval in seconds at which received pixels are written to the render checkpoint.
+CheckpointFlushInterval = 10.0
+
+# Samples per pixel and fraction of the render window rendered to calibrate time-budgeted renders.
+CalibrationSamples = 4
+CalibrationFraction = 0.1
+
+
+def get_budget_sampling(render_time, pixel_samples_per_second, pixel_count, passes):
+    """
+    Return the (max samples, passes) fitting a render of pixel_count pixels in render_time seconds.
+    The passes of multi-pass renders are kept when possible, with fewer samples per pass.
+    """
+
+    samples = max(1, int(render_time * pixel_samples_per_second / pixel_count))
+    passes = max(1, min(passes, samples))
+    return max(1, samples // passes), passes
+
+
+# Smallest mean value of a tile used to compute its relative error, so that dark tiles do not look noisy.
+MinTileMean = 1.0e-3
+
+
+def get_tile_error(previous_pixels, pixels):
+    """
+    Estimate the relative error of a tile from two consecutive passes: the mean absolute change of its
+    color channels divided by their mean value.
+    """
+
+    change = np.abs(pixels[..., :3] - previous_pixels[..., :3]).mean()
+    return float(change / max(float(pixels[..., :3].mean()), MinTileMean))
+
+
+def feed_project(fifo_path, project):
+    """
+    Write an encoded project to a named pipe once appleseed.cli opens it for reading.
+    Runs on a feeder thread, as opening the pipe blocks until the process opens it too.
+    """
+
+    try:
+        with open(fifo_path, "wb") as fifo:
+            fifo.write(project)
+    except OSError:
+        # appleseed.cli exited before reading the whole project.
+        pass
+
 
 class RenderAppleseed(bpy.types.RenderEngine):
     bl_idname = 'APPLESEED_RENDER'
     bl_label = 'appleseed'
     bl_use_preview = True
 
-    # This lock allows to serialize renders.
-    render_lock = threading.Lock()
-
     def __init__(self):
-        pass
+        self._noise_threshold = None
+        self._pass_counts = None
+
+        # Encoded project streamed to appleseed.cli through named pipes, see __open_project_input().
+        self._streamed_project = None
+        self._project_feeders = []
 
     def update(self, data, scene):
-        pass
+        # Catch the updates that the scene update handler did not see yet.
+        exportstate.get_export_state(scene).record_updates(data)
 
     def render(self, scene):
-        with RenderAppleseed.render_lock:
-            if self.is_preview:
-                if not bpy.app.background:
-                    self.__render_material_preview(scene)
-            else:
-                self.__render_scene(scene)
+        # Each render works in its own directory, so renders (and Blender instances) can run concurrently.
+        if self.is_preview:
+            if not bpy.app.background:
+                self.__render_material_preview(scene)
+        else:
+            self.__render_scene(scene)
 
     def __render_scene(self, scene):
         """
         Export and render the scene.
         """
 
-        # Name and location of the exported project.
-        project_dir = os.path.join(tempfile.gettempdir(), "blenderseed", "render")
+        # Name and location of the exported project, in a directory of its own.
+        try:
+            project_dir = projectdirs.create_session_dir("render")
+        except os.error:
+            self.report({"ERROR"}, "A directory could not be created in {0}. Check directory permissions.".format(projectdirs.SessionsDir))
+            return
+
+        try:
+            self.__render_session(scene, project_dir)
+        finally:
+            # Directories that are kept are removed by later renders once they are old enough.
+            if scene.appleseed.clean_cache:
+                projectdirs.remove_session_dir(project_dir)
+                self.report({'INFO'}, "Render Cache Deleted")
+            else:
+                projectdirs.release_session_dir(project_dir)
+
+    def __render_session(self, scene, project_dir):
+        """
+        Export and render the scene in a session directory.
+        """
+
         project_filepath = os.path.join(project_dir, "render.appleseed")
 
-        # Create target directories if necessary.
-        if not os.path.exists(project_dir):
+        # Start from the geometry files of previous renders, only changed meshes are written again.
+        projectdirs.seed_meshes(project_dir)
+
+        # Generate project on disk.
+        # Time-budgeted renders are first exported with few samples, to measure the rendering speed.
+        # Streamed projects are kept in memory and never written to disk, only their geometry files are.
+        time_budget = scene.appleseed.time_budget if scene.appleseed.enable_time_budget else None
+        export_start_time = time.time()
+        if not self.__export_project(scene, project_filepath, (CalibrationSamples, 1) if time_budget is not None else None):
+            return
+        projectdirs.publish_meshes(project_dir)
+        export_time = time.time() - export_start_time
+
+        # Identify the render by the content of the project and the settings passed to appleseed.cli.
+        (width, height) = util.get_render_resolution(scene)
+        (min_x, min_y, max_x, max_y) = self.__get_render_window(scene, width, height)
+        project_hash = None
+        if scene.appleseed.enable_checkpoints or scene.appleseed.enable_result_cache:
             try:
-                os.makedirs(project_dir)
-            except os.error:
-                self.report({"ERROR"}, "The directory {0} could not be created. Check directory permissions.".format(project_dir))
+                project_hash = rendercheckpoint.get_project_hash(project_filepath, (width, height, min_x, min_y, max_x, max_y,
+                                                                                    scene.appleseed.renderer_passes, self.__get_noise_threshold(scene),
+                                                                                    time_budget), self._streamed_project)
+            except (IOError, OSError) as e:
+                self.report({'WARNING'}, "Could not read the exported project: {0}.".format(e))
+
+        # Show the result of an identical render right away.
+        result_cache = None
+        if project_hash is not None and scene.appleseed.enable_result_cache:
+            result_cache = resultcache.ResultCache(projectdirs.ResultsDir, scene.appleseed.result_cache_size * 1024 * 1024)
+            pixels = result_cache.get(project_hash)
+            if pixels is not None and pixels.shape == (max_y - min_y + 1, max_x - min_x + 1, 4):
+                self.__show_result(pixels)
+                self.report({'INFO'}, "Reused the result of an identical render.")
                 return
 
-        # Generate project on disk.
-        writer = projectwriter.Writer()
-        writer.write(scene, project_filepath)
+        # Fit the samples of the final configuration to the time budget. The budget starts with the first export,
+        # the time left after calibrating includes exporting again and loading the final project.
+        passes = scene.appleseed.renderer_passes
+        deadline = None
+        if time_budget is not None:
+            calibration = self.__calibrate(scene, project_filepath)
+            if calibration is None:
+                if not self.test_break():
+                    self.report({'ERROR'}, "Could not calibrate the render for its time budget.")
+                return
+            load_time, pixel_samples_per_second = calibration
+            render_time = export_start_time + time_budget - time.time() - export_time - load_time
+            sampling = get_budget_sampling(render_time, pixel_samples_per_second, (max_x - min_x + 1) * (max_y - min_y + 1), passes)
+            self.report({'INFO'}, "Rendering {0} samples per pass, {1} passes, to fit the time budget.".format(*sampling))
+            passes = sampling[1]
+            if not self.__export_project(scene, project_filepath, sampling):
+                return
+            deadline = export_start_time + time_budget
+
+        # Keep received pixels on disk, to resume the render if it is interrupted.
+        # Time-budgeted renders are not resumed, their sampling depends on the calibration.
+        checkpoint = None
+        if project_hash is not None and scene.appleseed.enable_checkpoints and time_budget is None:
+            try:
+                checkpoint = rendercheckpoint.RenderCheckpoint(projectdirs.CheckpointsDir, project_hash,
+                                                               max_x - min_x + 1, max_y - min_y + 1, passes)
+            except (IOError, OSError) as e:
+                self.report({'WARNING'}, "Could not create a render checkpoint: {0}.".format(e))
 
         # Render project.
-        self.__render_project_file(scene, project_filepath, project_dir)
+        completed = self.__render_project_file(scene, project_filepath, checkpoint, passes, deadline)
+
+        # Keep the result of a complete render for identical renders.
+        # The framebuffer only holds rendered pixels, tile highlights are drawn in an overlay.
+        if completed and result_cache is not None:
+            try:
+                result_cache.put(project_hash, np.ascontiguousarray(self._framebuffer, dtype=np.float32))
+            except (IOError, OSError) as e:
+                self.report({'WARNING'}, "Could not store the render result in the cache: {0}.".format(e))
+
+    def __export_project(self, scene, project_filepath, final_sampling):
+        """
+        Export the scene to project_filepath, or to memory when the project is streamed to appleseed.cli.
+        Return False if the project could not be exported.
+        """
+
+        writer = projectwriter.Writer()
+        if scene.appleseed.stream_project and hasattr(os, "mkfifo"):
+            sink = projectsinks.MemorySink()
+            exported = writer.write(scene, project_filepath, final_sampling=final_sampling, sink=sink)
+            self._streamed_project = sink.getvalue().encode("utf-8")
+        else:
+            exported = writer.write(scene, project_filepath, final_sampling=final_sampling)
+            self._streamed_project = None
+        if not exported:
+            self.report({'ERROR'}, "Could not export the scene to {0}, see the console for details.".format(project_filepath))
+        return exported
+
+    def __open_project_input(self, project_filepath, name):
+        """
+        Return the project path to pass to an appleseed.cli process. Streamed projects are fed to each
+        process through a named pipe of its own, created next to project_filepath so that relative paths
+        to geometry files are resolved the same way.
+        """
+
+        if self._streamed_project is None:
+            return project_filepath
+
+        fifo_path = os.path.join(os.path.dirname(project_filepath), "{0}.appleseed".format(name))
+        if os.path.exists(fifo_path):
+            os.remove(fifo_path)
+        os.mkfifo(fifo_path)
+        feeder = threading.Thread(target=feed_project, args=(fifo_path, self._streamed_project))
+        feeder.daemon = True
+        feeder.start()
+        self._project_feeders.append((feeder, fifo_path))
+        return fifo_path
+
+    def __close_project_inputs(self):
+        """End the feeder threads of streamed projects, after their appleseed.cli processes terminated, and remove the pipes."""
+
+        for feeder, fifo_path in self._project_feeders:
+            while feeder.is_alive():
+                # Unblock a feeder still waiting for its process to open the pipe.
+                try:
+                    os.close(os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK))
+                except OSError:
+                    pass
+                feeder.join(timeout=tilestream.ChunkPollInterval)
+            try:
+                os.remove(fifo_path)
+            except OSError:
+                pass
+        self._project_feeders = []
 
     def __render_material_preview(self, scene):
         """
@@ -116,26 +311,32 @@ class RenderAppleseed(bpy.types.RenderEngine):
         if not likely_materials:
             return
 
-        # Build the path to the output preview project.
-        preview_output_dir = os.path.join(tempfile.gettempdir(), "blenderseed", "material_preview")
+        # Build the path to the output preview project, in a directory of its own.
+        try:
+            preview_output_dir = projectdirs.create_session_dir("material_preview")
+        except os.error:
+            self.report({"ERROR"}, "A directory could not be created in {0}. Check directory permissions.".format(projectdirs.SessionsDir))
+            return
         preview_project_filepath = os.path.join(preview_output_dir, "material_preview.appleseed")
 
-        # Create target directories if necessary.
-        if not os.path.exists(preview_output_dir):
-            try:
-                os.makedirs(preview_output_dir)
-            except os.error:
-                self.report({"ERROR"}, "The directory {0} could not be created. Check directory permissions.".format(preview_output_dir))
-                return
+        try:
+            self.__render_material_preview_project(scene, preview_output_dir, preview_project_filepath, likely_materials[0], width, height)
+        finally:
+            projectdirs.remove_session_dir(preview_output_dir)
+
+    def __render_material_preview_project(self, scene, preview_output_dir, preview_project_filepath, prev_mat, width, height):
+        """
+        Export and render the material preview project.
+        """
 
-        # Copy assets from template project to output directory.
+        # Link (or copy) assets from template project to output directory.
         preview_template_dir = os.path.join(os.sep.join(util.realpath(__file__).split(os.sep)[:-1]), "mat_preview")
-        existing_files = os.listdir(preview_output_dir)
         for item in os.listdir(preview_template_dir):
-            if item not in existing_files:
+            try:
+                os.link(os.path.join(preview_template_dir, item), os.path.join(preview_output_dir, item))
+            except OSError:
                 copyfile(os.path.join(preview_template_dir, item), os.path.join(preview_output_dir, item))
 
-        prev_mat = likely_materials[0]
         prev_type = prev_mat.preview_render_type.lower()
 
         # Export the project.
@@ -153,12 +354,47 @@ class RenderAppleseed(bpy.types.RenderEngine):
         # Render the project.
         self.__render_project_file(scene, preview_project_filepath)
 
-    def __render_project_file(self, scene, project_filepath, project_dir=None):
+    def __get_render_window(self, scene, width, height):
+        """Return the image-space render window (min_x, min_y, max_x, max_y) for a render resolution."""
+
+        if scene.render.use_border:
+            min_x = int(scene.render.border_min_x * width)
+            min_y = height - int(scene.render.border_max_y * height)
+            max_x = int(scene.render.border_max_x * width) - 1
+            max_y = height - int(scene.render.border_min_y * height) - 1
+        else:
+            min_x = 0
+            min_y = 0
+            max_x = width - 1
+            max_y = height - 1
+        return min_x, min_y, max_x, max_y
+
+    def __get_noise_threshold(self, scene):
+        """Return the relative error at which a multi-pass render is stopped, or None to render all the passes."""
+
+        asr_scn = scene.appleseed
+        if asr_scn.enable_noise_threshold and asr_scn.renderer_passes > 1:
+            return asr_scn.noise_threshold
+        return None
+
+    def __show_result(self, pixels):
+        """Display a complete framebuffer of the render window."""
+
+        self._framebuffer = pixels
+        self.__clear_highlights()
+        self.total_pixels = self.rendered_pixels = 1
+        self._dirty_regions = {}
+        self.__mark_dirty(0, 0, pixels.shape[1] - 1, pixels.shape[0] - 1)
+        self.__flush_framebuffer()
+
+    def __get_appleseed_bin_dir(self):
+        """Return the folder containing the appleseed.cli executable, or None after reporting an error."""
+
         # Check that the path to the bin folder is set.
         appleseed_bin_dir = bpy.context.user_preferences.addons['blenderseed'].preferences.appleseed_binary_directory
         if not appleseed_bin_dir:
             self.report({'ERROR'}, "The path to the folder containing the appleseed.cli executable has not been specified. Set the path in the add-on user preferences.")
-            return
+            return None
 
         # Properly handle relative Blender paths.
         appleseed_bin_dir = util.realpath(appleseed_bin_dir)
@@ -166,162 +402,421 @@ class RenderAppleseed(bpy.types.RenderEngine):
         # Check that the path to the bin folder indeed points to a folder.
         if not os.path.isdir(appleseed_bin_dir):
             self.report({'ERROR'}, "The path to the folder containing the appleseed.cli executable was set to {0} but this does not appear to be a valid folder.".format(appleseed_bin_dir))
-            return
+            return None
 
-        # Compute the path to the appleseed.cli executable.
-        appleseed_bin_path = os.path.join(appleseed_bin_dir, "appleseed.cli")
+        return appleseed_bin_dir
 
-        # Compute render resolution.
-        (width, height) = util.get_render_resolution(scene)
-
-        # Rendered pixel total
-        self.rendered_pixels = 0
+    def __calibrate(self, scene, project_filepath):
+        """
+        Render a band of the render window of a project exported with CalibrationSamples samples per pixel.
+        Return the time appleseed.cli took to load the project and the pixel samples it rendered per second,
+        or None if the calibration render did not complete.
+        """
 
-        # Compute render window.
-        if scene.render.use_border:
-            min_x = int(scene.render.border_min_x * width)
-            min_y = height - int(scene.render.border_max_y * height)
-            max_x = int(scene.render.border_max_x * width) - 1
-            max_y = height - int(scene.render.border_min_y * height) - 1
-        else:
-            min_x = 0
-            min_y = 0
-            max_x = width - 1
-            max_y = height - 1
+        appleseed_bin_dir = self.__get_appleseed_bin_dir()
+        if appleseed_bin_dir is None:
+            return None
+        appleseed_bin_path = os.path.join(appleseed_bin_dir, "appleseed.cli")
 
-        # Compute total pixel count.
-        self.total_pixels = (max_x - min_x + 1) * (max_y - min_y + 1) * scene.appleseed.renderer_passes
+        # Render a band in the middle of the render window.
+        (width, height) = util.get_render_resolution(scene)
+        (min_x, min_y, max_x, max_y) = self.__get_render_window(scene, width, height)
+        band_height = max(1, int((max_y - min_y + 1) * CalibrationFraction))
+        band_min_y = min_y + (max_y - min_y + 1 - band_height) // 2
+        window = (min_x, band_min_y, max_x, band_min_y + band_height - 1)
 
-        # Launch appleseed.cli.
         threads = 'auto' if scene.appleseed.threads_auto else str(scene.appleseed.threads)
         cmd = (appleseed_bin_path,
-               project_filepath,
+               self.__open_project_input(project_filepath, "calibration"),
                '--to-stdout',
                '--threads', threads,
                '--message-verbosity', 'warning',
                '--resolution', str(width), str(height),
-               '--window', str(min_x), str(min_y), str(max_x), str(max_y))
+               '--window', str(window[0]), str(window[1]), str(window[2]), str(window[3]))
+
+        self.update_stats("", "appleseed: Calibrating")
+        start_time = time.time()
         try:
             process = subprocess.Popen(cmd, cwd=appleseed_bin_dir, env=os.environ.copy(), stdout=subprocess.PIPE)
         except OSError as e:
             self.report({'ERROR'}, "Failed to run {0} with project {1}: {2}.".format(appleseed_bin_path, project_filepath, e))
-            return
+            self.__close_project_inputs()
+            return None
+
+        chunks = queue.Queue(maxsize=tilestream.MaxQueuedChunks)
+        stop_reading = threading.Event()
+        reader = threading.Thread(target=tilestream.read_chunks, args=(process.stdout, chunks, stop_reading, window))
+        reader.daemon = True
+        reader.start()
+
+        # The project is loaded when the first tile arrives.
+        first_tile_time = None
+        completed = False
+        while not self.test_break():
+            try:
+                window, chunk = chunks.get(timeout=tilestream.ChunkPollInterval)
+            except queue.Empty:
+                continue
+            if chunk is None:
+                completed = process.wait() == 0
+                break
+            if chunk[0] == tilestream.TileDataChunk and first_tile_time is None:
+                first_tile_time = time.time()
+        end_time = time.time()
+
+        stop_reading.set()
+        process.kill()
+        reader.join()
+        process.stdout.close()
+        self.__close_project_inputs()
+
+        if not completed or first_tile_time is None:
+            return None
+
+        pixel_samples = (max_x - min_x + 1) * band_height * CalibrationSamples
+        return first_tile_time - start_time, pixel_samples / max(end_time - first_tile_time, 1.0e-3)
+
+    def __render_project_file(self, scene, project_filepath, checkpoint=None, passes=None, deadline=None):
+        """
+        Render a project with appleseed.cli. Return True if all the pixels of the render window were rendered.
+        passes is the number of passes of the project when it differs from the scene settings. Rendering stops
+        at the time given by deadline, if any, keeping the pixels received so far.
+        """
+
+        appleseed_bin_dir = self.__get_appleseed_bin_dir()
+        if appleseed_bin_dir is None:
+            return False
+
+        # Compute the path to the appleseed.cli executable.
+        appleseed_bin_path = os.path.join(appleseed_bin_dir, "appleseed.cli")
+
+        # Compute render resolution.
+        (width, height) = util.get_render_resolution(scene)
+
+        # Rendered pixel total
+        self.rendered_pixels = 0
+
+        # Compute render window.
+        (min_x, min_y, max_x, max_y) = self.__get_render_window(scene, width, height)
+
+        # Compute total pixel count.
+        if passes is None:
+            passes = scene.appleseed.renderer_passes
+        self.total_pixels = (max_x - min_x + 1) * (max_y - min_y + 1) * passes
+
+        # Tiles and highlights are composited into a framebuffer of the render window, rows from bottom to top,
+        # whose dirty regions are sent to Blender at a bounded rate. There is one dirty region per process window,
+        # so that the processes rendering separate bands do not make Blender update the whole framebuffer.
+        # With a checkpoint, the framebuffer is memory-mapped and holds the pixels of previous renders.
+        self._render_window = (min_x, min_y, max_x, max_y)
+        self._dirty_regions = {}
+        self._checkpoint = checkpoint
+
+        # Previous pass and relative error of each tile, keyed by the render window of the process rendering it
+        # and by its image-space origin, with the error estimated from its last two passes, and the tiles whose
+        # error is unknown or above the noise threshold.
+        self._noise_threshold = self.__get_noise_threshold(scene)
+        self._previous_tiles = {}
+        self._tile_errors = {}
+        self._noisy_tiles = set()
+        self._window_pixels = (max_x - min_x + 1) * (max_y - min_y + 1)
+        render_bounds = (min_x, min_y, max_x, max_y)
+        if checkpoint is None:
+            self._framebuffer = np.zeros((max_y - min_y + 1, max_x - min_x + 1, 4), dtype=np.float32)
+        else:
+            self._framebuffer = checkpoint.pixels
+        self.__clear_highlights()
+        if checkpoint is not None:
+            # Show the pixels received by previous renders right away.
+            self.rendered_pixels = checkpoint.get_completed_pass_count()
+            self.__mark_dirty(0, 0, max_x - min_x, max_y - min_y)
+            self.__flush_framebuffer()
+
+            missing_window = checkpoint.get_missing_window()
+            if missing_window is None:
+                self.__remove_checkpoint()
+                return True
+
+            # Only render the smallest window containing the incomplete pixels.
+            (x0, y0, x1, y1) = missing_window
+            render_bounds = (min_x + x0, max_y - y1, min_x + x1, max_y - y0)
+
+            # appleseed.cli averages its passes from the first one, and overwrites all the pixels of the window,
+            # so the pass counts of the window start over and count the passes of the new render.
+            checkpoint.pass_counts[y0:y1 + 1, x0:x1 + 1] = 0
+            checkpoint.flush()
+            self.rendered_pixels = checkpoint.get_completed_pass_count()
+
+        # Split the render window between the appleseed.cli processes.
+        windows = tilestream.split_render_window(*render_bounds, count=scene.appleseed.render_workers)
+
+        # Launch appleseed.cli, once per band with a share of the rendering threads.
+        total_threads = util.thread_count if scene.appleseed.threads_auto else scene.appleseed.threads
+        processes = []
+        for window_index, window in enumerate(windows):
+            if len(windows) == 1:
+                threads = 'auto' if scene.appleseed.threads_auto else str(scene.appleseed.threads)
+            else:
+                threads = str(max(1, total_threads // len(windows) + (1 if window_index < total_threads % len(windows) else 0)))
+            cmd = (appleseed_bin_path,
+                   self.__open_project_input(project_filepath, "render_{0}".format(window_index)),
+                   '--to-stdout',
+                   '--threads', threads,
+                   '--message-verbosity', 'warning',
+                   '--resolution', str(width), str(height),
+                   '--window', str(window[0]), str(window[1]), str(window[2]), str(window[3]))
+            try:
+                processes.append(subprocess.Popen(cmd, cwd=appleseed_bin_dir, env=os.environ.copy(), stdout=subprocess.PIPE))
+            except OSError as e:
+                self.report({'ERROR'}, "Failed to run {0} with project {1}: {2}.".format(appleseed_bin_path, project_filepath, e))
+                for process in processes:
+                    process.kill()
+                    process.stdout.close()
+                self.__close_project_inputs()
+                return False
 
         self.update_stats("", "appleseed: Rendering")
 
+        # Read the processes' stdout on separate threads, so that appleseed.cli never waits on a full pipe.
+        chunks = queue.Queue(maxsize=tilestream.MaxQueuedChunks)
+        stop_reading = threading.Event()
+        readers = []
+        for process, window in zip(processes, windows):
+            reader = threading.Thread(target=tilestream.read_chunks, args=(process.stdout, chunks, stop_reading, window))
+            reader.daemon = True
+            reader.start()
+            readers.append(reader)
+
+        last_flush_time = time.time()
+        last_checkpoint_time = last_flush_time
+
+        # Renders with a deadline or a noise threshold count the passes received by each pixel of the rendered bounds.
+        # Renders with a deadline keep a copy of the framebuffer each time all of its pixels received one more pass.
+        self._pass_counts = None
+        if deadline is not None or self._noise_threshold is not None:
+            self._pass_counts = np.zeros(self._framebuffer.shape[:2], dtype=np.uint16)
+        (bounds_min_x, bounds_min_y, bounds_max_x, bounds_max_y) = render_bounds
+        self._rendered_region = (slice(max_y - bounds_max_y, max_y - bounds_min_y + 1), slice(bounds_min_x - min_x, bounds_max_x - min_x + 1))
+        complete_passes = 0
+        complete_framebuffer = None
+        out_of_time = False
+
         # Update while rendering.
-        while not self.test_break():
-            # Wait for the next chunk header from the process's stdout.
-            chunk_header_data = os.read(process.stdout.fileno(), 2 * 4)
-            if not chunk_header_data:
+        running_processes = len(processes)
+        while running_processes > 0 and not self.test_break():
+            try:
+                window, chunk = chunks.get(timeout=tilestream.ChunkPollInterval)
+            except queue.Empty:
+                pass
+            else:
+                if chunk is None:
+                    # The stdout of one of the processes was closed.
+                    running_processes -= 1
+                else:
+                    chunk_type, tile_header, tile_data = chunk
+                    if chunk_type == tilestream.TileDataChunk:
+                        self.__process_tile_data_chunk(tile_header, tile_data, window)
+                    else:
+                        self.__process_tile_highlight_chunk(tile_header, window)
+
+            if time.time() - last_flush_time >= FramebufferFlushInterval:
+                self.__flush_framebuffer()
+                last_flush_time = time.time()
+
+                if deadline is not None and self.rendered_pixels >= (complete_passes + 1) * self._window_pixels:
+                    pass_count = int(self._pass_counts.min())
+                    if pass_count > complete_passes:
+                        complete_passes = pass_count
+                        complete_framebuffer = self._framebuffer.copy()
+
+            if checkpoint is not None and time.time() - last_checkpoint_time >= CheckpointFlushInterval:
+                checkpoint.flush()
+                last_checkpoint_time = time.time()
+
+            if self.__is_converged():
                 break
 
-            # Decode chunk header.
-            chunk_header = struct.unpack("II", chunk_header_data)
-            chunk_type = chunk_header[0]
-            chunk_size = chunk_header[1]
-
-            if chunk_type == 1:
-                # Tile data (protocol v1).
-                if not self.__process_tile_data_chunk(process, min_x, min_y, max_x, max_y):
-                    break
-            elif chunk_type == 2:
-                # Tile highlight (protocol v1).
-                if not self.__process_tile_highlight_chunk(process, min_x, min_y, max_x, max_y):
-                    break
+            if deadline is not None and time.time() >= deadline:
+                out_of_time = True
+                break
+
+        # Out of time, keep the last complete pass, or the pixels of the first pass received so far.
+        if out_of_time and complete_framebuffer is not None:
+            self._framebuffer[:] = complete_framebuffer
+            self.__mark_dirty(0, 0, self._framebuffer.shape[1] - 1, self._framebuffer.shape[0] - 1)
+
+        # Remove the highlights of the tiles that were still rendering.
+        for window in windows:
+            x0, y0 = window[0] - min_x, max_y - window[3]
+            highlighted_rows, highlighted_columns = np.nonzero(self._highlighted[y0:max_y - window[1] + 1, x0:window[2] - min_x + 1])
+            if len(highlighted_rows) > 0:
+                self.__mark_dirty(x0 + highlighted_columns.min(), y0 + highlighted_rows.min(),
+                                  x0 + highlighted_columns.max(), y0 + highlighted_rows.max(), window)
+        self._highlighted[:] = False
+        self.__flush_framebuffer()
+
+        # The render is complete if all the processes rendered their window to the end, or if it converged.
+        # Renders that ran out of time are never complete, they are not kept in the result cache.
+        converged = self.__is_converged()
+        completed = not out_of_time and (converged or (running_processes == 0 and all(process.wait() == 0 for process in processes)))
+
+        # Make sure the appleseed.cli processes have terminated, which also ends the reader threads.
+        # They are asked to stop first, and killed if they do not.
+        stop_reading.set()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=1.0)
+            except subprocess.TimeoutExpired:
+                pass
+            process.kill()
+        for reader in readers:
+            reader.join()
+        for process in processes:
+            process.stdout.close()
+        self.__close_project_inputs()
+
+        # Keep the checkpoint of an interrupted render only.
+        if checkpoint is not None:
+            completed = converged or checkpoint.get_missing_window() is None
+            if completed:
+                self.__remove_checkpoint()
             else:
-                # Ignore unknown chunks.
-                os.read(process.stdout.fileno(), chunk_size)
-                continue
+                checkpoint.flush()
 
-        # Make sure the appleseed.cli process has terminated.
-        process.kill()
+        return completed
 
-        if scene.appleseed.clean_cache:
-            if os.path.exists(project_dir):
-                try:
-                    shutil.rmtree(project_dir)
-                    self.report({'INFO'}, "Render Cache Deleted")
-                except:
-                    pass
+    def __is_converged(self):
+        """
+        Return True if the noise threshold is met everywhere: every pixel of the rendered bounds received
+        at least two passes and the relative error of all the tiles is below the threshold.
+        """
 
-    def __process_tile_data_chunk(self, process, min_x, min_y, max_x, max_y):
-        # Read and decode tile header.
-        tile_header = struct.unpack("IIIII", os.read(process.stdout.fileno(), 5 * 4))
+        if self._noise_threshold is None or self._noisy_tiles:
+            return False
+        return int(self._pass_counts[self._rendered_region].min()) >= 2
+
+    def __remove_checkpoint(self):
+        """Remove the checkpoint of a complete render, keeping its pixels in memory."""
+
+        self._framebuffer = np.array(self._framebuffer)
+        self._checkpoint.remove()
+        self._checkpoint = None
+
+    def __process_tile_data_chunk(self, tile_header, tile_data, window):
         tile_x = tile_header[0]
         tile_y = tile_header[1]
         tile_w = tile_header[2]
         tile_h = tile_header[3]
         tile_c = tile_header[4]
 
-        # Read tile data.
-        tile_size = tile_w * tile_h * tile_c * 4
-        tile_data = bytes()
-        while len(tile_data) < tile_size and not self.test_break():
-            tile_data += os.read(process.stdout.fileno(), tile_size - len(tile_data))
-        if self.test_break():
-            return False
-
         # Optional debug message.
         if False:
             print("Received tile: x={0} y={1} w={2} h={3} c={4}".format(tile_x, tile_y, tile_w, tile_h, tile_c))
 
-        # Ignore tiles completely outside the render window.
-        if tile_x > max_x or tile_x + tile_w - 1 < min_x:
-            return True
-        if tile_y > max_y or tile_y + tile_h - 1 < min_y:
-            return True
-
-        # Image-space coordinates of the intersection between the tile and the render window.
-        ix0 = max(tile_x, min_x)
-        iy0 = max(tile_y, min_y)
-        ix1 = min(tile_x + tile_w - 1, max_x)
-        iy1 = min(tile_y + tile_h - 1, max_y)
-
-        # Number of rows and columns to skip in the input tile.
-        skip_x = ix0 - tile_x
-        skip_y = iy0 - tile_y
-        take_x = ix1 - ix0 + 1
-        take_y = iy1 - iy0 + 1
-
-        # Extract relevant tile data and convert them to the format expected by Blender.
-        floats = array.array('f')
-        floats.fromstring(tile_data)
-        pix = []
-        for y in range(take_y - 1, -1, -1):
-            start_pix = (skip_y + y) * tile_w + skip_x
-            end_pix = start_pix + take_x
-            pix.extend(floats[p * 4:p * 4 + 4] for p in range(start_pix, end_pix))
+        # Crop the tile to the render window of the process.
+        cropped_tile = tilestream.crop_tile(tile_header, tile_data, window)
+        if cropped_tile is None:
+            return
+        (ix0, iy1, pix) = cropped_tile
+        take_y, take_x = pix.shape[:2]
 
         # Window-space coordinates of the intersection between the tile and the render window.
-        x0 = ix0 - min_x    # left
-        y0 = max_y - iy1    # bottom
+        render_min_x, render_min_y, render_max_x, render_max_y = self._render_window
+        x0 = ix0 - render_min_x     # left
+        y0 = render_max_y - iy1     # bottom
+
+        # Estimate the noise of the tile from the change since its previous pass.
+        if self._noise_threshold is not None:
+            tile_key = (window, tile_x, tile_y)
+            error = None
+            if tile_key in self._previous_tiles:
+                error = get_tile_error(self._previous_tiles[tile_key], pix)
+            self._previous_tiles[tile_key] = pix.copy()
+            self._tile_errors[tile_key] = error
+            if error is None or error > self._noise_threshold:
+                self._noisy_tiles.add(tile_key)
+            else:
+                self._noisy_tiles.discard(tile_key)
 
         # Update image.
-        result = self.begin_result(x0, y0, take_x, take_y)
-        layer = result.layers[0].passes[0]
-        layer.rect = pix
-        self.end_result(result)
-
-        # Update progress bar.
+        self._framebuffer[y0:y0 + take_y, x0:x0 + take_x] = pix
+        self._highlighted[y0:y0 + take_y, x0:x0 + take_x] = False
+        if self._pass_counts is not None:
+            self._pass_counts[y0:y0 + take_y, x0:x0 + take_x] += 1
+        self.__mark_dirty(x0, y0, x0 + take_x - 1, y0 + take_y - 1, window)
+        if self._checkpoint is not None:
+            self._checkpoint.pass_counts[y0:y0 + take_y, x0:x0 + take_x] += 1
+
+        # Progress is reported when the framebuffer is flushed.
         self.rendered_pixels += take_x * take_y
-        self.update_progress(self.rendered_pixels / self.total_pixels)
 
-        return True
+    def __mark_dirty(self, x0, y0, x1, y1, window=None):
+        """
+        Extend the region of the framebuffer to send to Blender with a window-space rectangle.
+        Each process window has a dirty region of its own, window is None for updates of the whole framebuffer.
+        """
+
+        if window not in self._dirty_regions:
+            self._dirty_regions[window] = (x0, y0, x1, y1)
+        else:
+            dx0, dy0, dx1, dy1 = self._dirty_regions[window]
+            self._dirty_regions[window] = (min(dx0, x0), min(dy0, y0), max(dx1, x1), max(dy1, y1))
 
-    def __process_tile_highlight_chunk(self, process, min_x, min_y, max_x, max_y):
-        # Read and decode tile header.
-        tile_header = struct.unpack("IIII", os.read(process.stdout.fileno(), 4 * 4))
+    def __clear_highlights(self):
+        """
+        Reset the tile highlights. They are drawn in a mask over the framebuffer, composited in TileHighlightColor
+        when the framebuffer is sent to Blender only, so they never reach the pixels of the render.
+        """
+
+        self._highlighted = np.zeros(self._framebuffer.shape[:2], dtype=bool)
+
+    def __flush_framebuffer(self):
+        """Send the dirty regions of the framebuffer, with the tile highlights, to Blender with one result update per region."""
+
+        dirty_regions = self._dirty_regions
+        self._dirty_regions = {}
+        for x0, y0, x1, y1 in dirty_regions.values():
+            pixels = self._framebuffer[y0:y1 + 1, x0:x1 + 1]
+            highlighted = self._highlighted[y0:y1 + 1, x0:x1 + 1]
+            if highlighted.any():
+                pixels = np.where(highlighted[..., None], TileHighlightColor, pixels)
+            result = self.begin_result(x0, y0, x1 - x0 + 1, y1 - y0 + 1)
+            layer = result.layers[0].passes[0]
+            self.__set_pass_pixels(layer, pixels)
+            self.end_result(result)
+
+        # Update progress bar. Resumed renders may render again some of the pixels they already have.
+        self.update_progress(min(1.0, self.rendered_pixels / self.total_pixels))
+
+        # Report the noise of the noisiest tile.
+        if self._noise_threshold is not None:
+            errors = [error for error in self._tile_errors.values() if error is not None]
+            if errors:
+                self.update_stats("", "appleseed: Rendering (noise {0:.4f}, threshold {1:.4f})".format(max(errors), self._noise_threshold))
+
+    def __set_pass_pixels(self, layer, pixels):
+        """
+        Copy a (height, width, channels) array of pixels to a render pass.
+        Render passes of Blender 2.7x take no flat buffer, rect is assigned one pixel after the other.
+        """
+
+        pixels = np.ascontiguousarray(pixels, dtype=np.float32)
+        layer.rect = pixels.reshape(-1, pixels.shape[2])
+
+    def __process_tile_highlight_chunk(self, tile_header, window):
+        min_x, min_y, max_x, max_y = window
         tile_x = tile_header[0]
         tile_y = tile_header[1]
         tile_w = tile_header[2]
         tile_h = tile_header[3]
 
-        # Ignore tiles completely outside the render window.
+        # Ignore tiles completely outside the render window of the process.
         if tile_x > max_x or tile_x + tile_w - 1 < min_x:
-            return True
+            return
         if tile_y > max_y or tile_y + tile_h - 1 < min_y:
-            return True
+            return
 
         # Image-space coordinates of the intersection between the tile and the render window.
         ix0 = max(tile_x, min_x)
@@ -330,45 +825,39 @@ class RenderAppleseed(bpy.types.RenderEngine):
         iy1 = min(tile_y + tile_h - 1, max_y)
 
         # Window-space coordinates of the intersection between the tile and the render window.
-        x0 = ix0 - min_x    # left
-        x1 = ix1 - min_x    # right
-        y0 = max_y - iy1    # bottom
-        y1 = max_y - iy0    # top
+        render_min_x, render_min_y, render_max_x, render_max_y = self._render_window
+        x0 = ix0 - render_min_x     # left
+        x1 = ix1 - render_min_x     # right
+        y0 = render_max_y - iy1     # bottom
+        y1 = render_max_y - iy0     # top
 
         # Bracket parameters.
         bracket_extent = 5
-        bracket_color = [1.0, 1.0, 1.0, 1.0]
 
         # Handle tiles smaller than the bracket extent.
         bracket_width = min(bracket_extent, x1 - x0 + 1)
         bracket_height = min(bracket_extent, y1 - y0 + 1)
 
         # Top-left corner.
-        self.__draw_hline(x0, y1, bracket_width, bracket_color)
-        self.__draw_vline(x0, y1 - bracket_height + 1, bracket_height, bracket_color)
+        self.__draw_hline(x0, y1, bracket_width)
+        self.__draw_vline(x0, y1 - bracket_height + 1, bracket_height)
 
         # Top-right corner.
-        self.__draw_hline(x1 - bracket_width + 1, y1, bracket_width, bracket_color)
-        self.__draw_vline(x1, y1 - bracket_height + 1, bracket_height, bracket_color)
+        self.__draw_hline(x1 - bracket_width + 1, y1, bracket_width)
+        self.__draw_vline(x1, y1 - bracket_height + 1, bracket_height)
 
         # Bottom-left corner.
-        self.__draw_hline(x0, y0, bracket_width, bracket_color)
-        self.__draw_vline(x0, y0, bracket_height, bracket_color)
+        self.__draw_hline(x0, y0, bracket_width)
+        self.__draw_vline(x0, y0, bracket_height)
 
         # Bottom-right corner.
-        self.__draw_hline(x1 - bracket_width + 1, y0, bracket_width, bracket_color)
-        self.__draw_vline(x1, y0, bracket_height, bracket_color)
-
-        return True
-
-    def __draw_hline(self, x, y, length, color):
-        result = self.begin_result(x, y, length, 1)
-        layer = result.layers[0].passes[0]
-        layer.rect = [color] * length
-        self.end_result(result)
-
-    def __draw_vline(self, x, y, length, color):
-        result = self.begin_result(x, y, 1, length)
-        layer = result.layers[0].passes[0]
-        layer.rect = [color] * length
-        self.end_result(result)
+        self.__draw_hline(x1 - bracket_width + 1, y0, bracket_width)
+        self.__draw_vline(x1, y0, bracket_height)
+
+        self.__mark_dirty(x0, y0, x1, y1, window)
+
+    def __draw_hline(self, x, y, length):
+        self._highlighted[y, x:x + length] = True
+
+    def __draw_vline(self, x, y, length):
+        self._highlighted[y:y + length, x] = True
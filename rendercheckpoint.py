@@ -0,0 +1,187 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from . import meshcache
+
+# Parameter values of a project, some of which are the paths of the files it references.
+ParameterValuePattern = re.compile(rb'<parameter name="[^"]*" value="([^"]*)"')
+
+# Extension of the projects referenced by a project, such as the archive assemblies of split projects.
+ProjectFileExtension = ".appleseed"
+
+# (device, inode, size, modification time) -> content hash of the files hashed so far.
+file_hashes = {}
+
+
+def get_file_hash(path):
+    """Return the content hash of a file, computed once per version of the file on disk."""
+
+    stat = os.stat(path)
+    key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+    if key not in file_hashes:
+        sha = hashlib.sha1()
+        with open(path, "rb") as referenced_file:
+            for block in iter(lambda: referenced_file.read(1 << 20), b""):
+                sha.update(block)
+        file_hashes[key] = sha.hexdigest()
+    return file_hashes[key]
+
+
+def get_project_hash(project_filepath, render_settings, project=None):
+    """
+    Return the content hash of an exported project and of the settings of its render.
+    project is the encoded content of projects that were not written to project_filepath.
+
+    Referenced files are identified by their paths as written in the project, their sizes and their
+    content hashes, taken from the mesh cache manifest for geometry files. The files referenced by the
+    projects it references, such as archive assemblies, are part of the hash too. As in appleseed, their
+    paths are relative to the directory of the main project. The hash does not depend on the session
+    directory the project was exported to.
+    """
+
+    sha = hashlib.sha1()
+    sha.update(repr(render_settings).encode("utf8"))
+    if project is None:
+        with open(project_filepath, "rb") as project_file:
+            project = project_file.read()
+    sha.update(project)
+
+    project_dir = os.path.dirname(project_filepath)
+    meshes_path = os.path.normpath(os.path.join(project_dir, "meshes"))
+    manifest = {}
+    try:
+        with open(os.path.join(meshes_path, meshcache.MeshCache.ManifestFileName), "r", encoding="utf8") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, ValueError):
+        pass
+
+    # Filename -> description of the referenced files.
+    referenced_files = {}
+    projects = [project]
+    while projects:
+        for value in ParameterValuePattern.findall(projects.pop()):
+            filename = value.decode("utf8")
+            if filename in referenced_files:
+                continue
+            path = os.path.normpath(os.path.join(project_dir, filename))
+            if not os.path.isfile(path):
+                # Not a file, or a missing file which is part of the project as is.
+                referenced_files[filename] = None
+                continue
+            content_hash = None
+            if os.path.dirname(path) == meshes_path:
+                content_hash = manifest.get(os.path.basename(path))
+            if content_hash is None:
+                content_hash = get_file_hash(path)
+            referenced_files[filename] = "{0}:{1}:{2}\n".format(filename, os.path.getsize(path), content_hash)
+            if filename.endswith(ProjectFileExtension):
+                with open(path, "rb") as referenced_project:
+                    projects.append(referenced_project.read())
+
+    for filename in sorted(referenced_files):
+        if referenced_files[filename] is not None:
+            sha.update(referenced_files[filename].encode("utf8"))
+
+    return sha.hexdigest()
+
+
+class RenderCheckpoint(object):
+    """
+    Pixels received from appleseed.cli for a project, kept in memory-mapped files so that an
+    interrupted render can be resumed.
+
+    pixels is the (height, width, 4) framebuffer of the render window, rows from bottom to top,
+    and pass_counts counts the render passes received for each pixel. A pixel is complete once
+    it received all the passes of the render.
+    """
+
+    def __init__(self, checkpoints_path, project_hash, width, height, pass_count):
+        self._pixels_path = os.path.join(checkpoints_path, project_hash + ".pixels.npy")
+        self._pass_counts_path = os.path.join(checkpoints_path, project_hash + ".passes.npy")
+        self._pass_count = pass_count
+
+        if not os.path.exists(checkpoints_path):
+            os.makedirs(checkpoints_path)
+
+        self.pixels = self.__open(self._pixels_path, (height, width, 4), np.float32)
+        self.pass_counts = self.__open(self._pass_counts_path, (height, width), np.uint32)
+
+    def get_completed_pass_count(self):
+        """Return the number of pixel passes already received, counting at most the render passes for each pixel."""
+
+        return int(np.minimum(self.pass_counts, self._pass_count).sum())
+
+    def get_missing_window(self):
+        """
+        Return the smallest window (min_x, min_y, max_x, max_y) containing all the incomplete pixels,
+        in window space with rows from bottom to top, or None if all pixels are complete.
+        """
+
+        incomplete = self.pass_counts < self._pass_count
+        rows = np.flatnonzero(incomplete.any(axis=1))
+        if len(rows) == 0:
+            return None
+        columns = np.flatnonzero(incomplete.any(axis=0))
+        return int(columns[0]), int(rows[0]), int(columns[-1]), int(rows[-1])
+
+    def flush(self):
+        """Write the received pixels to disk."""
+
+        self.pixels.flush()
+        self.pass_counts.flush()
+
+    def remove(self):
+        """Delete the checkpoint files, once the render is complete."""
+
+        del self.pixels
+        del self.pass_counts
+        for path in (self._pixels_path, self._pass_counts_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def __open(path, shape, dtype):
+        if os.path.exists(path):
+            try:
+                array = np.lib.format.open_memmap(path, mode='r+')
+                if array.shape == shape and array.dtype == dtype:
+                    return array
+                del array
+            except (IOError, ValueError):
+                # Corrupted checkpoint, start over.
+                pass
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
@@ -0,0 +1,238 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import subprocess
+
+import bpy
+
+from . import projectdirs
+from . import projectwriter
+from . import util
+
+
+def get_frame_project_dir(session_dir, frame):
+    """Return the directory of the project exported for a frame of a frame range render."""
+
+    return os.path.join(session_dir, "{0:04d}".format(frame))
+
+
+def get_frame_threads(scene):
+    """Return the number of rendering threads given to each appleseed.cli process of a frame range render."""
+
+    total_threads = util.thread_count if scene.appleseed.threads_auto else scene.appleseed.threads
+    return max(1, total_threads // scene.appleseed.frames_in_flight)
+
+
+# Blender output file formats that appleseed.cli can write, and the file extension it infers each of them from.
+FrameFileExtensions = {'PNG': ".png", 'OPEN_EXR': ".exr"}
+
+
+def get_frame_output_path(scene, frame):
+    """Return the path appleseed.cli writes the image of a frame to, with the file extension of the output file format."""
+
+    output_filepath = scene.render.frame_path(frame=frame)
+    extension = FrameFileExtensions[scene.render.image_settings.file_format]
+    if not output_filepath.lower().endswith(extension):
+        output_filepath += extension
+    return output_filepath
+
+
+# Seconds between two checks of the frames being rendered.
+FramePollInterval = 0.1
+
+
+def start_frame_render(appleseed_bin_path, appleseed_bin_dir, project_filepath, output_filepath, threads, width, height):
+    """Start rendering a frame project with appleseed.cli, writing the image to output_filepath. Return the process."""
+
+    cmd = (appleseed_bin_path,
+           project_filepath,
+           '--threads', str(threads),
+           '--message-verbosity', 'warning',
+           '--resolution', str(width), str(height),
+           '--output', output_filepath)
+    return subprocess.Popen(cmd, cwd=appleseed_bin_dir, env=os.environ.copy())
+
+
+class AppleseedRenderFrameRange(bpy.types.Operator):
+    """
+    Export the frames of the scene frame range, and render them with several appleseed.cli
+    processes running at the same time. A frame is exported as soon as a process is available
+    for it, while the previous frames render. Press Esc to stop rendering.
+    """
+
+    bl_idname = "appleseed.render_frame_range"
+    bl_label = "Render Frame Range"
+    bl_description = "Export the frame range and render several frames at once, writing images to the output path"
+
+    @classmethod
+    def poll(cls, context):
+        renderer = context.scene.render
+        return renderer.engine == 'APPLESEED_RENDER'
+
+    def execute(self, context):
+        scene = context.scene
+
+        # appleseed.cli picks the image format from the extension of the output file, check it before rendering anything.
+        file_format = scene.render.image_settings.file_format
+        if file_format not in FrameFileExtensions:
+            self.report({'ERROR'}, "appleseed.cli can not write {0} images. Set the output file format to PNG or OpenEXR.".format(file_format))
+            return {'CANCELLED'}
+
+        # Check that the path to the bin folder is set.
+        appleseed_bin_dir = bpy.context.user_preferences.addons['blenderseed'].preferences.appleseed_binary_directory
+        if not appleseed_bin_dir:
+            self.report({'ERROR'}, "The path to the folder containing the appleseed.cli executable has not been specified. Set the path in the add-on user preferences.")
+            return {'CANCELLED'}
+        self._appleseed_bin_dir = util.realpath(appleseed_bin_dir)
+        self._appleseed_bin_path = os.path.join(self._appleseed_bin_dir, "appleseed.cli")
+
+        try:
+            self._session_dir = projectdirs.create_session_dir("frames")
+        except (IOError, OSError) as e:
+            self.report({'ERROR'}, "A directory could not be created in {0}: {1}.".format(projectdirs.SessionsDir, e))
+            return {'CANCELLED'}
+
+        self._frames = list(range(scene.frame_start, scene.frame_end + 1, scene.frame_step))
+        self._resolution = util.get_render_resolution(scene)
+        self._threads = get_frame_threads(scene)
+        self._current_frame = scene.frame_current
+
+        # Frame -> appleseed.cli process rendering it.
+        self._renders = {}
+        self._next_frame_index = 0
+        self._rendered_frames = 0
+        self._previous_project_dir = None
+
+        window_manager = context.window_manager
+        window_manager.progress_begin(0, len(self._frames))
+        self._timer = window_manager.event_timer_add(FramePollInterval, context.window)
+        window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.__finish(context, cancelled=True)
+            self.report({'WARNING'}, "Stopped rendering the frame range after {0} frames.".format(self._rendered_frames))
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        # Collect the frames that finished rendering.
+        for frame, process in list(self._renders.items()):
+            return_code = process.poll()
+            if return_code is not None:
+                del self._renders[frame]
+                self._rendered_frames += 1
+                if return_code != 0:
+                    self.report({'WARNING'}, "appleseed.cli failed to render frame {0}.".format(frame))
+        context.window_manager.progress_update(self._rendered_frames)
+
+        # Export the next frame when a process is available to render it.
+        if self._next_frame_index < len(self._frames) and len(self._renders) < context.scene.appleseed.frames_in_flight:
+            frame = self._frames[self._next_frame_index]
+            try:
+                self._renders[frame] = self.__start_frame(context.scene, frame)
+            except (IOError, OSError) as e:
+                self.__finish(context, cancelled=True)
+                self.report({'ERROR'}, "Could not render frame {0}: {1}.".format(frame, e))
+                return {'CANCELLED'}
+            self._next_frame_index += 1
+
+        if self._next_frame_index == len(self._frames) and not self._renders:
+            self.__finish(context, cancelled=False)
+            self.report({'INFO'}, "Rendered {0} frames.".format(len(self._frames)))
+            return {'FINISHED'}
+
+        return {'PASS_THROUGH'}
+
+    def __start_frame(self, scene, frame):
+        """Export a frame to a project of its own and start rendering it. Return the appleseed.cli process."""
+
+        project_dir = get_frame_project_dir(self._session_dir, frame)
+        project_filepath = os.path.join(project_dir, "frame.appleseed")
+        if not os.path.exists(project_dir):
+            os.makedirs(project_dir)
+
+        # Reuse the geometry files of the previous frame, only changed meshes are written again.
+        if self._previous_project_dir is not None:
+            projectdirs.link_meshes(self._previous_project_dir, project_dir)
+        else:
+            projectdirs.seed_meshes(project_dir)
+        self._previous_project_dir = project_dir
+
+        scene.frame_set(frame)
+        writer = projectwriter.Writer()
+        if not writer.write(scene, project_filepath):
+            raise IOError("could not export the project to {0}".format(project_filepath))
+
+        output_filepath = get_frame_output_path(scene, frame)
+        output_dir = os.path.dirname(output_filepath)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        (width, height) = self._resolution
+        return start_frame_render(self._appleseed_bin_path, self._appleseed_bin_dir,
+                                  project_filepath, output_filepath, self._threads, width, height)
+
+    def __finish(self, context, cancelled):
+        """Stop the timer, stop the frames still rendering if cancelled, and clean up."""
+
+        scene = context.scene
+        window_manager = context.window_manager
+        window_manager.event_timer_remove(self._timer)
+
+        for process in self._renders.values():
+            if cancelled:
+                process.terminate()
+        for process in self._renders.values():
+            try:
+                process.wait(timeout=5.0)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        self._renders = {}
+
+        scene.frame_set(self._current_frame)
+        window_manager.progress_end()
+
+        if self._previous_project_dir is not None and not cancelled:
+            projectdirs.publish_meshes(self._previous_project_dir)
+        if scene.appleseed.clean_cache:
+            projectdirs.remove_session_dir(self._session_dir)
+        else:
+            projectdirs.release_session_dir(self._session_dir)
+
+
+def register():
+    bpy.utils.register_class(AppleseedRenderFrameRange)
+
+
+def unregister():
+    bpy.utils.unregister_class(AppleseedRenderFrameRange)
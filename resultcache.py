@@ -0,0 +1,97 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+
+import numpy as np
+
+
+class ResultCache(object):
+    """
+    Least recently used cache of finished renders on disk.
+
+    Each entry is the (height, width, 4) float framebuffer of a render window, stored as a .npy file
+    named after the content hash of the rendered project (see rendercheckpoint.get_project_hash()).
+    Reading an entry marks it as recently used; the least recently used entries are removed when
+    the total size of the cache exceeds its limit.
+    """
+
+    def __init__(self, cache_path, max_size):
+        self._cache_path = cache_path
+        self._max_size = max_size
+
+    def get(self, project_hash):
+        """Return the cached framebuffer of a project, or None."""
+
+        path = self.__get_path(project_hash)
+        try:
+            pixels = np.load(path)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return pixels
+
+    def put(self, project_hash, pixels):
+        """Store the framebuffer of a finished render, then trim the cache to its size limit."""
+
+        if not os.path.exists(self._cache_path):
+            os.makedirs(self._cache_path)
+
+        # Write to a temporary file first so that other Blender instances never read a partial entry.
+        path = self.__get_path(project_hash)
+        temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as temp_file:
+            np.save(temp_file, pixels)
+        os.replace(temp_path, path)
+
+        self.__trim(keep=path)
+
+    def __trim(self, keep):
+        entries = []
+        for filename in os.listdir(self._cache_path):
+            path = os.path.join(self._cache_path, filename)
+            if filename.endswith(".npy"):
+                try:
+                    entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+                except OSError:
+                    pass
+
+        total_size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total_size <= self._max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
+
+    def __get_path(self, project_hash):
+        return os.path.join(self._cache_path, project_hash + ".npy")
@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+import types
+
+import pytest
+
+# The add-on package needs Blender to be imported. Its modules that do not use Blender
+# are loaded from a bare package, without running the add-on's __init__.py.
+RepoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "blenderseed" not in sys.modules:
+    package = types.ModuleType("blenderseed")
+    package.__path__ = [RepoDir]
+    sys.modules["blenderseed"] = package
+
+from blenderseed import meshcache
+from blenderseed import projectdirs
+
+Project = b"""<project>
+    <object name="cube" model="mesh_object">
+        <parameter name="filename" value="meshes/cube.binarymesh" />
+    </object>
+</project>
+"""
+
+
+@pytest.fixture
+def write_session():
+    """Return a function exporting a project made of a single mesh to a session directory, which returns the project path."""
+
+    def write(session_dir, mesh_source=None, mesh_content=b"cube", mesh_hash="1234", shared_dir=None):
+        """
+        mesh_source is a mesh file hard linked instead of writing mesh_content. With shared_dir, the session
+        starts from the shared geometry files and publishes its own, like a render does.
+        """
+
+        os.makedirs(session_dir)
+        if shared_dir is not None:
+            projectdirs.link_meshes(shared_dir, session_dir)
+        meshes_dir = os.path.join(session_dir, "meshes")
+        if not os.path.isdir(meshes_dir):
+            os.makedirs(meshes_dir)
+            mesh_path = os.path.join(meshes_dir, "cube.binarymesh")
+            if mesh_source is not None:
+                os.link(mesh_source, mesh_path)
+            else:
+                with open(mesh_path, "wb") as mesh_file:
+                    mesh_file.write(mesh_content)
+            with open(os.path.join(meshes_dir, meshcache.MeshCache.ManifestFileName), "w") as manifest_file:
+                json.dump({"cube.binarymesh": mesh_hash}, manifest_file)
+        project_path = os.path.join(session_dir, "render.appleseed")
+        with open(project_path, "wb") as project_file:
+            project_file.write(Project)
+        if shared_dir is not None:
+            projectdirs.link_meshes(session_dir, shared_dir)
+        return project_path
+
+    return write
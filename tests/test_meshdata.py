@@ -0,0 +1,88 @@
+import struct
+
+import numpy as np
+
+from blenderseed import meshdata
+
+
+def make_mesh_arrays(offset=0.0, tilt=0.0):
+    """Return the arrays of two quads and a triangle on two materials, the first quad smooth, with texture coordinates."""
+
+    positions = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0], [2, 0, 0], [2, 1, 0]], dtype=np.float32)
+    positions[:, 2] += offset + tilt * positions[:, 0]
+    vertex_normals = np.column_stack((0.1 * positions[:, 0] - tilt, 0.1 * positions[:, 1], np.ones(len(positions)))).astype(np.float32)
+    vertex_normals /= np.linalg.norm(vertex_normals, axis=1)[:, np.newaxis]
+    face_vertices = np.array([[0, 1, 2, 3], [1, 4, 5, 2], [3, 2, 5, 0]], dtype=np.int32)
+    face_normals = np.array([[0.0, 0.0, 1.0], [0.2 - tilt, 0.0, 1.0], [0.0, 0.2, 1.0]], dtype=np.float32)
+    face_normals /= np.linalg.norm(face_normals, axis=1)[:, np.newaxis]
+    face_materials = np.array([1, 0, 1], dtype=np.int32)
+    face_smooth = np.array([True, False, False])
+    face_uvs = np.array([[[0, 0], [1, 0], [1, 1], [0, 1]],
+                         [[1, 0], [0.5, 0], [0.5, 1], [1, 1]],
+                         [[0, 1], [1, 1], [0.5, 1], [0, 0]]], dtype=np.float32)
+    # Triangles are stored with a zero fourth vertex index.
+    face_vertices[2, 3] = 0
+    return meshdata.MeshArrays(positions, vertex_normals, face_vertices, face_normals, face_materials, face_smooth, face_uvs)
+
+
+def read_obj_layout(filepath):
+    """Return the vertex, normal and texture coordinate counts and the face lines of an OBJ file."""
+
+    with open(filepath) as obj_file:
+        lines = obj_file.read().splitlines()
+    counts = tuple(sum(1 for line in lines if line.split()[0] == keyword) for keyword in ("v", "vn", "vt"))
+    return counts, [line for line in lines if line.split()[0] in ("o", "f")]
+
+
+def read_binarymesh_layout(filepath):
+    """Return the name, vertex, normal and texture coordinate counts and the face words of each mesh of a binary mesh file."""
+
+    with open(filepath, "rb") as mesh_file:
+        data = mesh_file.read()
+    assert data[:10] == b"BINARYMESH"
+    offset = 12
+    layout = []
+    while offset < len(data):
+        name_length, = struct.unpack_from("<H", data, offset)
+        name = data[offset + 2:offset + 2 + name_length]
+        offset += 2 + name_length
+        counts = []
+        for dimension in (3, 3, 2):
+            count, = struct.unpack_from("<I", data, offset)
+            counts.append(count)
+            offset += 4 + count * dimension * 8
+        offset += 2
+        face_count, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        face_start = offset
+        for _ in range(face_count):
+            corner_count, = struct.unpack_from("<H", data, offset)
+            offset += 2 + corner_count * 12 + 2
+        layout.append((name, tuple(counts), data[face_start:offset]))
+    return layout
+
+
+def test_mesh_pose_has_the_layout_of_the_mesh_at_shutter_open(tmpdir):
+    base_mesh_arrays = make_mesh_arrays()
+    base_mesh_data = meshdata.build_mesh_data(base_mesh_arrays)
+    pose_mesh_arrays = make_mesh_arrays(offset=0.5, tilt=0.25)
+
+    base_obj, pose_obj = str(tmpdir.join("base.obj")), str(tmpdir.join("pose.obj"))
+    assert meshdata.write_mesh_arrays(base_mesh_arrays, base_obj) == meshdata.write_mesh_pose(pose_mesh_arrays, base_mesh_data, pose_obj)
+    assert read_obj_layout(base_obj) == read_obj_layout(pose_obj)
+
+    base_binarymesh, pose_binarymesh = str(tmpdir.join("base.binarymesh")), str(tmpdir.join("pose.binarymesh"))
+    meshdata.write_mesh_arrays(base_mesh_arrays, base_binarymesh, 'binarymesh')
+    meshdata.write_mesh_pose(pose_mesh_arrays, base_mesh_data, pose_binarymesh, 'binarymesh')
+    assert read_binarymesh_layout(base_binarymesh) == read_binarymesh_layout(pose_binarymesh)
+
+
+def test_mesh_pose_has_the_positions_and_normals_of_the_sample():
+    base_mesh_data = meshdata.build_mesh_data(make_mesh_arrays())
+    pose_mesh_arrays = make_mesh_arrays(offset=0.5, tilt=0.25)
+    pose_mesh_data = meshdata.build_mesh_pose(pose_mesh_arrays, base_mesh_data)
+
+    assert np.array_equal(pose_mesh_data.positions, pose_mesh_arrays.positions)
+    assert np.allclose(pose_mesh_data.normals, meshdata.build_mesh_data(pose_mesh_arrays).normals)
+    assert not np.allclose(pose_mesh_data.normals, base_mesh_data.normals)
+    assert np.array_equal(pose_mesh_data.texcoords, base_mesh_data.texcoords)
@@ -0,0 +1,45 @@
+import os
+import time
+
+import pytest
+
+from blenderseed import projectdirs
+
+
+def age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+@pytest.fixture
+def root_dir(tmpdir, monkeypatch):
+    """Move all the directories of projectdirs to tmpdir, so that tests never remove the files of actual renders."""
+
+    monkeypatch.setattr(projectdirs, "RootDir", str(tmpdir))
+    for name, dirname in (("SessionsDir", "sessions"), ("SharedMeshesDir", "meshes"), ("CheckpointsDir", "checkpoints"), ("ResultsDir", "results")):
+        monkeypatch.setattr(projectdirs, name, str(tmpdir.join(dirname)))
+    return str(tmpdir)
+
+
+def test_old_session_dirs_in_use_are_kept(root_dir):
+    in_use_dir = projectdirs.create_session_dir("render")
+    kept_dir = projectdirs.create_session_dir("render")
+    projectdirs.release_session_dir(kept_dir)
+    for session_dir in (in_use_dir, kept_dir):
+        age(session_dir, projectdirs.MaxSessionAge + 60)
+
+    projectdirs.remove_old_session_dirs()
+    assert os.path.isdir(in_use_dir)
+    assert not os.path.exists(kept_dir)
+
+    projectdirs.remove_session_dir(in_use_dir)
+    assert not os.path.exists(in_use_dir)
+
+
+def test_stale_session_locks_are_ignored(root_dir):
+    crashed_dir = projectdirs.create_session_dir("render")
+    age(os.path.join(crashed_dir, projectdirs.SessionLockFileName), projectdirs.MaxLockAge + 60)
+    age(crashed_dir, projectdirs.MaxSessionAge + 60)
+
+    projectdirs.remove_old_session_dirs()
+    assert not os.path.exists(crashed_dir)
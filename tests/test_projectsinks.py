@@ -0,0 +1,65 @@
+import gzip
+import sys
+
+import pytest
+
+from blenderseed import projectsinks
+
+
+class BlockSink(projectsinks.Sink):
+    """Keep the blocks written by the sink."""
+
+    def __init__(self):
+        super(BlockSink, self).__init__()
+        self.blocks = []
+        self.closed = False
+
+    def _write_block(self, block):
+        self.blocks.append(block)
+
+    def _close(self):
+        self.closed = True
+
+
+def test_sink_requires_a_block_writer():
+    with pytest.raises(TypeError):
+        projectsinks.Sink()
+
+
+def test_text_is_written_in_blocks(monkeypatch):
+    monkeypatch.setattr(projectsinks, "BlockSize", 10)
+
+    with BlockSink() as sink:
+        sink.write("abcd")
+        sink.write("efgh")
+        assert sink.blocks == []
+        sink.write("ijkl")
+        assert sink.blocks == ["abcdefghijkl"]
+        sink.write("mn")
+    assert sink.blocks == ["abcdefghijkl", "mn"]
+    assert sink.closed
+
+
+def test_gzip_file_sink_round_trip(tmpdir):
+    file_path = str(tmpdir.join("project.appleseed.gz"))
+    text = "".join('<parameter name="p{0}" value="été {0}" />\n'.format(i) for i in range(100000))
+
+    with projectsinks.GzipFileSink(file_path) as sink:
+        for line in text.splitlines(True):
+            sink.write(line)
+
+    with gzip.open(file_path, "rt", encoding="utf-8", newline="") as project_file:
+        assert project_file.read() == text
+
+
+def test_process_sink_writes_to_the_child_process(tmpdir):
+    output_path = str(tmpdir.join("output.appleseed"))
+    text = "<project>\n    <scene été />\n</project>\n"
+    script = "import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, open(sys.argv[1], 'wb'))"
+
+    with projectsinks.ProcessSink([sys.executable, "-c", script, output_path]) as sink:
+        sink.write(text)
+    assert sink.process.wait(timeout=30) == 0
+
+    with open(output_path, "rb") as output_file:
+        assert output_file.read() == text.encode("utf-8")
@@ -0,0 +1,100 @@
+import json
+import os
+
+import numpy as np
+
+from blenderseed import meshcache
+from blenderseed import rendercheckpoint
+
+RenderSettings = (640, 480, 0, 0, 639, 479, 1, None, None)
+
+
+def test_project_hash_does_not_depend_on_session_dir(tmpdir, write_session):
+    first = write_session(str(tmpdir.join("session_a")))
+    second = write_session(str(tmpdir.join("session_b")), mesh_source=os.path.join(str(tmpdir), "session_a", "meshes", "cube.binarymesh"))
+    assert rendercheckpoint.get_project_hash(first, RenderSettings) == rendercheckpoint.get_project_hash(second, RenderSettings)
+
+
+def test_project_hash_follows_geometry(tmpdir, write_session):
+    first = write_session(str(tmpdir.join("session_a")))
+    second = write_session(str(tmpdir.join("session_b")), mesh_hash="5678")
+    assert rendercheckpoint.get_project_hash(first, RenderSettings) != rendercheckpoint.get_project_hash(second, RenderSettings)
+
+
+def test_project_hash_of_streamed_project(tmpdir, write_session):
+    project_path = write_session(str(tmpdir.join("session_a")))
+    with open(project_path, "rb") as project_file:
+        project = project_file.read()
+    os.remove(project_path)
+    assert rendercheckpoint.get_project_hash(project_path, RenderSettings, project) == \
+        rendercheckpoint.get_project_hash(write_session(str(tmpdir.join("session_b"))), RenderSettings)
+
+
+def test_project_hash_follows_geometry_of_archive_assemblies(tmpdir, write_session):
+    def write_split_session(session_dir, mesh_hash):
+        project_path = write_session(session_dir, mesh_hash=mesh_hash)
+        meshes_dir = os.path.join(session_dir, "meshes")
+        os.rename(project_path, os.path.join(meshes_dir, "scene.assembly.appleseed"))
+        with open(os.path.join(meshes_dir, meshcache.MeshCache.ManifestFileName), "w") as manifest_file:
+            json.dump({"cube.binarymesh": mesh_hash, "scene.assembly.appleseed": "abcd"}, manifest_file)
+        with open(project_path, "wb") as project_file:
+            project_file.write(b'<assembly name="scene" model="archive_assembly">\n'
+                               b'    <parameter name="filename" value="meshes/scene.assembly.appleseed" />\n'
+                               b'</assembly>\n')
+        return project_path
+
+    first = write_split_session(str(tmpdir.join("session_a")), "1234")
+    second = write_split_session(str(tmpdir.join("session_b")), "5678")
+    assert rendercheckpoint.get_project_hash(first, RenderSettings) != rendercheckpoint.get_project_hash(second, RenderSettings)
+
+
+def test_checkpoint_is_reopened_with_its_pixels_and_pass_counts(tmpdir):
+    checkpoint = rendercheckpoint.RenderCheckpoint(str(tmpdir), "1234", 4, 3, 2)
+    pixels = np.random.rand(3, 4, 4).astype(np.float32)
+    checkpoint.pixels[:] = pixels
+    checkpoint.pass_counts[1:, :2] = 1
+    checkpoint.flush()
+    del checkpoint
+
+    checkpoint = rendercheckpoint.RenderCheckpoint(str(tmpdir), "1234", 4, 3, 2)
+    assert np.array_equal(checkpoint.pixels, pixels)
+    assert int(checkpoint.pass_counts.sum()) == 4
+
+
+def test_checkpoint_of_another_shape_or_type_starts_over(tmpdir):
+    checkpoint = rendercheckpoint.RenderCheckpoint(str(tmpdir), "1234", 4, 3, 2)
+    checkpoint.pixels[:] = 1.0
+    checkpoint.pass_counts[:] = 2
+    checkpoint.flush()
+    del checkpoint
+
+    checkpoint = rendercheckpoint.RenderCheckpoint(str(tmpdir), "1234", 5, 3, 2)
+    assert checkpoint.pixels.shape == (3, 5, 4)
+    assert not checkpoint.pixels.any() and not checkpoint.pass_counts.any()
+    del checkpoint
+
+    np.save(str(tmpdir.join("1234.passes.npy")), np.full((3, 5), 2, dtype=np.uint16))
+    checkpoint = rendercheckpoint.RenderCheckpoint(str(tmpdir), "1234", 5, 3, 2)
+    assert checkpoint.pass_counts.dtype == np.uint32
+    assert not checkpoint.pass_counts.any()
+
+
+def test_missing_window_bounds_the_incomplete_pixels(tmpdir):
+    checkpoint = rendercheckpoint.RenderCheckpoint(str(tmpdir), "1234", 4, 3, 2)
+    assert checkpoint.get_missing_window() == (0, 0, 3, 2)
+
+    # Rows are from bottom to top: the window starts at the lowest incomplete row.
+    checkpoint.pass_counts[:] = 2
+    checkpoint.pass_counts[1, 2] = 1
+    checkpoint.pass_counts[2, 1] = 0
+    assert checkpoint.get_missing_window() == (1, 1, 2, 2)
+
+    checkpoint.pass_counts[:] = 2
+    assert checkpoint.get_missing_window() is None
+
+
+def test_completed_pass_count_is_clamped_to_the_passes(tmpdir):
+    checkpoint = rendercheckpoint.RenderCheckpoint(str(tmpdir), "1234", 4, 3, 2)
+    checkpoint.pass_counts[0] = 5
+    checkpoint.pass_counts[1] = 1
+    assert checkpoint.get_completed_pass_count() == 4 * 2 + 4 * 1
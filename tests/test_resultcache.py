@@ -0,0 +1,30 @@
+import numpy as np
+
+from blenderseed import rendercheckpoint
+from blenderseed import resultcache
+
+RenderSettings = (4, 3, 0, 0, 3, 2, 1, None, None)
+
+
+def test_identical_render_is_served_from_cache(tmpdir, write_session):
+    shared_dir = str(tmpdir.join("shared"))
+    cache = resultcache.ResultCache(str(tmpdir.join("results")), 1024 * 1024)
+    pixels = np.random.rand(3, 4, 4).astype(np.float32)
+
+    first_hash = rendercheckpoint.get_project_hash(write_session(str(tmpdir.join("session_a")), shared_dir=shared_dir), RenderSettings)
+    assert cache.get(first_hash) is None
+    cache.put(first_hash, pixels)
+
+    second_hash = rendercheckpoint.get_project_hash(write_session(str(tmpdir.join("session_b")), shared_dir=shared_dir), RenderSettings)
+    cached_pixels = cache.get(second_hash)
+    assert cached_pixels is not None
+    assert np.array_equal(cached_pixels, pixels)
+
+
+def test_cache_is_trimmed_to_its_size(tmpdir):
+    pixels = np.zeros((16, 16, 4), dtype=np.float32)
+    cache = resultcache.ResultCache(str(tmpdir), pixels.nbytes + 1024)
+    cache.put("first", pixels)
+    cache.put("second", pixels)
+    assert cache.get("first") is None
+    assert cache.get("second") is not None
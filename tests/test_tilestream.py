@@ -0,0 +1,91 @@
+import io
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from blenderseed import tilestream
+
+# Image of 8x6 pixels rendered as 4x3 tiles, rows from top to bottom as appleseed.cli writes them.
+Width, Height = 8, 6
+TileWidth, TileHeight = 4, 3
+Image = np.arange(Height * Width * 4, dtype=np.float32).reshape(Height, Width, 4)
+
+
+def record_stream():
+    """Return the standard output of appleseed.cli rendering Image, with highlights and an unknown chunk."""
+
+    stream = io.BytesIO()
+    stream.write(struct.pack("II", 99, 3) + b"abc")
+    for tile_y in range(0, Height, TileHeight):
+        for tile_x in range(0, Width, TileWidth):
+            stream.write(struct.pack("II", tilestream.TileHighlightChunk, 4 * 4))
+            stream.write(struct.pack("IIII", tile_x, tile_y, TileWidth, TileHeight))
+            tile = Image[tile_y:tile_y + TileHeight, tile_x:tile_x + TileWidth]
+            stream.write(struct.pack("II", tilestream.TileDataChunk, 5 * 4 + tile.nbytes))
+            stream.write(struct.pack("IIIII", tile_x, tile_y, TileWidth, TileHeight, 4))
+            stream.write(tile.tobytes())
+    stream.seek(0)
+    return stream
+
+
+def read_recorded_chunks(window):
+    chunks = queue.Queue(maxsize=tilestream.MaxQueuedChunks)
+    reader = threading.Thread(target=tilestream.read_chunks, args=(record_stream(), chunks, threading.Event(), window))
+    reader.start()
+    received = []
+    while True:
+        chunk_window, chunk = chunks.get(timeout=5.0)
+        assert chunk_window == window
+        if chunk is None:
+            break
+        received.append(chunk)
+    reader.join()
+    return received
+
+
+def draw_tiles(chunks, window):
+    """Composite tile chunks into a framebuffer of the window, rows from bottom to top, like the render engine."""
+
+    min_x, min_y, max_x, max_y = window
+    framebuffer = np.zeros((max_y - min_y + 1, max_x - min_x + 1, 4), dtype=np.float32)
+    for chunk_type, tile_header, tile_data in chunks:
+        if chunk_type != tilestream.TileDataChunk:
+            continue
+        cropped_tile = tilestream.crop_tile(tile_header, tile_data, window)
+        if cropped_tile is None:
+            continue
+        (ix0, iy1, pixels) = cropped_tile
+        x0 = ix0 - min_x
+        y0 = max_y - iy1
+        framebuffer[y0:y0 + pixels.shape[0], x0:x0 + pixels.shape[1]] = pixels
+    return framebuffer
+
+
+def test_recorded_stream_is_decoded():
+    window = (0, 0, Width - 1, Height - 1)
+    chunks = read_recorded_chunks(window)
+    chunk_types = [chunk[0] for chunk in chunks]
+    assert chunk_types.count(tilestream.TileDataChunk) == 4
+    assert chunk_types.count(tilestream.TileHighlightChunk) == 4
+    assert np.array_equal(draw_tiles(chunks, window), Image[::-1])
+
+
+def test_tiles_are_cropped_to_bands():
+    full_window = (0, 0, Width - 1, Height - 1)
+    chunks = read_recorded_chunks(full_window)
+    for band in tilestream.split_render_window(1, 1, 6, 4, 3):
+        (min_x, min_y, max_x, max_y) = band
+        assert np.array_equal(draw_tiles(chunks, band), Image[min_y:max_y + 1, min_x:max_x + 1][::-1])
+
+
+def test_truncated_stream_ends_the_chunks():
+    chunks = queue.Queue()
+    stream = io.BytesIO(record_stream().getvalue()[:-5])
+    tilestream.read_chunks(stream, chunks, threading.Event(), None)
+    received = []
+    while not chunks.empty():
+        received.append(chunks.get()[1])
+    assert received[-1] is None
+    assert [chunk[0] for chunk in received[:-1]].count(tilestream.TileDataChunk) == 3
@@ -0,0 +1,151 @@
+
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2014-2017 The appleseedhq Organization
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import queue
+import struct
+
+import numpy as np
+
+# Chunk types of the appleseed.cli standard output protocol (v1).
+TileDataChunk = 1
+TileHighlightChunk = 2
+
+# Largest number of decoded chunks waiting to be drawn.
+MaxQueuedChunks = 256
+
+# Interval in seconds at which the render thread checks for cancellation while waiting for chunks.
+ChunkPollInterval = 0.005
+
+
+def read_exactly(stream, buffer):
+    """Fill a buffer from a stream. Returns False if the stream ended first."""
+
+    view = memoryview(buffer)
+    received = 0
+    while received < len(view):
+        count = stream.readinto(view[received:])
+        if not count:
+            return False
+        received += count
+    return True
+
+
+def read_chunks(stream, chunks, stop_event, window):
+    """
+    Decode the chunks written by appleseed.cli to its standard output and queue them as
+    (window, (chunk type, header, tile data)) tuples, followed by (window, None) when the stream ends.
+    window is the render window of the process, used to route the chunks of several processes.
+    Runs on a reader thread so that the pipe is drained while the render thread draws tiles.
+    """
+
+    def put(chunk):
+        while not stop_event.is_set():
+            try:
+                chunks.put((window, chunk), timeout=ChunkPollInterval)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        while not stop_event.is_set():
+            chunk_header = bytearray(2 * 4)
+            if not read_exactly(stream, chunk_header):
+                break
+            chunk_type, chunk_size = struct.unpack("II", chunk_header)
+
+            if chunk_type == TileDataChunk:
+                tile_header = bytearray(5 * 4)
+                if not read_exactly(stream, tile_header):
+                    break
+                tile_header = struct.unpack("IIIII", tile_header)
+                tile_w, tile_h, tile_c = tile_header[2:5]
+                tile_data = bytearray(tile_w * tile_h * tile_c * 4)
+                if not read_exactly(stream, tile_data):
+                    break
+                chunk = (chunk_type, tile_header, tile_data)
+            elif chunk_type == TileHighlightChunk:
+                tile_header = bytearray(4 * 4)
+                if not read_exactly(stream, tile_header):
+                    break
+                chunk = (chunk_type, struct.unpack("IIII", tile_header), None)
+            else:
+                # Ignore unknown chunks.
+                if not read_exactly(stream, bytearray(chunk_size)):
+                    break
+                continue
+
+            if not put(chunk):
+                return
+    except (OSError, ValueError):
+        # The pipe was closed while reading.
+        pass
+
+    put(None)
+
+
+def crop_tile(tile_header, tile_data, window):
+    """
+    Crop the data of a tile to a render window.
+    Return the image-space left and top coordinates of the cropped tile and its (height, width, channels) pixels,
+    rows from bottom to top as Blender expects them, or None if the tile is outside the window.
+    """
+
+    min_x, min_y, max_x, max_y = window
+    tile_x, tile_y, tile_w, tile_h, tile_c = tile_header
+
+    # Ignore tiles completely outside the render window of the process.
+    if tile_x > max_x or tile_x + tile_w - 1 < min_x:
+        return None
+    if tile_y > max_y or tile_y + tile_h - 1 < min_y:
+        return None
+
+    # Image-space coordinates of the intersection between the tile and the render window.
+    ix0 = max(tile_x, min_x)
+    iy0 = max(tile_y, min_y)
+    ix1 = min(tile_x + tile_w - 1, max_x)
+    iy1 = min(tile_y + tile_h - 1, max_y)
+
+    # Number of rows and columns to skip in the input tile.
+    skip_x = ix0 - tile_x
+    skip_y = iy0 - tile_y
+    take_x = ix1 - ix0 + 1
+    take_y = iy1 - iy0 + 1
+
+    # Crop the tile data to the render window and flip it vertically.
+    floats = np.frombuffer(tile_data, dtype=np.float32).reshape(tile_h, tile_w, tile_c)
+    return ix0, iy1, floats[skip_y:skip_y + take_y, skip_x:skip_x + take_x][::-1]
+
+
+def split_render_window(min_x, min_y, max_x, max_y, count):
+    """Split a render window into at most count horizontal bands of nearly equal height."""
+
+    height = max_y - min_y + 1
+    count = max(1, min(count, height))
+    bounds = [min_y + height * band_index // count for band_index in range(count + 1)]
+    return [(min_x, bounds[band_index], max_x, bounds[band_index + 1] - 1) for band_index in range(count)]
@@ -56,14 +56,37 @@ class AppleseedRenderSettingsPanel(bpy.types.Panel, AppleseedRenderPanelBase):
         col = split.column()
         col.enabled = not asr_scene_props.threads_auto
         col.prop(asr_scene_props, "threads", text="Threads")
+        layout.prop(asr_scene_props, "render_workers", text="Render Processes")
+        row = layout.row()
+        row.operator("appleseed.render_frame_range", text="Render Frame Range")
+        row.prop(asr_scene_props, "frames_in_flight", text="Frames At Once")
 
         row = layout.row()
         row.prop(asr_scene_props, "generate_mesh_files", text="Export Geometry")
         if asr_scene_props.generate_mesh_files:
             row.prop(asr_scene_props, "export_mode", text="")
+            row.prop(asr_scene_props, "mesh_format", text="")
             # layout.prop(asr_scene_props, "export_hair", text="Export Hair")
+            split = layout.split()
+            col = split.column()
+            col.prop(asr_scene_props, "export_threads_auto", text="Auto Export Threads")
+            split = split.split()
+            col = split.column()
+            col.enabled = not asr_scene_props.export_threads_auto
+            col.prop(asr_scene_props, "export_threads", text="Export Threads")
+        row = layout.row()
+        row.prop(asr_scene_props, "split_assemblies", text="Split Assemblies Into Files")
         row = layout.row()
         row.prop(asr_scene_props, "clean_cache", text="Delete External Cache After Render")
+        row = layout.row()
+        row.prop(asr_scene_props, "stream_project", text="Stream Project To appleseed")
+        row = layout.row()
+        row.prop(asr_scene_props, "enable_checkpoints", text="Resume Interrupted Renders")
+        row = layout.row()
+        row.prop(asr_scene_props, "enable_result_cache", text="Reuse Identical Renders")
+        sub = row.row()
+        sub.enabled = asr_scene_props.enable_result_cache
+        sub.prop(asr_scene_props, "result_cache_size", text="Cache Size (MB)")
 
         layout.prop(asr_scene_props, "tile_ordering", text="Tile Ordering")
 
@@ -89,6 +112,17 @@ class AppleseedSamplingPanel(bpy.types.Panel, AppleseedRenderPanelBase):
         layout.separator()
         layout.prop(asr_scene_props, "pixel_sampler", text="Pixel Sampler")
         layout.prop(asr_scene_props, "renderer_passes", text="Passes")
+        if asr_scene_props.renderer_passes > 1:
+            row = layout.row()
+            row.prop(asr_scene_props, "enable_noise_threshold", text="Stop When Converged")
+            sub = row.row()
+            sub.enabled = asr_scene_props.enable_noise_threshold
+            sub.prop(asr_scene_props, "noise_threshold", text="Noise Threshold")
+        row = layout.row()
+        row.prop(asr_scene_props, "enable_time_budget", text="Time Budget")
+        sub = row.row()
+        sub.enabled = asr_scene_props.enable_time_budget
+        sub.prop(asr_scene_props, "time_budget", text="Seconds")
 
         if asr_scene_props.pixel_sampler == 'adaptive':
             row = layout.row(align=True)
@@ -246,6 +280,7 @@ class AppleseedMotionBlurPanel(bpy.types.Panel, AppleseedRenderPanelBase):
 
         layout.prop(asr_scene_props, "shutter_open", text="Shutter Open")
         layout.prop(asr_scene_props, "shutter_close", text="Shutter Close")
+        layout.prop(asr_scene_props, "motion_blur_samples", text="Motion Samples")
 
         row = layout.row(align=True)
         row.prop(asr_scene_props, "enable_camera_blur", text="Camera Blur")
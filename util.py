@@ -26,12 +26,13 @@
 # THE SOFTWARE.
 #
 
+import collections
 import multiprocessing
 import os
 from math import tan, atan, degrees
 
 import bpy
-import mathutils
+import numpy as np
 
 from . import bl_info
 
@@ -180,50 +181,34 @@ def is_proxy(ob, scene):
 
 def get_instances(obj_parent, scene):
     """
-    Get the instanced objects on the parent object (dupli-faces / dupli-verts).
-    If motion blur is not enabled, returns list of lists [ [dupli_object.object, dupli matrix]]
-    If motion blur is enabled, returns a nested list: [ [dupli_object.object, [dupli matrices]]]
+    Get the instanced objects on the parent object (dupli-faces / dupli-verts / particles).
+    Returns list of lists [ [dupli_object.object, (instance count, 4, 4) array of dupli matrices]]
+    Motion blurred instances are sampled by motionsamples.MotionSampleCache.
     """
-    dupli_list = []
-    if ob_mblur_enabled(obj_parent, scene):
-        dupli_list = sample_mblur(obj_parent, scene, dupli=True)
-    else:
-        obj_parent.dupli_list_create(scene)
-        for dupli in obj_parent.dupli_list:
-            dupli_matrix = dupli.matrix.copy()
-            dupli_list.append([dupli.object, dupli_matrix])
-        obj_parent.dupli_list_clear()
-    return dupli_list
+    obj_parent.dupli_list_create(scene)
+    dupli_matrices = get_dupli_matrices(obj_parent.dupli_list)
+    dupli_objects = [dupli.object for dupli in obj_parent.dupli_list]
+    obj_parent.dupli_list_clear()
+    return [[dupli_object, dupli_matrices[indices]] for dupli_object, indices in group_by_object(dupli_objects)]
+
+
+def get_dupli_matrices(dupli_list):
+    """Return the matrices of a dupli list as an (instance count, 4, 4) array, read in bulk."""
+    matrices = np.empty(len(dupli_list) * 16, dtype=np.float32)
+    dupli_list.foreach_get("matrix", matrices)
+    # Matrices are stored column after column.
+    return matrices.reshape(-1, 4, 4).transpose(0, 2, 1)
 
 
-def sample_mblur(ob, scene, dupli=False):
+def group_by_object(objects):
     """
-    Sample motion blur matrices for the object or duplis.
-    Returns a list of matrices, if an object only.
-    Returns a nested list of [ [dupli_object.object, [dupli matrix 1, dupli matrix 2]]]
+    Group the indices of a list of objects by object.
+    Returns a list of [ [object, array of indices]] in order of first occurrence.
     """
-    matrices = []
-    asr_scn = scene.appleseed
-    frame_orig = scene.frame_current
-    frame_set = scene.frame_set
-
-    # Collect matrices at shutter open.
-    frame_set(frame_orig, subframe=asr_scn.shutter_open)
-    ob.dupli_list_create(scene)
-    for dupli in ob.dupli_list:
-        matrices.append([dupli.object, [dupli.matrix.copy(), ]])
-    ob.dupli_list_clear()
-
-    # Advance to shutter close, collect matrices.
-    frame_set(frame_orig, subframe=asr_scn.shutter_close)
-    ob.dupli_list_create(scene)
-    for m in range(0, len(ob.dupli_list)):
-        matrices[m][1].append(ob.dupli_list[m].matrix.copy())
-    ob.dupli_list_clear()
-
-    # Reset timeline and return.
-    frame_set(frame_orig)
-    return matrices
+    groups = collections.OrderedDict()
+    for index, ob in enumerate(objects):
+        groups.setdefault(ob, []).append(index)
+    return [[ob, np.array(indices)] for ob, indices in groups.items()]
 
 
 # ------------------------------------
@@ -278,139 +263,3 @@ def get_all_psysobs():
         elif settings.render_type == 'GROUP' and settings.dupli_group is not None:
             obs.update({ob for ob in settings.dupli_group.objects})
     return obs
-
-
-def get_psys_instances(ob, scene):
-    """
-    Return a dictionary of
-    particle: [dupli.object, [matrices]]
-    pairs. This function assumes particle systems and
-    face / verts duplication aren't being used on the same object.
-    """
-    all_duplis = {}
-    current_total = 0
-    index = 0
-    if not hasattr(ob, 'modifiers'):
-        return {}
-    if not ob_mblur_enabled(ob, scene):
-        # If no motion blur
-        ob.dupli_list_create(scene, settings='RENDER')
-    for modifier in ob.modifiers:
-        if modifier.type == 'PARTICLE_SYSTEM' and modifier.show_render:
-            psys = modifier.particle_system
-            if not psys.settings.render_type in {'OBJECT', 'GROUP'}:
-                continue
-            if psys.settings.type == 'EMITTER':
-                particles = [p for p in psys.particles if p.alive_state == 'ALIVE']
-            else:
-                particles = [p for p in psys.particles]
-            start = current_total
-            current_total += len(particles)
-
-            if not ob_mblur_enabled(ob, scene):
-                # No motion blur.
-                duplis = []
-                for dupli_index in range(start, current_total):
-                    # Store the dupli.objects for the current particle system only
-                    # ob.dupli_list is created in descending order of particle systems
-                    # So it should be reliable to match them this way.
-                    duplis.append(ob.dupli_list[dupli_index].object)
-
-                if psys.settings.type == 'EMITTER':
-                    p_duplis_pairs = list(zip(particles, duplis))  # Match the particles to the duplis
-                    dupli_dict = {p[0]: [p[1], []] for p in p_duplis_pairs}  # Create particle:[dupli.object, [matrix]] pairs
-                    for particle in dupli_dict.keys():
-                        size = particle.size
-                        loc = particle.location
-                        scale = dupli_dict[particle][0].scale * size
-                        transl = mathutils.Matrix.Translation((loc))
-                        scale = mathutils.Matrix.Scale(scale.x, 4, (1, 0, 0)) * mathutils.Matrix.Scale(scale.y, 4,
-                                                                                                       (0, 1, 0)) * mathutils.Matrix.Scale(scale.z, 4,
-                                                                                                                                           (0, 0, 1))
-                        mat = transl * scale
-                        dupli_dict[particle][1].append(mat)
-                else:
-                    dupli_mat_list = [dupli.matrix.copy() for dupli in ob.dupli_list]
-                    p_duplis_pairs = list(zip(particles, duplis, dupli_mat_list))
-                    dupli_dict = {p[0]: [p[1], [p[2]]] for p in p_duplis_pairs}
-            else:
-                # Using motion blur
-                dupli_dict, index = sample_psys_mblur(ob, scene, psys, index, start, current_total)
-
-            # Add current particle system to the collection.
-            all_duplis.update(dupli_dict)
-
-    if not ob_mblur_enabled(ob, scene):
-        # If no motion blur
-        ob.dupli_list_clear()
-    return all_duplis
-
-
-def sample_psys_mblur(ob, scene, psys, index, start, current_total):
-    """
-    Return a dictionary of
-    particle: [dupli.object, [matrices]]
-    pairs
-    """
-    asr_scn = scene.appleseed
-    dupli_dict = {}
-    frame_orig = scene.frame_current
-    frame_set = scene.frame_set
-
-    frame_set(frame_orig, subframe=asr_scn.shutter_open)
-    if psys.settings.type == 'EMITTER':
-        particles = [p for p in psys.particles if p.alive_state == 'ALIVE']
-    else:
-        particles = [p for p in psys.particles]
-    if len(particles) == 0:
-        return False
-
-    if psys.settings.type == 'EMITTER':
-        # Emitter particle system.
-        ob.dupli_list_create(scene, 'RENDER')
-        duplis = [dupli.object for dupli in ob.dupli_list]
-        p_duplis_pairs = list(zip(particles, duplis))
-        dupli_dict = {p[0]: [p[1], []] for p in p_duplis_pairs}
-        new_index = index
-        for frame in {asr_scn.shutter_open, asr_scn.shutter_close}:
-            new_index = index
-            frame_set(frame_orig, subframe=frame)
-            for particle in dupli_dict.keys():
-                size = particle.size
-                transl = particle.location
-                scale = dupli_dict[particle][0].scale * size
-                transl = mathutils.Matrix.Translation((transl))
-                scale = mathutils.Matrix.Scale(scale.x, 4, (1, 0, 0)) * mathutils.Matrix.Scale(scale.y, 4,
-                                                                                               (0, 1, 0)) * mathutils.Matrix.Scale(scale.z, 4,
-                                                                                                                                   (0, 0, 1))
-                mat = transl * scale
-                dupli_dict[particle][1].append(mat)
-                new_index += 1
-        index += new_index
-    else:
-        # Hair particle system.
-        duplis = []
-        ob.dupli_list_create(scene, 'RENDER')
-        for dupli_index in range(start, current_total):
-            duplis.append(ob.dupli_list[dupli_index].object)
-        p_duplis_pairs = list(zip(particles, duplis))
-        dupli_dict = {p[0]: [p[1], []] for p in p_duplis_pairs}
-        ob.dupli_list_clear()
-        new_index = index
-        for frame in {asr_scn.shutter_open, asr_scn.shutter_close}:
-            new_index = index
-            frame_set(frame_orig, subframe=frame)
-            ob.dupli_list_create(scene, 'RENDER')
-            for particle in dupli_dict.keys():
-                mat = ob.dupli_list[new_index].matrix.copy()
-                dupli_dict[particle][1].append(mat)
-                new_index += 1
-            ob.dupli_list_clear()
-        index += new_index
-
-    # Clean up and return
-    if psys.settings.type == 'EMITTER':
-        del scale, transl, mat
-        ob.dupli_list_clear()
-    frame_set(frame_orig)
-    return dupli_dict, index